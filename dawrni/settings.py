@@ -86,6 +86,42 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The default cache holds the profile versions of dawrni_app.accounts and
+# the unread notification counts, 'responses' the rendered company
+# responses. Writes invalidate cached values only in the cache they reach:
+# with a per-process backend such as locmem, every other worker keeps what
+# it cached until the entry's timeout runs out, so the timeouts of
+# DAWRNI_RESPONSE_CACHE, DAWRNI_NOTIFICATIONS, DAWRNI_TOKEN_CACHE and
+# dawrni_app.accounts stay short. Point an alias at memcached, redis or
+# DatabaseCache (FileBasedCache on a single host) to share it instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dawrni',
+    },
+    # Rendered company list and detail responses.
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dawrni-responses',
+    },
+    # Shared by every worker through the database; holds the verify
+    # lockouts. The table is created by migration 0049 (or
+    # manage.py createcachetable).
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'dawrni_cache',
+    },
+}
+
+DAWRNI_RESPONSE_CACHE = {
+    'CACHE': 'responses',
+    'TIMEOUT': 60,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -104,6 +140,43 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# New passwords are hashed with scrypt; PBKDF2 hashes of existing users
+# still verify and are rehashed with scrypt on their next login. Move
+# dawrni_app.passwords.Argon2PasswordHasher first once argon2-cffi is
+# installed to switch to Argon2 the same way.
+PASSWORD_HASHERS = [
+    'dawrni_app.passwords.ScryptPasswordHasher',
+    'dawrni_app.passwords.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+AUTHENTICATION_BACKENDS = ['dawrni_app.passwords.PooledModelBackend']
+
+# Hashing costs and the per-process pool verifying passwords (see
+# dawrni_app/passwords.py).
+DAWRNI_PASSWORDS = {
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    'WORKERS': 4,
+    'QUEUE_TIMEOUT': 5,
+}
+
+# Token buckets of login and verify per IP and per email, kept in the
+# database, and the verify lockout, kept in the CACHE alias (see
+# dawrni_app/throttling.py). Both are shared between workers.
+DAWRNI_THROTTLE = {
+    'CACHE': 'shared',
+    'RATES': {
+        'login.ip': '30/min',
+        'login.email': '10/hour',
+        'verify.ip': '30/min',
+        'verify.email': '10/hour',
+    },
+    'VERIFY_FAILURES': 5,
+    'VERIFY_WINDOW': 15 * 60,
+    'VERIFY_LOCKOUT': 15 * 60,
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -123,6 +196,23 @@ USE_TZ = True
 STATIC_URL = 'static/'
 import os
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
+
+# Uploads, served by dawrni_app.media.serve under MEDIA_URL. Both must stay
+# set: the media route matches every path below MEDIA_URL.
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = '/media/'
+
+# Uploads are stored once per distinct content under blobs/, see
+# dawrni_app.storage.ContentAddressedStorage.
+STORAGES = {
+    'default': {
+        'BACKEND': 'dawrni_app.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -130,14 +220,71 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'knox.auth.TokenAuthentication',
+        'dawrni_app.authentication.CachedTokenAuthentication',
+    ],
+    # FastJSONRenderer uses orjson when installed and JSONRenderer otherwise.
+    'DEFAULT_RENDERER_CLASSES': [
+        'dawrni_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # Reverse proxies in front of the app, whose X-Forwarded-For entries
+    # the throttles trust. With 0 they key on REMOTE_ADDR; left unset, DRF
+    # would key on the whole client-supplied header. Set it to 1 behind a
+    # single nginx.
+    'NUM_PROXIES': 0,
     
     
 }
 
+# Authenticated knox tokens are cached per process by digest (see the note
+# on CACHES); set SHARED_CACHE to a CACHES alias to share them.
+DAWRNI_TOKEN_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TIMEOUT': 5,
+    'SHARED_CACHE': None,
+}
+
+# Knox tokens per user (older ones are dropped at login) and the batch
+# size of manage.py prune_tokens, which deletes expired tokens.
+DAWRNI_TOKENS = {
+    'MAX_PER_USER': 10,
+    'BATCH_SIZE': 1000,
+}
+
+# Media is served by dawrni_app.media.serve; set HANDOFF to 'x-accel-redirect'
+# or 'x-sendfile' when a front proxy can send the files itself.
+DAWRNI_MEDIA = {
+    'HANDOFF': None,
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+    'MAX_AGE': 60 * 60,
+}
+
+# Appointment event streams (api/events/). They need the ASGI server
+# (gunicorn.conf.py runs dawrni.asgi on uvicorn workers) and answer 501
+# under WSGI. The in-process broker only reaches streams held by the same
+# process; point BROKER at another dawrni_app.events.Broker to fan out
+# across processes.
+DAWRNI_EVENTS = {
+    'BROKER': 'dawrni_app.events.InProcessBroker',
+    'KEEPALIVE': 15,
+    'MAX_STREAM_SECONDS': 300,
+}
+
+# Notification inbox (api/notifications/). Unread counts are cached in the
+# default cache and dropped whenever the user's notifications change (see
+# the note on CACHES).
+DAWRNI_NOTIFICATIONS = {
+    'BATCH_SIZE': 500,
+    'UNREAD_TIMEOUT': 60,
+}
+
+# Threads generating image variants after uploads; set IMAGE_PROCESSING_SYNC
+# to generate them in the request once the transaction commits instead.
+IMAGE_PROCESSING_WORKERS = 2
+IMAGE_PROCESSING_SYNC = False
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
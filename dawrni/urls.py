@@ -15,15 +15,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
-from dawrni_app import views
+from dawrni_app import media, views
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('dawrni_app.urls')),
-    path('policy/', views.test, name='privacy_policy')
-
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('policy/', views.test, name='privacy_policy'),
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media.serve),
+]
\ No newline at end of file
@@ -0,0 +1,91 @@
+import time
+
+from django.core.cache import cache
+
+from .models import Client, Company, custom_user
+
+
+# Company and Client profiles are cached in the default cache under a
+# per-user version that signals bump; see the note on CACHES in settings
+# for why the lifetime stays short with per-process caches. Cached profiles
+# are for reads only: views that save one load it with the *_for_update()
+# helpers, which always read the row.
+CACHE_TIMEOUT = 60
+MISSING = object()
+
+
+def version_key(user_id):
+    return f'dawrni:profile-version:{user_id}'
+
+
+def invalidate(user_id):
+    """Drop every cached profile of the user by moving to a new version."""
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        # Nothing has been cached for this user yet.
+        pass
+
+
+def resolve(request, kind, load, shared=True):
+    """Profile object of the authenticated user, looked up once per request.
+
+    With shared, the result (including "none") is also cached across
+    requests under the user's current profile version, which signals bump
+    whenever the custom_user, Company or Client of that user changes.
+    """
+    profiles = getattr(request, '_dawrni_profiles', None)
+    if profiles is None:
+        profiles = request._dawrni_profiles = {}
+    if kind in profiles:
+        return profiles[kind]
+
+    user = request.user
+    if not user.is_authenticated:
+        value = None
+    elif not shared:
+        value = load(user)
+    else:
+        # Versions start from the clock so that an evicted version key can
+        # never come back as a number that older entries were stored under.
+        version = cache.get_or_set(version_key(user.pk), time.time_ns, None)
+        key = f'dawrni:profile:{user.pk}:{kind}:{version}'
+        value = cache.get(key, MISSING)
+        if value is MISSING:
+            value = load(user)
+            cache.set(key, value, CACHE_TIMEOUT)
+    profiles[kind] = value
+    return value
+
+
+def get_custom_user(request):
+    # Not cached across requests: is_verified changes through verify(), and
+    # a stale copy in another worker would report the old state.
+    user = resolve(request, 'custom_user', lambda user: custom_user.objects.filter(pk=user.pk).first(), shared=False)
+    if user is None:
+        raise custom_user.DoesNotExist('User has no custom_user profile')
+    return user
+
+
+def get_company(request):
+    company = resolve(request, 'company', lambda user: Company.objects.filter(user_id=user.pk).first())
+    if company is None:
+        raise Company.DoesNotExist('User is not associated with any company')
+    return company
+
+
+def get_client(request):
+    client = resolve(request, 'client', lambda user: Client.objects.filter(user_id=user.pk).first())
+    if client is None:
+        raise Client.DoesNotExist('User is not associated with any client')
+    return client
+
+
+def get_company_for_update(request):
+    """The user's Company read from the database, for views that save it."""
+    return Company.objects.get(user_id=request.user.pk)
+
+
+def get_client_for_update(request):
+    """The user's Client read from the database, for views that save it."""
+    return Client.objects.get(user_id=request.user.pk)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Company, Client, Notification, Category, CompanyPhoto, custom_user, Favorite, Appointment
+from .models import Company, Client, Notification, Category, CompanyPhoto, custom_user, Favorite, Appointment, WorkingHours, OutboxEmail
 
 # Register your models here.
 admin.site.register(Company)
@@ -10,3 +10,5 @@ admin.site.register(CompanyPhoto)
 admin.site.register(custom_user)
 admin.site.register(Favorite)
 admin.site.register(Appointment)
+admin.site.register(WorkingHours)
+admin.site.register(OutboxEmail)
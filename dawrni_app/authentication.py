@@ -0,0 +1,142 @@
+import binascii
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.settings import knox_settings
+from rest_framework import exceptions
+
+
+DEFAULTS = {
+    # Entries kept in each process.
+    'MAX_ENTRIES': 1024,
+    # Upper bound on how long a token is trusted without a database check,
+    # and so on how long other workers accept a token logged out or
+    # deactivated elsewhere (see the note on CACHES in settings).
+    'TIMEOUT': 5,
+    # Cache alias shared between processes, or None for in-process only.
+    'SHARED_CACHE': None,
+}
+
+
+def token_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_TOKEN_CACHE', {})}
+
+
+class TokenCache:
+    """Authenticated (user, token) pairs keyed by token digest.
+
+    A bounded LRU in front of an optional shared Django cache. Entries are
+    stored pickled so every request gets its own model instances.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, digest):
+        return f'dawrni:token:{digest}'
+
+    def get(self, digest):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None:
+                expires, user_id, payload = entry
+                if expires > now:
+                    self.entries.move_to_end(digest)
+                    return pickle.loads(payload)
+                del self.entries[digest]
+
+        alias = token_cache_settings()['SHARED_CACHE']
+        if alias is None:
+            return None
+        payload = caches[alias].get(self.key(digest))
+        if payload is None:
+            return None
+        user, auth_token = pickle.loads(payload)
+        self.store_local(digest, user.pk, payload, self.timeout(auth_token))
+        return user, auth_token
+
+    def timeout(self, auth_token):
+        timeout = token_cache_settings()['TIMEOUT']
+        if auth_token.expiry is not None:
+            timeout = min(timeout, (auth_token.expiry - timezone.now()).total_seconds())
+        return timeout
+
+    def set(self, digest, user, auth_token):
+        timeout = self.timeout(auth_token)
+        if timeout <= 0:
+            return
+        payload = pickle.dumps((user, auth_token))
+        self.store_local(digest, user.pk, payload, timeout)
+        alias = token_cache_settings()['SHARED_CACHE']
+        if alias is not None:
+            caches[alias].set(self.key(digest), payload, timeout)
+
+    def store_local(self, digest, user_id, payload, timeout):
+        max_entries = token_cache_settings()['MAX_ENTRIES']
+        with self.lock:
+            self.entries[digest] = (time.monotonic() + timeout, user_id, payload)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, digest):
+        with self.lock:
+            self.entries.pop(digest, None)
+        alias = token_cache_settings()['SHARED_CACHE']
+        if alias is not None:
+            caches[alias].delete(self.key(digest))
+
+    def delete_user(self, user_id):
+        """Evict the user's tokens from this process, e.g. after deactivation."""
+        with self.lock:
+            for digest in [digest for digest, entry in self.entries.items() if entry[1] == user_id]:
+                del self.entries[digest]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Knox token authentication that skips the token query for known tokens.
+
+    Tokens are looked up by their digest in token_cache, so a hit costs the
+    hash and no query. Deleting an AuthToken (logout, logout all, expiry
+    cleanup) evicts it through a post_delete signal; the timeout bounds how
+    long another process may keep trusting a token deleted elsewhere, so
+    the cache saves the lookups of request bursts rather than of sessions.
+    """
+
+    def authenticate_credentials(self, token):
+        if knox_settings.AUTO_REFRESH:
+            # Refreshing the expiry needs the database row on every request.
+            return super().authenticate_credentials(token)
+
+        try:
+            digest = hash_token(token.decode('utf-8'))
+        except (TypeError, binascii.Error, UnicodeDecodeError):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        cached = token_cache.get(digest)
+        if cached is not None:
+            user, auth_token = cached
+            if auth_token.expiry is None or auth_token.expiry > timezone.now():
+                return self.validate_user(auth_token)
+            token_cache.delete(digest)
+
+        user, auth_token = super().authenticate_credentials(token)
+        token_cache.set(digest, user, auth_token)
+        return user, auth_token
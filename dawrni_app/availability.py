@@ -0,0 +1,250 @@
+import datetime
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Appointment
+
+
+BOOKING_ATTEMPTS = 3
+# Largest number of items a bulk booking or status change may carry.
+MAX_BATCH = 100
+
+
+class InvalidSlot(Exception):
+    pass
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+class BatchRejected(Exception):
+    """A bulk operation was rolled back; results say which items failed."""
+
+    def __init__(self, results, conflict=False):
+        super().__init__('Batch rejected')
+        self.results = results
+        self.conflict = conflict
+
+
+def slot_times(company, date, working_hours=None):
+    """Start times of the company's slots on date, from its working hours."""
+    if working_hours is None:
+        working_hours = company.working_hours.filter(weekday=date.weekday())
+    length = datetime.timedelta(minutes=company.slot_minutes)
+    if length <= datetime.timedelta(0):
+        # Rows saved before slot_minutes was validated; a zero length would
+        # never reach the closing time.
+        return []
+    times = []
+    for hours in sorted(working_hours, key=lambda hours: hours.opens_at):
+        start = datetime.datetime.combine(date, hours.opens_at)
+        end = datetime.datetime.combine(date, hours.closes_at)
+        while start + length <= end:
+            times.append(start.time())
+            start += length
+    return times
+
+
+def booked_counts(company, date):
+    """Active appointments per start time on date, in one grouped query."""
+    rows = (
+        Appointment.objects.filter(company=company, date=date)
+        .exclude(status='canceled')
+        .values('time')
+        .annotate(booked=Count('id'))
+        .order_by()
+    )
+    return {row['time']: row['booked'] for row in rows}
+
+
+def slots(company, date):
+    booked = booked_counts(company, date)
+    return [
+        {
+            'time': time,
+            'capacity': company.slot_capacity,
+            'available': max(company.slot_capacity - booked.get(time, 0), 0),
+        }
+        for time in slot_times(company, date)
+    ]
+
+
+def check_bookable(company, date, time, working_hours=None):
+    if date < timezone.localdate():
+        raise InvalidSlot('Cannot book an appointment in the past')
+    # Companies that have not set up working hours keep accepting any time.
+    if working_hours is None:
+        working_hours = list(company.working_hours.all())
+    if not working_hours:
+        return
+    todays_hours = [hours for hours in working_hours if hours.weekday == date.weekday()]
+    if time not in slot_times(company, date, todays_hours):
+        raise InvalidSlot('The company has no slot at this time')
+
+
+def free_seat(company, date, time, exclude=None):
+    taken = Appointment.objects.select_for_update().filter(
+        company=company, date=date, time=time,
+    ).exclude(status='canceled')
+    if exclude is not None:
+        taken = taken.exclude(pk=exclude.pk)
+    taken = set(taken.values_list('seat', flat=True))
+    for seat in range(company.slot_capacity):
+        if seat not in taken:
+            return seat
+    raise SlotUnavailable('This slot is fully booked')
+
+
+def book(client, company, date, time):
+    """Create an appointment in the first free seat of the slot.
+
+    The seat is part of a unique constraint over active appointments, so
+    two concurrent bookings of the last seat cannot both commit; the loser
+    retries against the new state and gets SlotUnavailable once full.
+    """
+    check_bookable(company, date, time)
+    for attempt in range(BOOKING_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                seat = free_seat(company, date, time)
+                return Appointment.objects.create(
+                    client=client, company=company, date=date, time=time, seat=seat,
+                )
+        except IntegrityError:
+            continue
+    raise SlotUnavailable('This slot is fully booked')
+
+
+def change_status(appointment, new_status):
+    """Set the status, taking a seat again when a canceled booking is restored."""
+    restoring = appointment.status == 'canceled' and new_status != 'canceled'
+    for attempt in range(BOOKING_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                if restoring:
+                    appointment.seat = free_seat(
+                        appointment.company, appointment.date, appointment.time, exclude=appointment,
+                    )
+                appointment.status = new_status
+                appointment.save(update_fields=['status', 'seat'])
+                return appointment
+        except IntegrityError:
+            continue
+    raise SlotUnavailable('This slot is fully booked')
+
+
+def retrying(operation):
+    """Run operation in a transaction, again if a concurrent booking took
+    one of its seats first."""
+    for attempt in range(BOOKING_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return operation()
+        except IntegrityError:
+            continue
+    raise SlotUnavailable('This slot is fully booked')
+
+
+def book_many(client, company, slots):
+    """Book several (date, time) slots with the company, all or none.
+
+    The company's working hours are read once, the taken seats of every
+    requested slot are locked in one query and the appointments are
+    inserted with one bulk INSERT. Raises BatchRejected with per-item
+    results when any slot is invalid or full.
+    """
+    working_hours = list(company.working_hours.all())
+    results = []
+    for date, time in slots:
+        try:
+            check_bookable(company, date, time, working_hours)
+        except InvalidSlot as e:
+            results.append({'date': date, 'time': time, 'result': 'invalid', 'error': str(e)})
+        else:
+            results.append({'date': date, 'time': time, 'result': 'booked'})
+    if any(result['result'] != 'booked' for result in results):
+        raise BatchRejected(results)
+
+    def insert():
+        taken = defaultdict(set)
+        rows = Appointment.objects.select_for_update().filter(
+            company=company, date__in={date for date, time in slots}, time__in={time for date, time in slots},
+        ).exclude(status='canceled').values_list('date', 'time', 'seat')
+        for date, time, seat in rows:
+            taken[date, time].add(seat)
+
+        appointments = []
+        for result, (date, time) in zip(results, slots):
+            seat = next((seat for seat in range(company.slot_capacity) if seat not in taken[date, time]), None)
+            if seat is None:
+                result.update(result='unavailable', error='This slot is fully booked')
+                continue
+            taken[date, time].add(seat)
+            appointments.append(Appointment(client=client, company=company, date=date, time=time, seat=seat))
+        if len(appointments) < len(slots):
+            raise BatchRejected(results, conflict=True)
+
+        appointments = Appointment.objects.bulk_create(appointments)
+        for result, appointment in zip(results, appointments):
+            result['id'] = appointment.pk
+        return results
+
+    return retrying(insert)
+
+
+def change_statuses(company, changes):
+    """Apply (appointment id, status) changes of one company, all or none.
+
+    Ownership and current statuses come from one locking query, and the
+    changes are written with one UPDATE per target status. Restoring a
+    canceled appointment needs a free seat, so those are seated one by
+    one after the cancellations of the batch are applied. Raises
+    BatchRejected with per-item results when an appointment is not the
+    company's or no seat is left.
+    """
+    def apply():
+        ids = [appointment_id for appointment_id, new_status in changes]
+        current = {
+            row['id']: row
+            for row in Appointment.objects.select_for_update()
+            .filter(company=company, id__in=ids)
+            .values('id', 'status', 'date', 'time')
+        }
+        results = []
+        by_status = defaultdict(list)
+        restores = []
+        for appointment_id, new_status in changes:
+            row = current.get(appointment_id)
+            if row is None:
+                results.append({'id': appointment_id, 'result': 'not_found'})
+            elif row['status'] == new_status:
+                results.append({'id': appointment_id, 'status': new_status, 'result': 'unchanged'})
+            else:
+                if row['status'] == 'canceled':
+                    restores.append((len(results), row, new_status))
+                else:
+                    by_status[new_status].append(appointment_id)
+                results.append({'id': appointment_id, 'status': new_status, 'result': 'updated'})
+        if any(result['result'] == 'not_found' for result in results):
+            raise BatchRejected(results)
+
+        for new_status, status_ids in by_status.items():
+            Appointment.objects.filter(pk__in=status_ids).update(status=new_status)
+        conflict = False
+        for index, row, new_status in restores:
+            try:
+                seat = free_seat(company, row['date'], row['time'], exclude=Appointment(pk=row['id']))
+            except SlotUnavailable as e:
+                results[index].update(result='unavailable', error=str(e))
+                conflict = True
+                continue
+            Appointment.objects.filter(pk=row['id']).update(status=new_status, seat=seat)
+        if conflict:
+            raise BatchRejected(results, conflict=True)
+        return results
+
+    return retrying(apply)
@@ -0,0 +1,88 @@
+import json
+
+from django.core.files.storage import default_storage
+
+from . import images
+from .models import Company, CompanyCard
+from .serializers import COMPANY_COMPACT_FIELDS, CompanySerializer, favorite_company_ids
+
+
+LANGUAGES = ('en', 'ar')
+# Company fields that CompanySerializer does not render.
+UNRENDERED_FIELDS = {'geohash', 'slot_minutes', 'slot_capacity'}
+
+
+def is_listable(company):
+    """Python side of models.LISTABLE."""
+    return (
+        company.name_en is not None
+        and company.category_id is not None
+        and bool(company.address_en)
+        and bool(company.about_en)
+    )
+
+
+def render(company, language):
+    data = CompanySerializer(company, context={'request': None, 'language': language}).data
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def card_values(company):
+    values = {
+        'category_id': company.category_id,
+        'is_listable': is_listable(company),
+        'thumbnail': images.thumbnail_name(company),
+    }
+    for language in LANGUAGES:
+        values[f'json_{language}'] = render(company, language)
+    return values
+
+
+def refresh(company_id):
+    """Rebuild the card of one company, or drop it if the company is gone."""
+    company = Company.objects.select_related('user').prefetch_related('photos').filter(pk=company_id).first()
+    if company is None:
+        CompanyCard.objects.filter(pk=company_id).delete()
+        return
+    CompanyCard.objects.update_or_create(company_id=company_id, defaults=card_values(company))
+
+
+def rebuild():
+    count = 0
+    for company_id in Company.objects.values_list('pk', flat=True).iterator():
+        refresh(company_id)
+        count += 1
+    CompanyCard.objects.exclude(company__in=Company.objects.all()).delete()
+    return count
+
+
+def listing(language, category_id=None):
+    cards = CompanyCard.objects.filter(is_listable=True)
+    if category_id is not None:
+        cards = cards.filter(category_id=category_id)
+    return cards.only('company_id', f'json_{language}', 'thumbnail')
+
+
+def render_page(request, cards, language, compact=False):
+    """Turn a page of cards into response items.
+
+    The stored fragments are joined and decoded in one pass; only the
+    absolute URLs and the requester's favorites are filled in per request.
+    """
+    items = json.loads('[' + ','.join(getattr(card, f'json_{language}') for card in cards) + ']')
+    favorites = favorite_company_ids(request)
+    build_url = request.build_absolute_uri
+    results = []
+    for card, item in zip(cards, items):
+        if compact:
+            item['thumbnail'] = build_url(default_storage.url(card.thumbnail)) if card.thumbnail else None
+            results.append({field: item[field] for field in COMPANY_COMPACT_FIELDS})
+            continue
+        if item['image'] is not None:
+            item['image'] = build_url(item['image'])
+        item['image_variants'] = {
+            variant: build_url(url) if url is not None else None for variant, url in item['image_variants'].items()
+        }
+        item['is_favorite'] = item['id'] in favorites
+        results.append(item)
+    return results
@@ -0,0 +1,219 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+DEFAULTS = {
+    # Dotted path of the Broker class; the in-process one only reaches
+    # streams served by the same process.
+    'BROKER': 'dawrni_app.events.InProcessBroker',
+    # Events kept per channel for clients reconnecting with Last-Event-ID.
+    'HISTORY': 50,
+    # Channels whose history is kept, least recently used dropped first.
+    'MAX_CHANNELS': 10000,
+    # Events buffered per open stream before the oldest are dropped.
+    'QUEUE_SIZE': 100,
+    # Seconds between comments that keep idle connections open.
+    'KEEPALIVE': 15,
+    # Streams end after this many seconds and the client reconnects.
+    'MAX_STREAM_SECONDS': 300,
+}
+
+broker = None
+broker_lock = threading.Lock()
+
+
+def events_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_EVENTS', {})}
+
+
+class Subscription:
+    """Events of one channel for one open stream, read on its event loop."""
+
+    def __init__(self, broker, channel, loop, queue_size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+
+    def deliver(self, event):
+        """Hand an event over from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self.put, event)
+        except RuntimeError:
+            # The stream's loop is gone.
+            self.close()
+
+    def put(self, event):
+        if self.queue.full():
+            # A stalled client loses its oldest events rather than memory.
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Pub/sub interface behind the event streams.
+
+    publish() is called from request threads after commit; subscribe() from
+    the async stream view, returning a Subscription that yields the events
+    published to the channel from then on, preceded by those after
+    last_event_id when the broker keeps history.
+    """
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channel, last_event_id=None):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+    def __init__(self):
+        options = events_settings()
+        self.history_size = options['HISTORY']
+        self.max_channels = options['MAX_CHANNELS']
+        self.queue_size = options['QUEUE_SIZE']
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.subscribers = {}
+        self.history = OrderedDict()
+
+    def publish(self, channel, event):
+        with self.lock:
+            event = {'id': next(self.ids), **event}
+            history = self.history.get(channel)
+            if history is None:
+                history = self.history[channel] = deque(maxlen=self.history_size)
+                while len(self.history) > self.max_channels:
+                    self.history.popitem(last=False)
+            self.history.move_to_end(channel)
+            history.append(event)
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, channel, last_event_id=None):
+        subscription = Subscription(self, channel, asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+            missed = [] if last_event_id is None else [
+                event for event in self.history.get(channel, ()) if event['id'] > last_event_id
+            ]
+        for event in missed:
+            subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+
+def get_broker():
+    global broker
+    with broker_lock:
+        if broker is None:
+            broker = import_string(events_settings()['BROKER'])()
+    return broker
+
+
+def client_channel(client_id):
+    return f'client:{client_id}'
+
+
+def company_channel(company_id):
+    return f'company:{company_id}'
+
+
+def appointment_row(appointment):
+    return {
+        'id': appointment.pk,
+        'client_id': appointment.client_id,
+        'company_id': appointment.company_id,
+        'date': appointment.date,
+        'time': appointment.time,
+        'status': appointment.status,
+    }
+
+
+def publish_appointments(kind, rows):
+    """Push appointment events to the client and company of each row once
+    the current transaction commits.
+
+    kind is 'created', 'status' or 'deleted'; rows are appointment_row()
+    dicts (or .values() rows with the same keys).
+    """
+    events = []
+    for row in rows:
+        event = {
+            'type': f'appointment.{kind}',
+            'appointment': {
+                'id': row['id'],
+                'company': row['company_id'],
+                'client': row['client_id'],
+                'date': str(row['date']),
+                'time': str(row['time']),
+                'status': row['status'],
+            },
+        }
+        events.append((client_channel(row['client_id']), event))
+        events.append((company_channel(row['company_id']), event))
+
+    def publish():
+        target = get_broker()
+        for channel, event in events:
+            target.publish(channel, event)
+
+    if events:
+        transaction.on_commit(publish)
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+async def stream(channel, last_event_id=None):
+    """Server-sent event body of one channel.
+
+    Subscribes when the body is first read, so events are handed to the
+    event loop that consumes it. Sends a comment every KEEPALIVE seconds
+    so proxies keep the connection open, and ends after
+    MAX_STREAM_SECONDS; the client then reconnects with Last-Event-ID and
+    gets what it missed from the broker's history.
+    """
+    options = events_settings()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + options['MAX_STREAM_SECONDS']
+    subscription = get_broker().subscribe(channel, last_event_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(subscription.get(), min(options['KEEPALIVE'], remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        subscription.close()
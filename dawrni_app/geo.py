@@ -0,0 +1,123 @@
+import math
+
+from django.db.models import Q
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def encode(lat, lng, precision=PRECISION):
+    """Geohash of a point; neighbouring points share a common prefix."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_range[0] = mid
+            else:
+                value <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(lat, lng) size in degrees of a geohash cell of the given precision."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in kilometres."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, min_lng, max_lat, max_lng) enclosing the circle around a point.
+
+    Longitudes are not wrapped, so min_lng < -180 or max_lng > 180 means the
+    box crosses the antimeridian.
+    """
+    d_lat = radius_km / KM_PER_DEGREE
+    d_lng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return (
+        max(lat - d_lat, -90.0),
+        lng - d_lng,
+        min(lat + d_lat, 90.0),
+        lng + d_lng,
+    )
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng):
+    """Geohash prefixes whose cells together cover the bounding box.
+
+    The precision is the finest one whose cells are still at least as large
+    as the box, so the box never touches more than four cells.
+    """
+    height = max_lat - min_lat
+    width = max_lng - min_lng
+    precision = 1
+    for candidate in range(PRECISION, 0, -1):
+        cell_lat, cell_lng = cell_size(candidate)
+        if cell_lat >= height and cell_lng >= width:
+            precision = candidate
+            break
+
+    cell_lat, cell_lng = cell_size(precision)
+    columns = round(360.0 / cell_lng)
+    cells = set()
+    row = math.floor((min_lat + 90.0) / cell_lat)
+    while row * cell_lat - 90.0 <= max_lat and row * cell_lat < 180.0:
+        column = math.floor((min_lng + 180.0) / cell_lng)
+        while column * cell_lng - 180.0 <= max_lng:
+            center_lat = (row + 0.5) * cell_lat - 90.0
+            center_lng = ((column % columns) + 0.5) * cell_lng - 180.0
+            cells.add(encode(center_lat, center_lng, precision))
+            column += 1
+        row += 1
+    return sorted(cells)
+
+
+def nearby_filter(lat, lng, radius_km):
+    """Indexable prefilter for rows within radius_km of a point.
+
+    Each covering cell becomes a range scan on the geohash index; the plain
+    lat/lng box then trims the corners of the cells.
+    """
+    min_lat, min_lng, max_lat, max_lng = bounding_box(lat, lng, radius_km)
+    cells = Q()
+    for prefix in covering_cells(min_lat, min_lng, max_lat, max_lng):
+        cells |= Q(geohash__gte=prefix, geohash__lt=prefix + '~')
+    condition = cells & Q(lat__range=(min_lat, max_lat))
+    if min_lng >= -180.0 and max_lng <= 180.0:
+        condition &= Q(lng__range=(min_lng, max_lng))
+    return condition
@@ -0,0 +1,170 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils.translation import gettext as _
+from PIL import Image, ImageOps, features
+from rest_framework import serializers
+
+
+logger = logging.getLogger(__name__)
+
+# Longest edge, in pixels, of each generated variant.
+VARIANTS = {
+    'full': 1600,
+    'medium': 800,
+    'thumb': 200,
+}
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_EDGE = 8000
+MAX_PIXELS = 40_000_000
+QUALITY = 80
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def validate_upload(upload):
+    """Reject oversized uploads from the image header, before any decoding."""
+    if upload is None:
+        return upload
+    if upload.size > MAX_UPLOAD_BYTES:
+        raise serializers.ValidationError(
+            _('Image files must be smaller than %(size)d MB.') % {'size': MAX_UPLOAD_BYTES // (1024 * 1024)}
+        )
+    position = upload.tell()
+    try:
+        with Image.open(upload) as image:
+            width, height = image.size
+    except Exception:
+        raise serializers.ValidationError(_('Upload a valid image.'))
+    finally:
+        upload.seek(position)
+    if max(width, height) > MAX_EDGE or width * height > MAX_PIXELS:
+        raise serializers.ValidationError(
+            _('Images must be at most %(edge)d pixels on each side.') % {'edge': MAX_EDGE}
+        )
+    return upload
+
+
+def output_format():
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def render_variants(storage, name):
+    """Decode the stored image once and save each variant next to it.
+
+    Variants are produced from the largest to the smallest, each one
+    downscaled from the previous, and the returned dict maps variant names
+    to storage names, plus the source name they were made from.
+    """
+    image_format, extension = output_format()
+    with storage.open(name) as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    variants = {'source': name}
+    for variant, edge in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, quality=QUALITY)
+        target = os.path.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+        variants[variant] = storage.save(target, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_variants(storage, variants):
+    for variant, name in variants.items():
+        if variant != 'source':
+            storage.delete(name)
+
+
+def process(model, pk, field_name, variants_field):
+    """Generate variants for one instance; runs in the worker pool."""
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None:
+            return
+        field = getattr(instance, field_name)
+        if not field or getattr(instance, variants_field).get('source') == field.name:
+            return
+        variants = render_variants(field.storage, field.name)
+
+        # The image may have been replaced while we were working.
+        current = model.objects.filter(pk=pk).values_list(field_name, flat=True).first()
+        if current != field.name:
+            delete_variants(field.storage, variants)
+            return
+        delete_variants(field.storage, getattr(instance, variants_field))
+        setattr(instance, variants_field, variants)
+        instance.save(update_fields=[variants_field])
+    except Exception:
+        logger.exception('Could not generate variants for %s %s', model.__name__, pk)
+
+
+def process_in_worker(*args):
+    try:
+        process(*args)
+    finally:
+        # Worker threads hold their own database connections.
+        connections.close_all()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+                thread_name_prefix='dawrni-images',
+            )
+    return executor
+
+
+def schedule(instance, field_name, variants_field):
+    """Queue variant generation once the upload's transaction commits."""
+    args = (type(instance), instance.pk, field_name, variants_field)
+    if getattr(settings, 'IMAGE_PROCESSING_SYNC', False):
+        transaction.on_commit(lambda: process(*args))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(process_in_worker, *args))
+
+
+def variant_urls(variants, build_url=None):
+    urls = {}
+    for variant in VARIANTS:
+        name = variants.get(variant) if variants else None
+        if name:
+            url = default_storage.url(name)
+            urls[variant] = build_url(url) if build_url else url
+        else:
+            urls[variant] = None
+    return urls
+
+
+def thumbnail_name(company):
+    """Storage name of the image a compact listing shows for a company.
+
+    The thumb variant of the company image, else of its first photo,
+    falling back to the originals until their variants are generated.
+    """
+    if company.image:
+        return company.image_variants.get('thumb') or company.image.name
+    photo = min(company.photos.all(), key=lambda photo: photo.pk, default=None)
+    if photo is not None:
+        return photo.variants.get('thumb') or photo.image.name
+    return ''
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views.static import serve as static_serve
+
+from dawrni_app import media
+
+
+class Command(BaseCommand):
+    help = "Compare media serving throughput of static() and dawrni_app.media.serve."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--size', type=int, default=256 * 1024, help="Size in bytes of the served file.")
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'bench.png'), 'wb') as handle:
+                handle.write(os.urandom(options['size']))
+            with override_settings(MEDIA_ROOT=root):
+                self.run(options['requests'], options['size'])
+        finally:
+            shutil.rmtree(root)
+
+    def run(self, count, size):
+        factory = RequestFactory()
+        full = factory.get('/bench.png')
+        etag = media.serve(full, 'bench.png')['ETag']
+        cases = [
+            ('static() full file', lambda: static_serve(full, 'bench.png', document_root=settings.MEDIA_ROOT)),
+            ('serve full file', lambda: media.serve(full, 'bench.png')),
+            ('serve 304 revalidation', lambda: media.serve(factory.get('/bench.png', HTTP_IF_NONE_MATCH=etag), 'bench.png')),
+            ('serve 64 KiB range', lambda: media.serve(factory.get('/bench.png', HTTP_RANGE='bytes=0-65535'), 'bench.png')),
+        ]
+        for label, view in cases:
+            transferred = 0
+            started = time.perf_counter()
+            for _ in range(count):
+                response = view()
+                for chunk in response:
+                    transferred += len(chunk)
+                response.close()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{label:<24} {count / elapsed:10.0f} req/s {transferred / elapsed / 2 ** 20:10.1f} MiB/s"
+            )
+
+        with override_settings(DAWRNI_MEDIA={'HANDOFF': 'x-accel-redirect'}):
+            started = time.perf_counter()
+            for _ in range(count):
+                media.serve(full, 'bench.png').close()
+            elapsed = time.perf_counter() - started
+        self.stdout.write(f"{'serve x-accel handoff':<24} {count / elapsed:10.0f} req/s")
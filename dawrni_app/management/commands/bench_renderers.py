@@ -0,0 +1,39 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from dawrni_app import rows
+from dawrni_app.models import Appointment, Company
+from dawrni_app.renderers import FastJSONRenderer
+from dawrni_app.serializers import CompanySerializer
+
+from . import bench_serializers
+
+
+class Command(bench_serializers.Command):
+    help = "Compare render time of JSONRenderer and FastJSONRenderer on large company and appointment pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help="Companies (and appointments) per page.")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def run(self, client, repeat):
+        request = APIRequestFactory().get('/api/', HTTP_ACCEPT_LANGUAGE='ar')
+        request.user = client.user
+        companies = Company.objects.filter(category__name='Benchmark').prefetch_related('photos').order_by('id')
+        pages = [
+            ('companies (ar)', {'next': None, 'results': CompanySerializer(
+                companies, many=True, context={'request': request},
+            ).data}),
+            ('appointments (ar)', {'next': None, 'results': rows.serialize(
+                rows.APPOINTMENT, Appointment.objects.filter(client=client).order_by('id'), request,
+            )}),
+        ]
+        for label, page in pages:
+            before, expected = self.measure(repeat, lambda: JSONRenderer().render(page))
+            after, rendered = self.measure(repeat, lambda: FastJSONRenderer().render(page))
+            self.stdout.write(
+                f"{label:<18} {len(expected) / 2 ** 10:8.0f} KiB   JSONRenderer {before * 1000:8.2f} ms   "
+                f"FastJSONRenderer {after * 1000:8.2f} ms   x{before / after:.1f}   identical={expected == rendered}"
+            )
@@ -0,0 +1,102 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from dawrni_app import rows
+from dawrni_app.models import Appointment, Category, Client, Company, CompanyPhoto, Favorite, custom_user
+from dawrni_app.serializers import AppointmentSerializer, FavoriteSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of the DRF serializers and dawrni_app.rows on appointments and favorites."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help="Appointments (and favorites) to seed.")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # The seeded data never outlives the run.
+        try:
+            with transaction.atomic():
+                client = self.seed(options['rows'])
+                self.run(client, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        category = Category.objects.create(name='Benchmark')
+        user = custom_user.objects.create(username='bench-client@example.com', email='bench-client@example.com')
+        client = Client.objects.create(user=user, email=user.email, name_en='Client', name_ar='عميل')
+        companies = []
+        for index in range(count):
+            owner = custom_user.objects.create(
+                username=f'bench-company{index}@example.com', email=f'bench-company{index}@example.com',
+            )
+            companies.append(Company(
+                user=owner, category=category, name_en=f'Company {index}', name_ar=f'شركة {index}',
+                address_en='Address', address_ar='عنوان', about_en='About', about_ar='حول',
+                image=f'companies/{index}.png', image_variants={'thumb': f'companies/{index}_thumb.webp'},
+                lat=30.0, lng=31.0,
+            ))
+        companies = Company.objects.bulk_create(companies)
+        CompanyPhoto.objects.bulk_create(
+            CompanyPhoto(company=company, image=f'photos/{company.pk}-{photo}.png')
+            for company in companies for photo in range(2)
+        )
+        date = datetime.date.today()
+        Appointment.objects.bulk_create(
+            Appointment(client=client, company=company, date=date, time=datetime.time(9)) for company in companies
+        )
+        Favorite.objects.bulk_create(Favorite(client=client, company=company) for company in companies)
+        return client
+
+    def run(self, client, repeat):
+        factory = APIRequestFactory()
+
+        def make_request():
+            # A new request per run, so favorites and profiles are loaded
+            # again as they would be for a real request.
+            request = factory.get('/api/')
+            request.user = client.user
+            return request
+
+        cases = [
+            ('appointments', Appointment.objects.filter(client=client).order_by('id'),
+             AppointmentSerializer, rows.APPOINTMENT, ['client', 'company'], ['company__photos']),
+            ('favorites', Favorite.objects.filter(client=client).order_by('id'),
+             FavoriteSerializer, rows.FAVORITE, ['company'], ['company__photos']),
+        ]
+        renderer = JSONRenderer()
+        for label, queryset, serializer_class, shape, related, prefetch in cases:
+            drf_queryset = queryset.select_related(*related).prefetch_related(*prefetch)
+            before = self.measure(repeat, lambda: serializer_class(
+                drf_queryset.all(), many=True, context={'request': make_request()},
+            ).data)
+            after = self.measure(repeat, lambda: rows.serialize(shape, queryset, make_request()))
+            same = renderer.render(before[1]) == renderer.render(after[1])
+            count = len(after[1])
+            self.stdout.write(
+                f"{label:<14} serializer {count / before[0]:10.0f} rows/s   "
+                f"rows {count / after[0]:10.0f} rows/s   x{before[0] / after[0]:.1f}   "
+                f"identical={same}"
+            )
+
+    @staticmethod
+    def measure(repeat, render):
+        """Best wall time of repeat runs, queries included, and the last output."""
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, data
@@ -0,0 +1,61 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dawrni_app.models import MediaBlob
+from dawrni_app.signals import FILE_FIELDS, IMAGE_FIELDS
+from dawrni_app.storage import is_blob
+
+
+class Command(BaseCommand):
+    help = "Move files uploaded before content-addressed storage into shared blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be moved.")
+
+    def handle(self, *args, **options):
+        moved = freed = 0
+        blobs = set()
+        for model, field_name in FILE_FIELDS.items():
+            variants_field = IMAGE_FIELDS.get(model, (None, None))[1]
+            columns = ['pk', field_name] + ([variants_field] if variants_field else [])
+            rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for row in rows.values(*columns).iterator():
+                name = row[field_name]
+                if is_blob(name):
+                    continue
+                if not default_storage.exists(name):
+                    self.stderr.write(f"{model.__name__} {row['pk']}: {name} is missing, skipped.")
+                    continue
+                size = default_storage.size(name)
+                moved += 1
+                if options['dry_run']:
+                    continue
+
+                with default_storage.open(name) as content:
+                    blob = default_storage.save(name, content)
+                changes = {field_name: blob}
+                if variants_field and row[variants_field].get('source') == name:
+                    changes[variants_field] = {**row[variants_field], 'source': blob}
+                with transaction.atomic():
+                    instance = model.objects.filter(pk=row['pk']).first()
+                    if instance is None:
+                        # Deleted meanwhile; drop the reference just taken.
+                        default_storage.delete(blob)
+                        continue
+                    for field, value in changes.items():
+                        setattr(instance, field, value)
+                    # Saved rather than updated so the post_save handlers
+                    # rebuild company cards and drop cached responses and
+                    # profiles that still name the old file.
+                    instance.save(update_fields=list(changes))
+                    default_storage.delete(name)
+                # The content was already stored, so this copy was a duplicate.
+                if MediaBlob.objects.filter(name=blob, references__gt=1).exists():
+                    freed += size
+                blobs.add(blob)
+
+        if options['dry_run']:
+            self.stdout.write(f"Would move {moved} file(s).")
+        else:
+            self.stdout.write(f"Moved {moved} file(s) into {len(blobs)} blob(s), {freed} bytes freed.")
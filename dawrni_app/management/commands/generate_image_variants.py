@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from dawrni_app import images
+from dawrni_app.signals import IMAGE_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Generate missing image variants for images uploaded before the pipeline existed."
+
+    def handle(self, *args, **options):
+        for model, (field_name, variants_field) in IMAGE_FIELDS.items():
+            pending = model.objects.exclude(**{field_name: ''}).exclude(**{field_name: None})
+            count = 0
+            for pk in pending.values_list('pk', flat=True).iterator():
+                images.process(model, pk, field_name, variants_field)
+                count += 1
+            self.stdout.write(f"Checked {count} {model.__name__} image(s).")
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dawrni_app import tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired knox tokens in batches and report the token table size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=tokens.token_settings()['BATCH_SIZE'])
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep deleting tokens as they expire instead of exiting once none are left.",
+        )
+        parser.add_argument('--interval', type=float, default=60 * 5, help="Seconds between passes with --loop.")
+        parser.add_argument(
+            '--compact', action='store_true',
+            help="Return the freed space to the database afterwards (VACUUM; on SQLite the whole file).",
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            # A batch of 0 would never come back short and never end the pass.
+            raise CommandError('--batch-size must be at least 1.')
+        while True:
+            rows_before, size_before = tokens.table_size()
+            deleted = 0
+            started = time.perf_counter()
+            while True:
+                batch = tokens.prune_expired(options['batch_size'])
+                deleted += batch
+                if batch < options['batch_size']:
+                    break
+            elapsed = time.perf_counter() - started
+            if options['compact'] and deleted:
+                tokens.compact()
+            if deleted or not options['loop']:
+                rows_after, size_after = tokens.table_size()
+                self.stdout.write(
+                    f"Deleted {deleted} expired token(s) in {elapsed:.2f}s "
+                    f"({deleted / elapsed if elapsed else 0:.0f}/s). "
+                    f"Token table: {rows_before} -> {rows_after} rows"
+                    + (f", {size_before} -> {size_after} bytes." if size_after is not None else ".")
+                )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
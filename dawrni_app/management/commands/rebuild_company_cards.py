@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from dawrni_app import cards
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed company listing cards from the company tables."
+
+    def handle(self, *args, **options):
+        count = cards.rebuild()
+        self.stdout.write(f"Rebuilt {count} company card(s).")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dawrni_app import outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued emails from the outbox in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep polling for new messages instead of exiting once the outbox is drained.",
+        )
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent_total = failed_total = 0
+            while True:
+                sent, failed = outbox.drain(options['batch_size'])
+                sent_total += sent
+                failed_total += failed
+                if sent + failed < options['batch_size']:
+                    break
+            if sent_total or failed_total or not options['loop']:
+                self.stdout.write(f"Sent {sent_total} email(s), {failed_total} failed.")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
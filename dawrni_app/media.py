@@ -0,0 +1,165 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+from .storage import is_blob
+
+
+DEFAULTS = {
+    # None to stream files from Django, or 'x-accel-redirect' (nginx) or
+    # 'x-sendfile' (Apache, lighttpd) to hand them to the front proxy.
+    'HANDOFF': None,
+    # Internal nginx location aliased to MEDIA_ROOT, for x-accel-redirect.
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+    # Browser cache lifetime of files that may change under the same name.
+    'MAX_AGE': 60 * 60,
+}
+
+# Blob names change whenever their content does, so they can be cached forever.
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_MEDIA', {})}
+
+
+def etag_for(path, stat):
+    if is_blob(path):
+        # The name is the SHA-256 of the content.
+        return '"%s"' % posixpath.splitext(posixpath.basename(path))[0]
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def parse_range(header, size):
+    """(start, end) of a single byte range, None to send the whole file, or
+    False when the range cannot be satisfied.
+
+    Multiple ranges are answered with the whole file, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def range_applies(request, etag, last_modified):
+    """If-Range: only serve a range of the representation the client has."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def read_range(handle, start, length):
+    with handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve(request, path):
+    """Serve a file from MEDIA_ROOT with validators, ranges and caching.
+
+    Responses carry an ETag and Last-Modified so clients revalidate with a
+    304, and byte ranges are honored for a single range. With a HANDOFF
+    mode the view only resolves the file and its headers and lets the
+    front proxy send the bytes.
+    """
+    if not settings.MEDIA_ROOT:
+        # Never fall back to the working directory: it holds the settings
+        # and the database.
+        raise ImproperlyConfigured('MEDIA_ROOT must be set to serve media.')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    options = media_settings()
+    etag = etag_for(path, stat)
+    last_modified = stat.st_mtime
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        handoff = options['HANDOFF']
+        if handoff == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = options['ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' + quote(path)
+        elif handoff == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = file_response(request, full_path, stat.st_size, content_type, etag, last_modified)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+    if is_blob(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=options['MAX_AGE'])
+    return response
+
+
+def file_response(request, full_path, size, content_type, etag, last_modified):
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and range_applies(request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(size)
+    elif byte_range is None:
+        # FileResponse lets the WSGI server use its file wrapper (sendfile).
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            read_range(open(full_path, 'rb'), start, length), status=206, content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+lock = threading.Lock()
+counters = {}
+observations = {}
+
+
+def increment(name, amount=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    """Record one sample (a duration in seconds, a ratio...) of name."""
+    with lock:
+        stats = observations.get(name)
+        if stats is None:
+            stats = observations[name] = {'count': 0, 'total': 0.0, 'max': value}
+        stats['count'] += 1
+        stats['total'] += value
+        stats['max'] = max(stats['max'], value)
+    logger.debug('%s %.6f', name, value)
+
+
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def snapshot():
+    """Counters and sample aggregates of this process since start (or reset)."""
+    with lock:
+        return {
+            'counters': dict(counters),
+            'observations': {
+                name: {**stats, 'mean': stats['total'] / stats['count']} for name, stats in observations.items()
+            },
+        }
+
+
+def reset():
+    with lock:
+        counters.clear()
+        observations.clear()
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9
+
+
+def encode(lat, lng):
+    # Frozen copy of dawrni_app.geo.encode at 9 characters, so this
+    # migration keeps producing the same hashes whatever geo becomes.
+    ranges = {True: [-180.0, 180.0], False: [-90.0, 90.0]}
+    chars = []
+    bits = value = 0
+    even = True
+    while len(chars) < PRECISION:
+        bounds = ranges[even]
+        mid = (bounds[0] + bounds[1]) / 2
+        coordinate = lng if even else lat
+        if coordinate >= mid:
+            value = (value << 1) | 1
+            bounds[0] = mid
+        else:
+            value <<= 1
+            bounds[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def populate_geohash(apps, schema_editor):
+    Company = apps.get_model('dawrni_app', 'Company')
+    companies = Company.objects.filter(lat__isnull=False, lng__isnull=False)
+    for company in companies.only('id', 'lat', 'lng'):
+        company.geohash = encode(company.lat, company.lng)
+        company.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0034_company_is_favorite'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
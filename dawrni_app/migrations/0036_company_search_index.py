@@ -0,0 +1,72 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+# Frozen copies of the dawrni_app.search index definition and text folding
+# as of this migration, so it builds the same index whatever search becomes.
+TABLE = 'dawrni_app_company_search'
+DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+FOLDING = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    'ى': 'ي',
+    'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+
+def normalize(text):
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text)
+    text = DIACRITICS.sub('', text)
+    return text.translate(FOLDING).casefold()
+
+
+def document(company):
+    return (
+        normalize(' '.join(filter(None, (company.name_ar, company.name_en)))),
+        normalize(' '.join(filter(None, (company.address_ar, company.address_en)))),
+        normalize(' '.join(filter(None, (company.about_ar, company.about_en)))),
+    )
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Company = apps.get_model('dawrni_app', 'Company')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "name, address, about, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        for company in Company.objects.all():
+            cursor.execute(
+                f'INSERT INTO {TABLE} (rowid, name, address, about) VALUES (%s, %s, %s, %s)',
+                [company.pk, *document(company)],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0035_company_geohash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
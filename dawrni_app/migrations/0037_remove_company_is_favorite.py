@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:03
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0036_company_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='company',
+            name='is_favorite',
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_seats(apps, schema_editor):
+    # Existing double bookings of the same slot get distinct seats so the
+    # unique constraint can be created.
+    Appointment = apps.get_model('dawrni_app', 'Appointment')
+    seats = {}
+    active = Appointment.objects.exclude(status='canceled').order_by('id')
+    for appointment in active.only('id', 'company_id', 'date', 'time'):
+        key = (appointment.company_id, appointment.date, appointment.time)
+        seat = seats.get(key, 0)
+        seats[key] = seat + 1
+        if seat:
+            appointment.seat = seat
+            appointment.save(update_fields=['seat'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0037_remove_company_is_favorite'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkingHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')], verbose_name='Weekday')),
+                ('opens_at', models.TimeField(verbose_name='Opens At')),
+                ('closes_at', models.TimeField(verbose_name='Closes At')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='seat',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Seat'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='slot_capacity',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='Appointments per Slot'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=30, verbose_name='Slot Length (minutes)'),
+        ),
+        migrations.RunPython(assign_seats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'canceled'), _negated=True), fields=('company', 'date', 'time', 'seat'), name='unique_active_appointment_seat'),
+        ),
+        migrations.AddField(
+            model_name='workinghours',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='working_hours', to='dawrni_app.company'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0038_availability'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['company', 'date', 'time'], name='appointment_company_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'status', 'date'], name='appointment_client_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['company', 'status', 'date'], name='appointment_company_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(condition=models.Q(('about_en__gt', ''), ('address_en__gt', ''), ('category__isnull', False), ('name_en__isnull', False)), fields=['id'], name='company_listable_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(condition=models.Q(('about_en__gt', ''), ('address_en__gt', ''), ('category__isnull', False), ('name_en__isnull', False)), fields=['category', 'id'], name='company_listable_category_idx'),
+        ),
+    ]
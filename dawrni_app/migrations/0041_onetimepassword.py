@@ -0,0 +1,61 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:09
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.utils.crypto import salted_hmac
+
+
+# Frozen copies of dawrni_app.otp.hash_code and TTL as of this migration.
+TTL = datetime.timedelta(minutes=10)
+
+
+def hash_code(user_id, code):
+    return salted_hmac('dawrni_app.otp', f'{user_id}:{code}', algorithm='sha256').hexdigest()
+
+
+def move_pending_codes(apps, schema_editor):
+    # Codes used to be stored in clear text in User.first_name.
+    custom_user = apps.get_model('dawrni_app', 'custom_user')
+    OneTimePassword = apps.get_model('dawrni_app', 'OneTimePassword')
+    User = apps.get_model('auth', 'User')
+    now = django.utils.timezone.now()
+    pending = custom_user.objects.exclude(is_verified=True).exclude(first_name='')
+    codes = []
+    for user in pending.only('pk', 'email', 'first_name'):
+        if user.first_name.isdigit():
+            codes.append(OneTimePassword(
+                user_id=user.pk,
+                email=user.email,
+                code_hash=hash_code(user.pk, user.first_name),
+                expires_at=now + TTL,
+                sent_at=now,
+            ))
+    OneTimePassword.objects.bulk_create(codes)
+    User.objects.filter(pk__in=[code.user_id for code in codes]).update(first_name='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('dawrni_app', '0040_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OneTimePassword',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='otp', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('email', models.EmailField(db_index=True, max_length=254)),
+                ('code_hash', models.CharField(max_length=64)),
+                ('expires_at', models.DateTimeField()),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(move_pending_codes, migrations.RunPython.noop),
+    ]
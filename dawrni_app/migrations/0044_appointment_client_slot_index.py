@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0043_mediablob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'date', 'time'], name='appointment_client_slot_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Cards are rendered by today's dawrni_app.cards, which needs today's
+# models, so this migration only creates the table. The post_migrate
+# handler in dawrni_app.signals renders the missing cards once every
+# migration has run; manage.py rebuild_company_cards renders them all.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0044_appointment_client_slot_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyCard',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='dawrni_app.company')),
+                ('is_listable', models.BooleanField(default=False)),
+                ('thumbnail', models.CharField(blank=True, default='', max_length=255)),
+                ('json_en', models.TextField()),
+                ('json_ar', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dawrni_app.category')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('is_listable', True)), fields=['company'], name='card_listable_idx'), models.Index(condition=models.Q(('is_listable', True)), fields=['category', 'company'], name='card_listable_category_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index knox's token expiry so prune_tokens picks each batch of expired
+    tokens with a range scan instead of reading the whole table."""
+
+    dependencies = [
+        ('dawrni_app', '0046_notification_inbox'),
+        ('knox', '0008_remove_authtoken_salt'),
+    ]
+
+    operations = [
+        # knox owns the table, and its model and migrations are not ours to
+        # change, so the index is created here. IF [NOT] EXISTS keeps this
+        # safe where the index was added by hand or a later knox release
+        # ships one under the same name.
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS knox_authtoken_expiry_idx ON knox_authtoken (expiry)',
+            'DROP INDEX IF EXISTS knox_authtoken_expiry_idx',
+        ),
+    ]
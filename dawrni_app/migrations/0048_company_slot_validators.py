@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:46
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def clamp_slots(apps, schema_editor):
+    Company = apps.get_model('dawrni_app', 'Company')
+    Company.objects.filter(slot_minutes__lt=5).update(slot_minutes=5)
+    Company.objects.filter(slot_minutes__gt=24 * 60).update(slot_minutes=24 * 60)
+    Company.objects.filter(slot_capacity__lt=1).update(slot_capacity=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0047_authtoken_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='slot_capacity',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Appointments per Slot'),
+        ),
+        migrations.AlterField(
+            model_name='company',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(1440)], verbose_name='Slot Length (minutes)'),
+        ),
+        migrations.RunPython(clamp_slots, migrations.RunPython.noop),
+    ]
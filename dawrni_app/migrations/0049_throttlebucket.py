@@ -0,0 +1,29 @@
+# Generated by Django 4.2.6 on 2026-10-18 13:00
+
+from django.core.management import call_command
+from django.db import migrations, models
+
+
+def create_cache_table(apps, schema_editor):
+    # The shared DatabaseCache of settings.CACHES; skips existing tables.
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0048_company_slot_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('tokens', models.FloatField()),
+                ('updated', models.FloatField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dawrni_app', '0049_throttlebucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='message',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='params',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,9 +1,24 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from . import geo
 
-class custom_user(User):
+
+class AtomicSaveMixin:
+    """Save in a transaction, so the blob references ContentAddressedStorage
+    takes while saving file fields roll back with a failed save."""
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+
+class custom_user(AtomicSaveMixin, User):
     TYPE_CHOICES = (
         ('company', 'Company'),
         ('user', 'User'),
@@ -21,7 +36,53 @@ class Category(models.Model):
         return self.name
 
 
-class Company(models.Model):
+# Companies with a complete enough profile to be shown publicly.
+LISTABLE = Q(
+    name_en__isnull=False,
+    category__isnull=False,
+    address_en__gt='',
+    about_en__gt='',
+)
+
+
+class CompanyQuerySet(models.QuerySet):
+    def listable(self):
+        return self.filter(LISTABLE)
+
+    def for_listing(self, language='en', fields=None):
+        # Everything CompanySerializer renders, loaded in a fixed number of
+        # queries: the user join for the username, the photos in one
+        # prefetch, and only the text columns of the requested language.
+        # With fields (CompanySerializer keys) only what those need is
+        # loaded, and the join and prefetch are skipped when not asked for.
+        suffix = 'ar' if language == 'ar' else 'en'
+        columns = {
+            'category': ['category_id'],
+            'name': [f'name_{suffix}'],
+            'address': [f'address_{suffix}'],
+            'about': [f'about_{suffix}'],
+            'is_certified': ['is_certified'],
+            'user': ['user__username'],
+            'image': ['image'],
+            'image_variants': ['image_variants'],
+            'thumbnail': ['image', 'image_variants'],
+            'lat': ['lat'],
+            'lng': ['lng'],
+        }
+        if fields is None:
+            fields = list(columns) + ['photos']
+        queryset = self.only('id', *{column for field in fields for column in columns.get(field, [])})
+        if 'user' in fields:
+            queryset = queryset.select_related('user')
+        if 'photos' in fields or 'thumbnail' in fields:
+            # The thumbnail falls back to the first photo.
+            queryset = queryset.prefetch_related(
+                models.Prefetch('photos', queryset=CompanyPhoto.objects.only('id', 'company_id', 'image', 'variants')),
+            )
+        return queryset
+
+
+class Company(AtomicSaveMixin, models.Model):
     user = models.ForeignKey(custom_user, on_delete=models.CASCADE)
     name_ar = models.CharField(max_length=255, verbose_name=_("Name (Arabic)"), null=True, blank=True)
     name_en = models.CharField(max_length=255, verbose_name=_("Name (English)"), null=True, blank=True)
@@ -32,21 +93,97 @@ class Company(models.Model):
     about_ar = models.TextField(verbose_name=_("About (Arabic)"), null=True, blank=True)
     about_en = models.TextField(verbose_name=_("About (English)"), null=True, blank=True)
     image = models.ImageField(upload_to='user_images/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     lat = models.FloatField(null=True, blank=True, verbose_name=_("Latitude"))
     lng = models.FloatField(null=True, blank=True, verbose_name=_("Longitude"))
-    is_favorite = models.BooleanField(default=False, verbose_name=_("Is Favorite"))
+    geohash = models.CharField(max_length=12, null=True, blank=True, editable=False, db_index=True)
+    slot_minutes = models.PositiveSmallIntegerField(
+        default=30, validators=[MinValueValidator(5), MaxValueValidator(24 * 60)],
+        verbose_name=_("Slot Length (minutes)"),
+    )
+    slot_capacity = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1)], verbose_name=_("Appointments per Slot"),
+    )
+
+    objects = CompanyQuerySet.as_manager()
+
+    class Meta:
+        # Partial indexes over exactly the rows CompanyQuerySet.listable()
+        # returns, so the public listing never scans incomplete profiles:
+        # one walks the listing in id order, the other serves ?category=.
+        indexes = [
+            models.Index(fields=['id'], name='company_listable_idx', condition=LISTABLE),
+            models.Index(fields=['category', 'id'], name='company_listable_category_idx', condition=LISTABLE),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the spatial index column in step with the coordinates.
+        if self.lat is not None and self.lng is not None:
+            self.geohash = geo.encode(self.lat, self.lng)
+        else:
+            self.geohash = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'lat', 'lng'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
 
 
     # def __str__(self):
     #     return self.name_en
 
 
-class Client(models.Model):
+class CompanyCard(models.Model):
+    """Denormalized listing row of a company, kept current by signals.
+
+    Holds the company as CompanySerializer renders it for each language,
+    with host-relative URLs and is_favorite false, so the listing reads
+    one table and only fills in the per-request parts.
+    """
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    is_listable = models.BooleanField(default=False)
+    # Storage name of the thumbnail shown by compact listings.
+    thumbnail = models.CharField(max_length=255, blank=True, default='')
+    json_en = models.TextField()
+    json_ar = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company'], name='card_listable_idx', condition=Q(is_listable=True)),
+            models.Index(
+                fields=['category', 'company'], name='card_listable_category_idx', condition=Q(is_listable=True),
+            ),
+        ]
+
+
+class WorkingHours(models.Model):
+    WEEKDAY_CHOICES = [
+        (0, _('Monday')),
+        (1, _('Tuesday')),
+        (2, _('Wednesday')),
+        (3, _('Thursday')),
+        (4, _('Friday')),
+        (5, _('Saturday')),
+        (6, _('Sunday')),
+    ]
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='working_hours')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES, verbose_name=_("Weekday"))
+    opens_at = models.TimeField(verbose_name=_("Opens At"))
+    closes_at = models.TimeField(verbose_name=_("Closes At"))
+
+    def __str__(self):
+        return f"{self.get_weekday_display()} {self.opens_at}-{self.closes_at}"
+
+
+class Client(AtomicSaveMixin, models.Model):
     user = models.ForeignKey(custom_user, on_delete=models.CASCADE)
     name_en = models.CharField(max_length=255, null=True, blank=True)
     name_ar = models.CharField(max_length=255, null=True, blank=True)
     email = models.EmailField(max_length=255) 
     photo = models.ImageField(upload_to='client_photos/', null=True, blank=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     favorites = models.ManyToManyField(Company, through='Favorite', related_name='favorited_by')
 
     # def __str__(self):
@@ -72,6 +209,25 @@ class Appointment(models.Model):
     date = models.DateField(verbose_name=_("Appointment Date"))
     time = models.TimeField(verbose_name=_("Appointment Time"))
     status = models.CharField(max_length=20, choices=APPOINTMENT_STATUS_CHOICES, default='pending')
+    seat = models.PositiveSmallIntegerField(default=0, verbose_name=_("Seat"))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'date', 'time'], name='appointment_company_slot_idx'),
+            # Keyset pages of a client's appointments, in (date, time, id) order.
+            models.Index(fields=['client', 'date', 'time'], name='appointment_client_slot_idx'),
+            models.Index(fields=['client', 'status', 'date'], name='appointment_client_status_idx'),
+            models.Index(fields=['company', 'status', 'date'], name='appointment_company_status_idx'),
+        ]
+        constraints = [
+            # A slot holds at most slot_capacity active appointments, one per
+            # seat; canceled appointments give their seat back.
+            models.UniqueConstraint(
+                fields=['company', 'date', 'time', 'seat'],
+                condition=~Q(status='canceled'),
+                name='unique_active_appointment_seat',
+            ),
+        ]
 
     def __str__(self):
         return f"Appointment #{self.id} - {self.client.name_en} with {self.company.name_en}"
@@ -81,11 +237,88 @@ class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)  
     body = models.TextField()
-    
+    # Key into notifications.MESSAGES and its params; when set, title and
+    # body are rendered again in the reader's language.
+    message = models.CharField(max_length=64, blank=True, default='')
+    params = models.JSONField(default=dict, blank=True)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # The inbox pages newest first by id.
+            models.Index(fields=['user', '-id'], name='notification_inbox_idx'),
+            models.Index(fields=['user'], condition=Q(is_read=False), name='notification_unread_idx'),
+        ]
+
     def __str__(self):
-        return self.name    
+        return self.title
 
 
-class CompanyPhoto(models.Model):
+class CompanyPhoto(AtomicSaveMixin, models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='photos')
     image = models.ImageField(upload_to='company_photos/')
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+
+class MediaBlob(models.Model):
+    """Reference count of a file stored by ContentAddressedStorage."""
+    name = models.CharField(max_length=255, unique=True)
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+
+
+class OutboxEmail(models.Model):
+    STATUS_CHOICES = [
+        ('pending', _('Pending')),
+        ('sending', _('Sending')),
+        ('sent', _('Sent')),
+        ('failed', _('Failed')),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipient = models.EmailField(max_length=254)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When a pending message is due, or when a claimed one's lease runs out.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipient} ({self.status})"
+
+
+class OneTimePassword(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='otp')
+    email = models.EmailField(max_length=254, db_index=True)
+    code_hash = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"OTP for {self.email}"
+
+
+class ThrottleBucket(models.Model):
+    """Token bucket of dawrni_app.throttling, refilled on read."""
+    key = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    # Unix time of the last take, as a float.
+    updated = models.FloatField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.tokens:.2f})"
@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import translation
+from django.utils.translation import gettext, gettext_noop
+
+from .models import Client, Company, Notification
+
+
+DEFAULTS = {
+    # Rows per INSERT when writing a batch of notifications.
+    'BATCH_SIZE': 500,
+    # Lifetime of a cached unread count; writes drop it sooner (see the
+    # note on CACHES in settings).
+    'UNREAD_TIMEOUT': 60,
+}
+
+
+def notification_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_NOTIFICATIONS', {})}
+
+
+def unread_key(user_id):
+    return f'dawrni:notifications:unread:{user_id}'
+
+
+def unread_count(user_id):
+    """Unread notifications of the user, counted at most once per change."""
+    return cache.get_or_set(
+        unread_key(user_id),
+        lambda: Notification.objects.filter(user_id=user_id, is_read=False).count(),
+        notification_settings()['UNREAD_TIMEOUT'],
+    )
+
+
+def forget_unread(user_ids):
+    cache.delete_many([unread_key(user_id) for user_id in set(user_ids)])
+
+
+def write(notifications):
+    """Insert a batch of notifications and drop their users' unread counts."""
+    Notification.objects.bulk_create(notifications, batch_size=notification_settings()['BATCH_SIZE'])
+    forget_unread(notification.user_id for notification in notifications)
+
+
+def send(notifications):
+    """Queue notifications to be written together once the current
+    transaction commits, so a rolled back change notifies nobody."""
+    notifications = list(notifications)
+    if notifications:
+        transaction.on_commit(lambda: write(notifications))
+
+
+def mark_read(user_id, ids=None):
+    """Mark the user's notifications (all, or those in ids) as read."""
+    notifications = Notification.objects.filter(user_id=user_id, is_read=False)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+    updated = notifications.update(is_read=True)
+    if updated:
+        forget_unread([user_id])
+    return updated
+
+
+# Title and body of each message. Notifications store the message and its
+# params, and are rendered in the language of whoever reads them.
+MESSAGES = {
+    'appointment.created': (
+        gettext_noop('New appointment'),
+        gettext_noop('An appointment was booked for %(date)s at %(time)s.'),
+    ),
+    'appointment.deleted': (
+        gettext_noop('Appointment canceled'),
+        gettext_noop('The appointment of %(date)s at %(time)s was canceled.'),
+    ),
+    'appointment.status': (
+        gettext_noop('Appointment %(status)s'),
+        gettext_noop('Your appointment of %(date)s at %(time)s is %(status)s.'),
+    ),
+    'favorite': (
+        gettext_noop('New favorite'),
+        gettext_noop('%(name)s added you to their favorites.'),
+    ),
+}
+STATUS_LABELS = {
+    'pending': gettext_noop('pending'),
+    'confirmed': gettext_noop('confirmed'),
+    'canceled': gettext_noop('canceled'),
+}
+
+
+def render(message, params):
+    """(title, body) of a message in the active language."""
+    title, body = MESSAGES[message]
+    params = dict(params)
+    if 'status' in params:
+        params['status'] = gettext(STATUS_LABELS.get(params['status'], params['status']))
+    if 'name_en' in params:
+        params['name'] = params['name_ar'] if translation.get_language() == 'ar' else params['name_en']
+    return gettext(title) % params, gettext(body) % params
+
+
+def build(user_id, message, **params):
+    """A Notification of message. Its title and body hold the LANGUAGE_CODE
+    rendering for rows read without render()."""
+    with translation.override(settings.LANGUAGE_CODE):
+        title, body = render(message, params)
+    return Notification(user_id=user_id, message=message, params=params, title=title, body=body)
+
+
+def notify_appointments(kind, rows):
+    """Notify the other party of created, deleted or status-changed
+    appointments: the company when a client books or cancels, the client
+    when the company changes a status.
+
+    rows are events.appointment_row() dicts; the recipients of a whole
+    batch are looked up in one query.
+    """
+    if not rows:
+        return
+    if kind == 'status':
+        model, key = Client, 'client_id'
+    else:
+        model, key = Company, 'company_id'
+    users = dict(model.objects.filter(pk__in={row[key] for row in rows}).values_list('pk', 'user_id'))
+    notifications = []
+    for row in rows:
+        if users.get(row[key]) is None:
+            continue
+        params = {'date': str(row['date']), 'time': str(row['time'])[:5]}
+        if kind == 'status':
+            params['status'] = row['status']
+        notifications.append(build(users[row[key]], f'appointment.{kind}', **params))
+    send(notifications)
+
+
+def notify_favorite(client, company):
+    name = client.name_en or client.email
+    send([build(company.user_id, 'favorite', name_en=name, name_ar=client.name_ar or name)])
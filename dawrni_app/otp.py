@@ -0,0 +1,91 @@
+import secrets
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext as _
+
+from . import accounts
+from .models import OneTimePassword, custom_user
+
+
+TTL = timedelta(minutes=10)
+MAX_ATTEMPTS = 5
+RESEND_INTERVAL = timedelta(minutes=1)
+
+
+class OTPError(Exception):
+    pass
+
+
+class NoPendingCode(OTPError):
+    pass
+
+
+class CodeExpired(OTPError):
+    pass
+
+
+class TooManyAttempts(OTPError):
+    pass
+
+
+class InvalidCode(OTPError):
+    pass
+
+
+class ResendTooSoon(OTPError):
+    pass
+
+
+def hash_code(user_id, code):
+    return salted_hmac('dawrni_app.otp', f'{user_id}:{code}', algorithm='sha256').hexdigest()
+
+
+def issue(user):
+    """Create or replace the user's code and return it in clear text."""
+    now = timezone.now()
+    previous = OneTimePassword.objects.filter(pk=user.pk).values_list('sent_at', flat=True).first()
+    if previous is not None and now - previous < RESEND_INTERVAL:
+        raise ResendTooSoon(_('A code was sent recently, please wait before asking again.'))
+    code = str(secrets.randbelow(9000) + 1000)
+    OneTimePassword.objects.update_or_create(
+        user_id=user.pk,
+        defaults={
+            'email': user.email,
+            'code_hash': hash_code(user.pk, code),
+            'expires_at': now + TTL,
+            'attempts': 0,
+            'sent_at': now,
+        },
+    )
+    return code
+
+
+def verify(email, code):
+    """Check the code and mark the user verified.
+
+    One indexed lookup of the pending code, then one conditional UPDATE
+    that claims an attempt before the code is compared, so concurrent
+    guesses cannot get past MAX_ATTEMPTS; a right code costs one more
+    UPDATE of custom_user.is_verified. No rows are re-saved.
+    """
+    pending = OneTimePassword.objects.filter(email=email).first()
+    if pending is None:
+        raise NoPendingCode(_('There is no pending verification code for this email.'))
+    if pending.expires_at <= timezone.now():
+        raise CodeExpired(_('Verification code has expired.'))
+    claimed = OneTimePassword.objects.filter(pk=pending.pk, attempts__lt=MAX_ATTEMPTS).update(
+        attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        raise TooManyAttempts(_('Too many attempts, please ask for a new code.'))
+    if not constant_time_compare(pending.code_hash, hash_code(pending.user_id, code)):
+        raise InvalidCode(_('Invalid verification code.'))
+
+    user_id = pending.user_id
+    custom_user.objects.filter(pk=user_id).exclude(is_verified=True).update(is_verified=True)
+    pending.delete()
+    # The update bypasses signals, so drop the cached profile explicitly.
+    accounts.invalidate(user_id)
@@ -0,0 +1,113 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+# How long a worker owns the messages it claimed before others may retry them.
+LEASE = timedelta(minutes=5)
+
+
+def enqueue(subject, body, recipient, from_email=None):
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        recipient=recipient,
+        from_email=from_email or settings.EMAIL_HOST_USER,
+    )
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def claim(batch_size):
+    """Lease up to batch_size due messages to this worker.
+
+    Messages of a worker that died mid-batch become due again once their
+    lease expires.
+    """
+    now = timezone.now()
+    due = Q(status='pending') | Q(status='sending')
+    ids = list(
+        OutboxEmail.objects.filter(due, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # The due condition is repeated so a concurrent worker's claim wins.
+    OutboxEmail.objects.filter(due, id__in=ids, next_attempt_at__lte=now).update(
+        status='sending', claim=token, next_attempt_at=now + LEASE,
+    )
+    return list(OutboxEmail.objects.filter(claim=token, status='sending').order_by('id'))
+
+
+def fail(message, error):
+    attempts = message.attempts + 1
+    if attempts >= MAX_ATTEMPTS:
+        status = 'failed'
+        next_attempt_at = timezone.now()
+    else:
+        status = 'pending'
+        next_attempt_at = timezone.now() + backoff(attempts)
+    OutboxEmail.objects.filter(pk=message.pk).update(
+        status=status, attempts=F('attempts') + 1, next_attempt_at=next_attempt_at,
+        claim='', last_error=str(error),
+    )
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Send one batch of due messages over a single SMTP connection.
+
+    Returns (sent, failed) counts for the batch.
+    """
+    messages = claim(batch_size)
+    if not messages:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        logger.warning('Could not connect to the mail server: %s', error)
+        for message in messages:
+            fail(message, error)
+        return 0, len(messages)
+
+    sent_ids = []
+    failed = 0
+    try:
+        for message in messages:
+            email = EmailMessage(
+                message.subject, message.body, message.from_email, [message.recipient],
+                connection=connection,
+            )
+            try:
+                email.send()
+            except Exception as error:
+                logger.warning('Sending outbox email %s failed: %s', message.pk, error)
+                fail(message, error)
+                failed += 1
+            else:
+                sent_ids.append(message.pk)
+    finally:
+        connection.close()
+
+    OutboxEmail.objects.filter(pk__in=sent_ids).update(
+        status='sent', sent_at=timezone.now(), claim='', last_error='',
+    )
+    return len(sent_ids), failed
@@ -0,0 +1,138 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Seek pagination over a unique ordering instead of OFFSET.
+
+    The cursor holds the ordering values of the last row of the page and
+    the next page is fetched with a WHERE on them, so every page costs the
+    same index range scan however deep the client has scrolled. Views set
+    keyset_ordering, a tuple of fields ending in a unique one ('-' for
+    descending); the total is only counted when asked with ?count=true.
+
+    Requests with ?offset= are still answered as LimitOffsetPagination did,
+    with count and previous. That is deprecated and kept only until the
+    clients sending them have moved to the cursors.
+    """
+
+    ordering = ('id',)
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    offset_query_param = 'offset'
+    default_limit = 10
+    max_limit = 100
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def decode_cursor(self, request, queryset, ordering):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise ValueError
+            return [self.to_python(queryset, name, value) for name, value in zip(ordering, values)]
+        except (ValueError, TypeError, ValidationError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, ordering):
+        values = []
+        for name in ordering:
+            value = row
+            for attribute in name.lstrip('-').split('__'):
+                value = getattr(value, attribute)
+            values.append(value if isinstance(value, (int, float)) else str(value))
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    @staticmethod
+    def to_python(queryset, name, value):
+        name = name.lstrip('-')
+        if name in queryset.query.annotations:
+            # Annotations such as the search rank are plain numbers.
+            if not isinstance(value, (int, float)):
+                raise ValueError
+            return value
+        return queryset.model._meta.get_field(name).to_python(value)
+
+    @staticmethod
+    def seek_filter(ordering, values):
+        """Rows after values in ordering:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ..."""
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = self.get_ordering(view)
+        self.request = request
+        self.legacy = None
+        if self.offset_query_param in request.query_params:
+            self.legacy = LimitOffsetPagination()
+            self.legacy.default_limit = self.default_limit
+            self.legacy.max_limit = self.max_limit
+            return self.legacy.paginate_queryset(queryset.order_by(*ordering), request, view)
+
+        self.limit = self.get_limit(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.order_by().count()
+
+        queryset = queryset.order_by(*ordering)
+        after = self.decode_cursor(request, queryset, ordering)
+        if after is not None:
+            queryset = queryset.filter(self.seek_filter(ordering, after))
+
+        # One extra row tells whether there is a next page.
+        rows = list(queryset[:self.limit + 1])
+        page = rows[:self.limit]
+        self.next_cursor = self.encode_cursor(page[-1], ordering) if len(rows) > self.limit else None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        payload = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
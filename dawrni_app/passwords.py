@@ -0,0 +1,155 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from . import metrics
+from .models import custom_user
+
+
+DEFAULTS = {
+    # Cost of ScryptPasswordHasher; hashes of another cost are upgraded on
+    # the next login.
+    'SCRYPT_WORK_FACTOR': 2 ** 14,
+    'SCRYPT_BLOCK_SIZE': 8,
+    'SCRYPT_PARALLELISM': 1,
+    # Cost of Argon2PasswordHasher (needs argon2-cffi).
+    'ARGON2_TIME_COST': 2,
+    'ARGON2_MEMORY_COST': 102400,
+    'ARGON2_PARALLELISM': 8,
+    # Hashes computed at once per process. Hashing releases the GIL, so
+    # this bounds the CPU logins and registrations take.
+    'WORKERS': 4,
+    # Seconds a login or registration waits for a free worker before it is
+    # answered with a 503.
+    'QUEUE_TIMEOUT': 5,
+}
+
+pool = None
+pool_lock = threading.Lock()
+in_flight = 0
+
+
+def passwords_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_PASSWORDS', {})}
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """scrypt at the cost set in DAWRNI_PASSWORDS."""
+
+    @property
+    def work_factor(self):
+        return passwords_settings()['SCRYPT_WORK_FACTOR']
+
+    @property
+    def block_size(self):
+        return passwords_settings()['SCRYPT_BLOCK_SIZE']
+
+    @property
+    def parallelism(self):
+        return passwords_settings()['SCRYPT_PARALLELISM']
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2 at the cost set in DAWRNI_PASSWORDS."""
+
+    @property
+    def time_cost(self):
+        return passwords_settings()['ARGON2_TIME_COST']
+
+    @property
+    def memory_cost(self):
+        return passwords_settings()['ARGON2_MEMORY_COST']
+
+    @property
+    def parallelism(self):
+        return passwords_settings()['ARGON2_PARALLELISM']
+
+
+class Busy(Exception):
+    """No hashing worker became free within QUEUE_TIMEOUT."""
+
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool is None:
+            workers = passwords_settings()['WORKERS']
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dawrni-passwords')
+            pool = (executor, threading.BoundedSemaphore(workers), workers)
+    return pool
+
+
+def run(function, *args):
+    """function(*args) on a hashing worker, waiting at most QUEUE_TIMEOUT
+    for one to be free instead of queueing without bound."""
+    global in_flight
+    executor, slots, workers = get_pool()
+    started = time.perf_counter()
+    if not slots.acquire(timeout=passwords_settings()['QUEUE_TIMEOUT']):
+        metrics.increment('passwords.rejected')
+        raise Busy
+    metrics.observe('passwords.wait', time.perf_counter() - started)
+    try:
+        with pool_lock:
+            in_flight += 1
+            metrics.observe('passwords.occupancy', in_flight / workers)
+        with metrics.timer('passwords.hash'):
+            return executor.submit(function, *args).result()
+    finally:
+        with pool_lock:
+            in_flight -= 1
+        slots.release()
+
+
+def make_password(password):
+    return run(hashers.make_password, password)
+
+
+def needs_upgrade(encoded):
+    """Whether encoded was made by another hasher or cost than the preferred one."""
+    preferred = hashers.get_hasher('default')
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def check_password(user, password):
+    """Verify password on a hashing worker and upgrade the stored hash to
+    the preferred hasher and cost when it matches an outdated one."""
+    if not run(hashers.check_password, password, user.password):
+        return False
+    if needs_upgrade(user.password):
+        user.password = make_password(password)
+        user.save(update_fields=['password'])
+        metrics.increment('passwords.upgraded')
+    return True
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend hashing on the password workers.
+
+    Users are looked up as custom_user first, so the login view gets the
+    profile it returns without another query.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        lookup = {User.USERNAME_FIELD: username}
+        user = custom_user.objects.filter(**lookup).first() or User.objects.filter(**lookup).first()
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords.
+            make_password(password)
+            return None
+        if check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,41 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with orjson when it is installed.
+
+    The output matches JSONRenderer with the default UNICODE_JSON and
+    COMPACT_JSON settings: non-ASCII text such as name_ar is written as is
+    rather than escaped, and dates, times, datetimes, Decimals and the
+    other types DRF knows about go through its encoder_class, so they come
+    out exactly as before. Indented output (the browsable API, or
+    ?indent= in the Accept header), non-default settings, a missing orjson
+    and anything orjson refuses (integers over 64 bits) fall back to
+    JSONRenderer. Two known differences are harmless to clients:
+    orjson writes NaN and infinity as null where STRICT_JSON would fail
+    the response, and may format a float exponent differently (1e16 for
+    1e+16).
+    """
+
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        fast = (
+            orjson is not None and not self.ensure_ascii and self.compact
+            and not self.get_indent(accepted_media_type, renderer_context or {})
+        )
+        if not fast:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped like JSONRenderer does, for JavaScript's sake.
+        return rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
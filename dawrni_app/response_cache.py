@@ -0,0 +1,120 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.response import Response
+
+from .serializers import favorite_company_ids
+
+
+DEFAULTS = {
+    # CACHES alias holding the responses; see the note on CACHES in settings.
+    'CACHE': 'default',
+    'TIMEOUT': 60,
+}
+GENERATION_KEY = 'dawrni:companies:generation'
+
+
+def response_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[response_cache_settings()['CACHE']]
+
+
+def generation():
+    # Starts from the clock, like the profile versions in accounts.
+    return get_cache().get_or_set(GENERATION_KEY, time.time_ns, None)
+
+
+def invalidate():
+    """Retire every cached company response by moving to a new generation."""
+    try:
+        get_cache().incr(GENERATION_KEY)
+    except ValueError:
+        pass
+
+
+def cache_key(request, kind):
+    params = sorted((key, sorted(request.query_params.getlist(key))) for key in request.query_params)
+    language = 'ar' if request.META.get('HTTP_ACCEPT_LANGUAGE', 'en') == 'ar' else 'en'
+    # Responses hold absolute URLs, so the scheme and host are part of the key.
+    variant = json.dumps([request.scheme, request.get_host(), request.path, language, params])
+    digest = hashlib.sha256(variant.encode()).hexdigest()
+    return f'dawrni:companies:{generation()}:{kind}:{digest}'
+
+
+def companies_in(data):
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return data['results']
+    return [data]
+
+
+def without_favorites(data):
+    """The payload as an anonymous client sees it."""
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': [without_favorites(item) for item in data['results']]}
+    if isinstance(data, dict) and 'is_favorite' in data:
+        return {**data, 'is_favorite': False}
+    return data
+
+
+def with_favorites(request, data):
+    """Put the requesting client's favorites back into a cached payload."""
+    if not request.user.is_authenticated or not any('is_favorite' in item for item in companies_in(data)):
+        return data, ''
+    favorites = favorite_company_ids(request)
+    marked = []
+
+    def overlay(item):
+        if 'is_favorite' not in item:
+            return item
+        is_favorite = item['id'] in favorites
+        if is_favorite:
+            marked.append(item['id'])
+        return {**item, 'is_favorite': is_favorite}
+
+    if 'results' in data:
+        data = {**data, 'results': [overlay(item) for item in data['results']]}
+    else:
+        data = overlay(data)
+    return data, ','.join(map(str, marked))
+
+
+def cached_response(request, kind, build):
+    """Serve a company list or detail response from the response cache.
+
+    build() renders the response on a miss. Entries are shared by every
+    client sending the same query string and language; the is_favorite
+    flags of the requesting client are applied on the way out. Every
+    response carries a strong ETag and matching If-None-Match requests get
+    a 304 without touching the payload.
+    """
+    options = response_cache_settings()
+    key = cache_key(request, kind)
+    entry = get_cache().get(key)
+    if entry is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+        data = without_favorites(response.data)
+        encoded = json.dumps(data, sort_keys=True, default=str).encode()
+        entry = (hashlib.sha256(encoded).hexdigest(), data)
+        get_cache().set(key, entry, options['TIMEOUT'])
+
+    digest, data = entry
+    data, marked = with_favorites(request, data)
+    if marked:
+        digest = hashlib.sha256(f'{digest}:{marked}'.encode()).hexdigest()
+    etag = f'"{digest}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = Response(data)
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept-Language', 'Authorization'])
+    return response
@@ -0,0 +1,247 @@
+from django.core.files.storage import default_storage
+from rest_framework.response import Response
+
+from . import images
+from .models import CompanyPhoto
+from .serializers import favorite_company_ids
+
+
+class Context:
+    """What a row needs from the request: language, URLs and favorites."""
+
+    def __init__(self, request):
+        self.request = request
+        self.language = 'ar' if request.META.get('HTTP_ACCEPT_LANGUAGE', 'en') == 'ar' else 'en'
+        self.build_url = request.build_absolute_uri
+        self.related = {}
+
+    @property
+    def favorites(self):
+        return favorite_company_ids(self.request)
+
+
+class Value:
+    """A column as it is, or passed through convert(value)."""
+
+    def __init__(self, column, convert=None):
+        self.column = column
+        self.convert = convert
+
+    def columns(self, language):
+        return [self.column]
+
+    def reader(self, indexes, language):
+        index, convert = indexes[0], self.convert
+        if convert is None:
+            return lambda row, context: row[index]
+        return lambda row, context: convert(row[index])
+
+
+class Localized(Value):
+    """name_en or name_ar, picked once when the shape is compiled."""
+
+    def columns(self, language):
+        return [f'{self.column}_{language}']
+
+
+class Computed:
+    """compute(context, *values) of one or more columns."""
+
+    def __init__(self, compute, *columns):
+        self.compute = compute
+        self.column_names = list(columns)
+
+    def columns(self, language):
+        return self.column_names
+
+    def reader(self, indexes, language):
+        compute = self.compute
+        if len(indexes) == 1:
+            index = indexes[0]
+            return lambda row, context: compute(context, row[index])
+        return lambda row, context: compute(context, *[row[index] for index in indexes])
+
+
+class Related:
+    """Rows of another table keyed by a column, loaded for the whole page in
+    one query by load(keys, context) -> {key: value}; default() for keys
+    without any."""
+
+    def __init__(self, name, column, load, default):
+        self.name = name
+        self.column = column
+        self.load = load
+        self.default = default
+
+    def columns(self, language):
+        return [self.column]
+
+    def reader(self, indexes, language):
+        index, name, default = indexes[0], self.name, self.default
+
+        def read(row, context):
+            value = context.related[name].get(row[index])
+            return default() if value is None else value
+        return read
+
+
+class Shape:
+    """Declarative, read-only counterpart of a serializer.
+
+    fields is a sequence of (key, spec) pairs in output order, where a spec
+    is a Value, Localized, Computed, Related or a nested Shape over the
+    columns of a relation (prefix='company'). compile() turns it into the
+    columns to fetch with .values_list() and a function building the dict
+    of one row by index, once per language; no DRF field is involved.
+    """
+
+    def __init__(self, fields, prefix=''):
+        self.fields = fields
+        self.prefix = prefix
+        self.compiled = {}
+
+    def qualify(self, column):
+        return f'{self.prefix}__{column}' if self.prefix else column
+
+    def columns(self, language):
+        return [self.qualify(column) for _, spec in self.fields for column in spec.columns(language)]
+
+    def reader(self, indexes, language):
+        readers = []
+        related = []
+        offset = 0
+        for key, spec in self.fields:
+            count = len(spec.columns(language))
+            readers.append((key, spec.reader(indexes[offset:offset + count], language)))
+            if isinstance(spec, Related):
+                related.append((spec, indexes[offset]))
+            elif isinstance(spec, Shape):
+                related.extend(spec.related)
+            offset += count
+        self.related = related
+        return lambda row, context: {key: read(row, context) for key, read in readers}
+
+    def compile(self, language):
+        """(columns, related, row -> dict) for the language."""
+        if language not in self.compiled:
+            columns = []
+            positions = {}
+            indexes = []
+            # A column used by several keys is fetched once.
+            for column in self.columns(language):
+                if column not in positions:
+                    positions[column] = len(columns)
+                    columns.append(column)
+                indexes.append(positions[column])
+            read = self.reader(indexes, language)
+            self.compiled[language] = (columns, self.related, read)
+        return self.compiled[language]
+
+    def serialize(self, rows, context):
+        """Dicts of rows fetched with the columns of compile()."""
+        columns, related, read = self.compile(context.language)
+        for spec, index in related:
+            keys = {row[index] for row in rows}
+            context.related[spec.name] = spec.load(keys, context) if keys else {}
+        return [read(row, context) for row in rows]
+
+    def values(self, queryset, language, extra=()):
+        """queryset as named rows of the shape's columns, followed by the
+        extra ones (the keyset ordering) it does not already have."""
+        columns, related, read = self.compile(language)
+        columns = columns + [column for column in extra if column not in columns]
+        # prefetch_related() cannot apply to tuples.
+        return queryset.prefetch_related(None).values_list(*columns, named=True)
+
+
+def file_url(name):
+    return default_storage.url(name) if name else None
+
+
+def absolute_file_url(context, name):
+    return context.build_url(default_storage.url(name)) if name else None
+
+
+def absolute_variant_urls(context, variants):
+    return images.variant_urls(variants, context.build_url)
+
+
+def load_photos(company_ids, context):
+    """CompanyPhotoSerializer output of the photos of the companies."""
+    photos = {}
+    rows = (
+        CompanyPhoto.objects.filter(company_id__in=company_ids)
+        .order_by('company_id', 'id')
+        .values_list('id', 'variants', 'image', 'company_id')
+    )
+    for pk, variants, image, company_id in rows:
+        photos.setdefault(company_id, []).append({
+            'id': pk,
+            'variants': images.variant_urls(variants),
+            'image': file_url(image),
+            'company': company_id,
+        })
+    return photos
+
+
+def is_favorite(context, company_id):
+    return company_id in context.favorites
+
+
+def embedded_company(prefix):
+    """The company of an appointment or favorite, as their serializers
+    reshape CompanySerializer(fields=COMPANY_EMBEDDED_FIELDS)."""
+    fields = [
+        ('id', Value('id')),
+        ('name', Localized('name')),
+        ('category_id', Value('category')),
+        ('image', Computed(absolute_file_url, 'image')),
+        ('image_variants', Computed(absolute_variant_urls, 'image_variants')),
+        ('address', Localized('address')),
+        ('about', Localized('about')),
+        ('is_certified', Value('is_certified')),
+        ('lat', Value('lat')),
+        ('lng', Value('lng')),
+        ('is_favorite', Computed(is_favorite, 'id')),
+        ('photos', Related('photos', 'id', load_photos, list)),
+    ]
+    return Shape(fields, prefix)
+
+
+# AppointmentSerializer
+APPOINTMENT = Shape([
+    ('id', Value('id')),
+    ('client', Shape([
+        ('id', Value('id')),
+        ('name', Localized('name')),
+        ('email', Value('email')),
+        ('photo', Value('photo', file_url)),
+        ('photo_variants', Value('photo_variants', images.variant_urls)),
+    ], 'client')),
+    ('company', embedded_company('company')),
+    ('date', Value('date', lambda date: date.isoformat())),
+    ('time', Value('time', lambda time: time.isoformat())),
+    ('status', Value('status')),
+])
+
+# FavoriteSerializer: the company itself, photos before is_favorite.
+FAVORITE = Shape([
+    (key, spec) for key, spec in embedded_company('company').fields if key != 'is_favorite'
+] + [('is_favorite', Computed(is_favorite, 'id'))], 'company')
+
+
+def serialize(shape, queryset, request):
+    """Dicts of every row of queryset, as the shape's serializer would render them."""
+    context = Context(request)
+    return shape.serialize(list(shape.values(queryset, context.language)), context)
+
+
+def list_response(view, shape, queryset):
+    """ListModelMixin.list() over the shape instead of the serializer."""
+    context = Context(view.request)
+    ordering = [name.lstrip('-') for name in getattr(view, 'keyset_ordering', ('id',))]
+    rows = shape.values(view.filter_queryset(queryset), context.language, ordering)
+    page = view.paginate_queryset(rows)
+    if page is None:
+        return Response(shape.serialize(list(rows), context))
+    return view.get_paginated_response(shape.serialize(page, context))
@@ -0,0 +1,120 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Case, Q, When
+
+
+TABLE = 'dawrni_app_company_search'
+# name, address, about
+WEIGHTS = (10.0, 2.0, 1.0)
+MAX_RESULTS = 500
+
+DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+FOLDING = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    'ى': 'ي',
+    'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+
+
+def normalize(text):
+    """Fold text so spelling variants of the same word index identically.
+
+    Strips harakat and tatweel, folds the hamza forms of alef, waw and yaa,
+    alef maksura and taa marbuta, maps Arabic-Indic digits to ASCII and
+    casefolds the Latin part.
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text)
+    text = DIACRITICS.sub('', text)
+    return text.translate(FOLDING).casefold()
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def create_index(cursor):
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+        "name, address, about, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+
+def document(company):
+    return (
+        normalize(' '.join(filter(None, (company.name_ar, company.name_en)))),
+        normalize(' '.join(filter(None, (company.address_ar, company.address_en)))),
+        normalize(' '.join(filter(None, (company.about_ar, company.about_en)))),
+    )
+
+
+def index_company(company):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [company.pk])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, name, address, about) VALUES (%s, %s, %s, %s)',
+            [company.pk, *document(company)],
+        )
+
+
+def remove_company(company_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [company_id])
+
+
+def match_expression(query):
+    """FTS5 query matching every word of the query as a prefix."""
+    terms = re.findall(r'\w+', normalize(query))
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def ranked_ids(query, queryset=None, limit=MAX_RESULTS):
+    """Ids of the best matches of query, restricted to queryset if given.
+
+    The restriction is part of the FTS statement, so the limit applies to
+    the companies that pass the queryset's filters rather than to every
+    match.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    restriction, restriction_params = '', []
+    if queryset is not None:
+        sql, restriction_params = queryset.order_by().values('pk').query.sql_with_params()
+        restriction = f' AND rowid IN ({sql})'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s{restriction} '
+            f'ORDER BY bm25({TABLE}, %s, %s, %s) LIMIT %s',
+            [expression, *restriction_params, *WEIGHTS, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_companies(queryset, query):
+    """Restrict a Company queryset to matches of query, best matches first."""
+    if not is_available():
+        return queryset.filter(
+            Q(name_ar__icontains=query) | Q(name_en__icontains=query) |
+            Q(address_ar__icontains=query) | Q(address_en__icontains=query) |
+            Q(about_ar__icontains=query) | Q(about_en__icontains=query)
+        )
+    ids = ranked_ids(query, queryset, MAX_RESULTS)
+    if not ids:
+        return queryset.none()
+    ranking = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)])
+    return queryset.filter(pk__in=ids).annotate(search_rank=ranking).order_by('search_rank', 'id')
@@ -2,7 +2,28 @@ from django.contrib.auth.models import User
 from rest_framework import serializers, validators
 from django.core.validators import MinLengthValidator
 from django.utils.translation import gettext as _
-from .models import Category, Company, Client, Notification, CompanyPhoto, custom_user, Favorite, Appointment
+from . import accounts, availability, images, notifications, passwords
+from .models import Category, Company, Client, Notification, CompanyPhoto, custom_user, Favorite, Appointment, WorkingHours
+
+def favorite_company_ids(request):
+    """Ids of the companies the requesting client has favorited.
+
+    Loaded with a single query the first time a request needs it, so
+    serializing a page of companies never checks favorites row by row.
+    """
+    if request is None:
+        return frozenset()
+    company_ids = getattr(request, '_favorite_company_ids', None)
+    if company_ids is None:
+        try:
+            client = accounts.get_client(request)
+        except Client.DoesNotExist:
+            company_ids = frozenset()
+        else:
+            company_ids = frozenset(Favorite.objects.filter(client=client).values_list('company_id', flat=True))
+        request._favorite_company_ids = company_ids
+    return company_ids
+
 
 class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,16 +37,28 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class CompanyPhotoSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = CompanyPhoto
         fields = '__all__'
 
+    def get_variants(self, obj):
+        return images.variant_urls(obj.variants)
+
+    def validate_image(self, value):
+        return images.validate_upload(value)
+
 
 class CompanyProfileSerializer(serializers.ModelSerializer):
     photos = CompanyPhotoSerializer(many=True, read_only=True)
+    image_variants = serializers.SerializerMethodField()
     class Meta:
         model = Company
         fields = '__all__'
+
+    def get_image_variants(self, obj):
+        return images.variant_urls(obj.image_variants)
     
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -34,10 +67,14 @@ class CompanyProfileSerializer(serializers.ModelSerializer):
         return representation
 
 class ClientProfileSerializer(serializers.ModelSerializer):
+    photo_variants = serializers.SerializerMethodField()
     class Meta:
         model = Client
         exclude = ('favorites',)  # Exclude the user field from serialization
 
+    def get_photo_variants(self, obj):
+        return images.variant_urls(obj.photo_variants)
+
 
 class ClientSerializer(serializers.ModelSerializer):
     favorites = serializers.SerializerMethodField()
@@ -60,6 +97,7 @@ class ClientSerializer(serializers.ModelSerializer):
             'name': name,
             'email': obj.email,
             'photo': obj.photo.url if obj.photo else None,
+            'photo_variants': images.variant_urls(obj.photo_variants),
             }
     
     def update(self, instance, validated_data):
@@ -72,6 +110,9 @@ class ClientSerializer(serializers.ModelSerializer):
         ClientSerializer(instance)
         return instance
     
+    def validate_photo(self, value):
+        return images.validate_upload(value)
+
     def get_favorites(self, obj):
         favorites = Favorite.objects.filter(client=obj)
         return [fav.company.id for fav in favorites]
@@ -80,7 +121,14 @@ class ClientSerializer(serializers.ModelSerializer):
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = '__all__'
+        fields = ('id', 'title', 'body', 'is_read', 'created_at')
+        read_only_fields = fields
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.message in notifications.MESSAGES:
+            data['title'], data['body'] = notifications.render(instance.message, instance.params)
+        return data
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -107,12 +155,15 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user_type = validated_data.get("user_type")
-        user = custom_user.objects.create_user(
-            username=validated_data["email"],
-            email=validated_data["email"],
-            password=validated_data["password"],
+        # What create_user() does, with the hash computed on a password
+        # worker (see passwords.py).
+        user = custom_user(
+            username=custom_user.normalize_username(validated_data["email"]),
+            email=custom_user.objects.normalize_email(validated_data["email"]),
             user_type=validated_data["user_type"],
         )
+        user.password = passwords.make_password(validated_data["password"])
+        user.save()
         if user_type == "company" :
             Company.objects.create(
                 user=user,
@@ -125,6 +176,38 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
     
 
+# Keys CompanySerializer can render, in output order.
+COMPANY_FIELDS = (
+    'id', 'category', 'name', 'address', 'about', 'is_certified', 'user', 'image', 'image_variants',
+    'thumbnail', 'photos', 'lat', 'lng', 'is_favorite',
+)
+# Rendered when no fields are requested.
+COMPANY_DEFAULT_FIELDS = tuple(field for field in COMPANY_FIELDS if field != 'thumbnail')
+# ?fields=compact, for list screens.
+COMPANY_COMPACT_FIELDS = ('id', 'category', 'name', 'thumbnail', 'lat', 'lng')
+# What appointments and favorites embed of their company.
+COMPANY_EMBEDDED_FIELDS = tuple(field for field in COMPANY_DEFAULT_FIELDS if field != 'user')
+
+
+def requested_company_fields(request):
+    """Company fields asked for with ?fields= and ?expand=.
+
+    ?fields= takes a comma separated list of COMPANY_FIELDS or "compact";
+    photos are only part of a sparse fieldset when listed or expanded with
+    ?expand=photos. Unknown names are ignored.
+    """
+    fields = request.query_params.get('fields') if request is not None else None
+    if not fields:
+        return COMPANY_DEFAULT_FIELDS
+    if fields == 'compact':
+        selected = list(COMPANY_COMPACT_FIELDS)
+    else:
+        selected = [field for field in fields.split(',') if field in COMPANY_FIELDS]
+    if 'photos' in request.query_params.get('expand', '').split(',') and 'photos' not in selected:
+        selected.append('photos')
+    return tuple(field for field in COMPANY_FIELDS if field in selected) or COMPANY_DEFAULT_FIELDS
+
+
 class CompanySerializer(serializers.ModelSerializer):
     photos = CompanyPhotoSerializer(many=True, read_only=True)
     category = serializers.IntegerField(required=False)  # Change to IntegerField for category ID
@@ -134,39 +217,58 @@ class CompanySerializer(serializers.ModelSerializer):
         model = Company
         exclude = ('user',)  # Exclude the user field from serialization
 
+    def __init__(self, *args, **kwargs):
+        # The keys to render; defaults to context['company_fields'], then
+        # COMPANY_DEFAULT_FIELDS.
+        self.rendered_fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
     def to_representation(self, obj):
+        # Without a request (see cards.py) the language comes from the
+        # context and URLs stay relative to the host.
         request = self.context.get('request')
-        language = request.META.get('HTTP_ACCEPT_LANGUAGE', 'en')
-        
+        language = self.context.get('language') or request.META.get('HTTP_ACCEPT_LANGUAGE', 'en')
+        build_url = request.build_absolute_uri if request is not None else str
+        fields = self.rendered_fields or self.context.get('company_fields') or COMPANY_DEFAULT_FIELDS
+
+        # Only the requested keys are computed, so columns left out by
+        # Company.objects.for_listing(fields=...) are never loaded.
+        data = {}
+        if 'id' in fields:
+            data['id'] = obj.id
+        if 'category' in fields:
+            data['category'] = obj.category_id
         # for the localization 
-        if language == 'ar':
-            name = obj.name_ar
-            address = obj.address_ar
-            about = obj.about_ar
-        else:
-            name = obj.name_en
-            address = obj.address_en
-            about = obj.about_en
-        category_id = obj.category.id if obj.category else None
-        image_url = request.build_absolute_uri(obj.image.url) if obj.image else None
-        # photos_data = [photo['image'] for photo in CompanyPhotoSerializer(obj.photos.all(), many=True).data] just get the images without id
-        
-        return {
-            'id': obj.id,
-            'category': category_id,
-            'name': name,
-            'address': address,
-            'about': about,
-            'is_certified': obj.is_certified,
-            'user': obj.user.username,
-            'image': image_url,
-            'photos': CompanyPhotoSerializer(obj.photos.all(), many=True).data,
-            'lat': obj.lat,
-            'lng': obj.lng,
-            'is_favorite': obj.is_favorite,
-
-        }
+        if 'name' in fields:
+            data['name'] = obj.name_ar if language == 'ar' else obj.name_en
+        if 'address' in fields:
+            data['address'] = obj.address_ar if language == 'ar' else obj.address_en
+        if 'about' in fields:
+            data['about'] = obj.about_ar if language == 'ar' else obj.about_en
+        if 'is_certified' in fields:
+            data['is_certified'] = obj.is_certified
+        if 'user' in fields:
+            data['user'] = obj.user.username
+        if 'image' in fields:
+            data['image'] = build_url(obj.image.url) if obj.image else None
+        if 'image_variants' in fields:
+            data['image_variants'] = images.variant_urls(obj.image_variants, build_url)
+        if 'thumbnail' in fields:
+            thumbnail = images.thumbnail_name(obj)
+            data['thumbnail'] = build_url(obj.image.storage.url(thumbnail)) if thumbnail else None
+        if 'photos' in fields:
+            data['photos'] = CompanyPhotoSerializer(obj.photos.all(), many=True).data
+        if 'lat' in fields:
+            data['lat'] = obj.lat
+        if 'lng' in fields:
+            data['lng'] = obj.lng
+        if 'is_favorite' in fields:
+            data['is_favorite'] = obj.id in favorite_company_ids(request)
+        return data
     
+    def validate_image(self, value):
+        return images.validate_upload(value)
+
     def update(self, instance, validated_data):
         # Update only the category if present in the validated data
         category_id = validated_data.pop('category', None)
@@ -184,6 +286,8 @@ class CompanySerializer(serializers.ModelSerializer):
         instance.is_certified = validated_data.get('is_certified', instance.is_certified)
         instance.lat = validated_data.get('lat', instance.lat)
         instance.lng = validated_data.get('lng', instance.lng)
+        instance.slot_minutes = validated_data.get('slot_minutes', instance.slot_minutes)
+        instance.slot_capacity = validated_data.get('slot_capacity', instance.slot_capacity)
         image_file = validated_data.get('image', None)
         if image_file:
             instance.image = image_file
@@ -193,7 +297,7 @@ class CompanySerializer(serializers.ModelSerializer):
         
 
 class AppointmentSerializer(serializers.ModelSerializer):
-    company = CompanySerializer()
+    company = CompanySerializer(fields=COMPANY_EMBEDDED_FIELDS)
     client = ClientSerializer()
 
     class Meta:
@@ -210,6 +314,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'name': company_data['name'],
             'category_id': company_data['category'],
             'image': company_data['image'],
+            'image_variants': company_data['image_variants'],
             'address': company_data['address'],
             'about': company_data['about'],
             'is_certified': company_data['is_certified'],
@@ -224,12 +329,13 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'name': client_data['name'],
             'email': client_data['email'],
             'photo': client_data.get('photo', None),
+            'photo_variants': client_data['photo_variants'],
         }
         return representation
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
-    company = CompanySerializer()
+    company = CompanySerializer(fields=COMPANY_EMBEDDED_FIELDS)
     photos = CompanyPhotoSerializer(many=True, read_only=True)
 
     class Meta:
@@ -245,6 +351,7 @@ class FavoriteSerializer(serializers.ModelSerializer):
             'name': company_data['name'],
             'category_id': company_data['category'],
             'image': company_data['image'],
+            'image_variants': company_data['image_variants'],
             'address': company_data['address'],
             'about': company_data['about'],
             'is_certified': company_data['is_certified'],
@@ -257,4 +364,46 @@ class FavoriteSerializer(serializers.ModelSerializer):
 
 class VerifyAccountSerializer(serializers.Serializer):
     email = serializers.EmailField()
-    code_name = serializers.CharField() 
\ No newline at end of file
+    code_name = serializers.CharField()
+
+
+class BookingSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    time = serializers.TimeField()
+
+
+class BulkBookingSerializer(serializers.Serializer):
+    slots = BookingSerializer(many=True, allow_empty=False)
+
+    def validate_slots(self, value):
+        if len(value) > availability.MAX_BATCH:
+            raise serializers.ValidationError(_("At most %(count)d items per request.") % {'count': availability.MAX_BATCH})
+        return value
+
+
+class StatusChangeSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=['pending', 'confirmed', 'canceled'])
+
+
+class BulkStatusSerializer(serializers.Serializer):
+    changes = StatusChangeSerializer(many=True, allow_empty=False)
+
+    def validate_changes(self, value):
+        if len(value) > availability.MAX_BATCH:
+            raise serializers.ValidationError(_("At most %(count)d items per request.") % {'count': availability.MAX_BATCH})
+        ids = [change['id'] for change in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(_("Each appointment may only appear once."))
+        return value
+
+
+class WorkingHoursSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WorkingHours
+        fields = ['weekday', 'opens_at', 'closes_at']
+
+    def validate(self, attrs):
+        if attrs['opens_at'] >= attrs['closes_at']:
+            raise serializers.ValidationError(_("Opening time must be before closing time."))
+        return attrs
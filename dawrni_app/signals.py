@@ -0,0 +1,180 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+from knox.models import AuthToken
+
+from . import accounts, cards, images, response_cache, search
+from .authentication import token_cache
+from .models import Category, Client, Company, CompanyCard, CompanyPhoto, custom_user
+
+
+SEARCH_FIELDS = {'name_ar', 'name_en', 'address_ar', 'address_en', 'about_ar', 'about_en'}
+
+
+@receiver(post_save, sender=Company)
+def index_company(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    search.index_company(instance)
+
+
+@receiver(post_delete, sender=Company)
+def unindex_company(sender, instance, **kwargs):
+    search.remove_company(instance.pk)
+
+
+@receiver(post_save, sender=Company)
+def refresh_company_card(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= cards.UNRENDERED_FIELDS:
+        return
+    cards.refresh(instance.pk)
+
+
+@receiver(post_migrate)
+def build_missing_company_cards(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Companies created before the cards table, or while it was emptied.
+    # Rendering needs today's models, so partial migrations are skipped.
+    if sender.name != 'dawrni_app':
+        return
+    executor = MigrationExecutor(connections[using])
+    if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+        return
+    missing = Company.objects.using(using).exclude(pk__in=CompanyCard.objects.values('company_id'))
+    for company_id in missing.values_list('pk', flat=True).iterator():
+        cards.refresh(company_id)
+
+
+@receiver(post_save, sender=CompanyPhoto)
+@receiver(post_delete, sender=CompanyPhoto)
+def refresh_photo_company_card(sender, instance, origin=None, **kwargs):
+    # Photos deleted along with their company need no card.
+    if origin is not None and not isinstance(origin, CompanyPhoto) and getattr(origin, 'model', None) is not CompanyPhoto:
+        return
+    cards.refresh(instance.company_id)
+
+
+@receiver(post_save, sender=custom_user)
+def refresh_owner_company_cards(sender, instance, created=False, **kwargs):
+    # Cards show the owner's username.
+    if not created:
+        for company_id in Company.objects.filter(user_id=instance.pk).values_list('pk', flat=True):
+            cards.refresh(company_id)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=CompanyPhoto)
+@receiver(post_delete, sender=CompanyPhoto)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_company_responses(sender, **kwargs):
+    # Once now, and once more after commit in case a response was cached
+    # from the old rows while the transaction was still open.
+    response_cache.invalidate()
+    transaction.on_commit(response_cache.invalidate)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=custom_user)
+def invalidate_owner_company_responses(sender, instance, update_fields=None, **kwargs):
+    # Payloads include the owner's username; last_login updates and users
+    # without a company leave them alone.
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    if Company.objects.filter(user_id=instance.pk).exists():
+        invalidate_company_responses(sender)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=custom_user)
+@receiver(post_delete, sender=custom_user)
+def invalidate_user_profiles(sender, instance, **kwargs):
+    accounts.invalidate(instance.pk)
+    token_cache.delete_user(instance.pk)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_owner_profiles(sender, instance, **kwargs):
+    accounts.invalidate(instance.user_id)
+
+
+@receiver(post_delete, sender=AuthToken)
+def evict_token(sender, instance, **kwargs):
+    token_cache.delete(instance.digest)
+
+
+# Image field and the JSON field holding its generated variants.
+IMAGE_FIELDS = {
+    Company: ('image', 'image_variants'),
+    Client: ('photo', 'photo_variants'),
+    CompanyPhoto: ('image', 'variants'),
+}
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=CompanyPhoto)
+def sync_image_variants(sender, instance, update_fields=None, **kwargs):
+    field_name, variants_field = IMAGE_FIELDS[sender]
+    if update_fields is not None and field_name not in update_fields:
+        return
+    field = getattr(instance, field_name)
+    variants = getattr(instance, variants_field)
+    if field:
+        if variants.get('source') != field.name:
+            images.schedule(instance, field_name, variants_field)
+    elif variants:
+        images.delete_variants(field.storage, variants)
+        setattr(instance, variants_field, {})
+        instance.save(update_fields=[variants_field])
+
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=CompanyPhoto)
+def delete_image_variants(sender, instance, **kwargs):
+    field_name, variants_field = IMAGE_FIELDS[sender]
+    images.delete_variants(getattr(instance, field_name).storage, getattr(instance, variants_field))
+
+
+# File fields whose files are released when replaced or when the row goes.
+FILE_FIELDS = {
+    custom_user: 'image',
+    Company: 'image',
+    Client: 'photo',
+    CompanyPhoto: 'image',
+}
+
+
+@receiver(pre_save, sender=custom_user)
+@receiver(pre_save, sender=Company)
+@receiver(pre_save, sender=Client)
+@receiver(pre_save, sender=CompanyPhoto)
+def release_replaced_file(sender, instance, update_fields=None, raw=False, **kwargs):
+    field_name = FILE_FIELDS[sender]
+    field = getattr(instance, field_name)
+    # Only a newly assigned upload replaces the stored file.
+    if raw or instance.pk is None or not field or field._committed:
+        return
+    if update_fields is not None and field_name not in update_fields:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+    if previous:
+        storage = field.storage
+        transaction.on_commit(lambda: storage.delete(previous))
+
+
+@receiver(post_delete, sender=custom_user)
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=CompanyPhoto)
+def release_deleted_file(sender, instance, **kwargs):
+    field = getattr(instance, FILE_FIELDS[sender])
+    if field:
+        field.storage.delete(field.name)
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+BLOB_DIRECTORY = 'blobs'
+
+
+def is_blob(name):
+    return bool(name) and name.replace('\\', '/').startswith(BLOB_DIRECTORY + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after the SHA-256 of their content.
+
+    Identical uploads share one file under blobs/. Every save() takes a
+    reference on the blob and every delete() releases one, recorded in
+    MediaBlob; the file is removed once the last reference is released and
+    the releasing transaction has committed. References are taken in the
+    caller's transaction, so they roll back with it. Files saved before
+    this storage existed keep their names and are deleted as before.
+
+    The MediaBlob row is the lock between saves and removals: save() writes
+    or re-checks the file only after its UPDATE holds the row, and the
+    removal deletes the row before unlinking the file.
+    """
+
+    def blob_name(self, content, name):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        extension = os.path.splitext(name)[1].lower()
+        hexdigest = digest.hexdigest()
+        return f'{BLOB_DIRECTORY}/{hexdigest[:2]}/{hexdigest}{extension}'
+
+    def save(self, name, content, max_length=None):
+        from .models import MediaBlob
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        name = self.blob_name(content, name)
+
+        with transaction.atomic():
+            while not MediaBlob.objects.filter(name=name).update(references=F('references') + 1):
+                try:
+                    with transaction.atomic():
+                        MediaBlob.objects.create(name=name, references=1)
+                    break
+                except IntegrityError:
+                    # Created concurrently; take a reference on that row.
+                    continue
+            # The row is held until commit, so a removal of this blob has
+            # either unlinked the file already or will find the reference.
+            if not self.exists(name):
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                self.write(name, content)
+        return name
+
+    def write(self, name, content):
+        """Write through a temporary file so concurrent writers of the same
+        blob never expose a partial file."""
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as target:
+                for chunk in content.chunks():
+                    target.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            file_move_safe(temporary, path, allow_overwrite=True)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def delete(self, name):
+        from .models import MediaBlob
+
+        if not is_blob(name):
+            return super().delete(name)
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None or blob.references == 0:
+                return
+            MediaBlob.objects.filter(pk=blob.pk).update(references=F('references') - 1)
+            if blob.references > 1:
+                return
+
+        def remove():
+            # The same content may have been uploaded again in the meantime,
+            # in which case the row has references again and stays.
+            with transaction.atomic():
+                deleted, _ = MediaBlob.objects.filter(name=name, references=0).delete()
+                if deleted:
+                    super(ContentAddressedStorage, self).delete(name)
+
+        transaction.on_commit(remove)
@@ -1,3 +1,1499 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import io
+import os
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.hashers import make_password
+from django.core.management import CommandError, call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.http import StreamingHttpResponse
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+from django.utils.translation import gettext_lazy
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import (
+    authentication, availability, cards, events, geo, images, metrics, notifications, otp, outbox, passwords, renderers,
+    response_cache, rows, search, throttling, tokens,
+)
+from .models import (
+    Appointment, Category, Client, Company, CompanyCard, CompanyPhoto, Favorite, MediaBlob, Notification,
+    OneTimePassword, OutboxEmail, ThrottleBucket, WorkingHours, custom_user,
+)
+from .serializers import AppointmentSerializer, FavoriteSerializer
+from .storage import is_blob
+
+
+def is_throttle_query(sql):
+    return 'dawrni_app_throttlebucket' in sql or 'dawrni_cache' in sql
+
+
+def make_company(index, category, **fields):
+    user = custom_user.objects.create(
+        username=f'company{index}@example.com',
+        email=f'company{index}@example.com',
+        user_type='company',
+    )
+    defaults = {
+        'name_en': f'Company {index}',
+        'name_ar': f'شركة {index}',
+        'address_en': f'Address {index}',
+        'address_ar': f'عنوان {index}',
+        'about_en': f'About {index}',
+        'about_ar': f'حول {index}',
+        'category': category,
+    }
+    defaults.update(fields)
+    return Company.objects.create(user=user, **defaults)
+
+
+def make_client(index):
+    user = custom_user.objects.create(
+        username=f'client{index}@example.com',
+        email=f'client{index}@example.com',
+        user_type='user',
+    )
+    return Client.objects.create(user=user, email=user.email, name_en=f'Client {index}')
+
+
+def authenticate(api_client, user):
+    instance, token = AuthToken.objects.create(user)
+    api_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+
+class CompanyListQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Salons Service')
+
+    def seed(self, count):
+        for index in range(count):
+            company = make_company(index, self.category)
+            CompanyPhoto.objects.create(company=company, image=f'company_photos/{index}_a.png')
+            CompanyPhoto.objects.create(company=company, image=f'company_photos/{index}_b.png')
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.seed(10)
+        # one read of the company cards; no COUNT(*) unless asked for
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/companies/', {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+
+        first = response.data['results'][0]
+        self.assertEqual(first['user'], 'company0@example.com')
+        self.assertEqual(first['category'], self.category.id)
+        self.assertEqual(len(first['photos']), 2)
+
+    def test_compact_list_skips_join_and_photos(self):
+        self.seed(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/companies/', {'fields': 'compact'})
+        self.assertEqual(len(queries), 1)
+        columns = queries[0]['sql'].split(' FROM ')[0]
+        self.assertNotIn('about_en', columns)
+        self.assertNotIn('auth_user', queries[0]['sql'])
+        self.assertEqual(list(response.data['results'][0]), ['id', 'category', 'name', 'thumbnail', 'lat', 'lng'])
+
+    def test_sparse_fields_with_expanded_photos(self):
+        self.seed(1)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/companies/', {'fields': 'id,name', 'expand': 'photos'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'name', 'photos'])
+        self.assertEqual(len(response.data['results'][0]['photos']), 2)
+
+    def test_list_renders_requested_language(self):
+        self.seed(1)
+        response = self.client.get('/api/companies/', HTTP_ACCEPT_LANGUAGE='ar')
+        self.assertEqual(response.data['results'][0]['name'], 'شركة 0')
+        self.assertEqual(response.data['results'][0]['about'], 'حول 0')
+
+    def test_retrieve_query_count(self):
+        self.seed(1)
+        company = Company.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/companies/{company.id}/')
+        self.assertEqual(response.data['name'], 'Company 0')
+
+
+class NearbyCompaniesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Cars Service')
+        # Amman downtown, ~3 km, ~8 km and ~70 km (Irbid) away.
+        self.center = make_company(0, category, lat=31.9539, lng=35.9106)
+        self.close = make_company(1, category, lat=31.9770, lng=35.8900)
+        self.medium = make_company(2, category, lat=31.9900, lng=35.8400)
+        self.far = make_company(3, category, lat=32.5556, lng=35.8500)
+
+    def test_geohash_is_maintained_on_save(self):
+        self.assertEqual(self.center.geohash[:5], geo.encode(31.9539, 35.9106, 5))
+        self.center.lat = None
+        self.center.save()
+        self.assertIsNone(Company.objects.get(pk=self.center.pk).geohash)
+
+    def test_results_are_sorted_by_distance_within_radius(self):
+        response = self.client.get('/api/companies/nearby/', {'lat': 31.9539, 'lng': 35.9106, 'radius_km': 10})
+        self.assertEqual(response.status_code, 200)
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids, [self.center.id, self.close.id, self.medium.id])
+        distances = [item['distance_km'] for item in response.data['results']]
+        self.assertEqual(distances, sorted(distances))
+        self.assertIsNone(response.data['next'])
+
+    def test_keyset_pagination(self):
+        params = {'lat': 31.9539, 'lng': 35.9106, 'radius_km': 100, 'limit': 3}
+        response = self.client.get('/api/companies/nearby/', params)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], [self.far.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_search_narrows_the_nearby_companies(self):
+        for company in (self.medium, self.far):
+            company.about_en = 'Tyre repairs'
+            company.save()
+        params = {'lat': 31.9539, 'lng': 35.9106, 'radius_km': 10, 'search': 'tyre'}
+        response = self.client.get('/api/companies/nearby/', params)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.medium.id])
+
+    def test_invalid_parameters(self):
+        response = self.client.get('/api/companies/nearby/', {'lat': 'x', 'lng': 35})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/companies/nearby/', {'lat': 31, 'lng': 35, 'radius_km': 10000})
+        self.assertEqual(response.status_code, 400)
+
+
+class CompanySearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Salons Service')
+        self.salon = make_company(
+            0, category, name_en='Rose Beauty Salon', name_ar='صالون الأميرة',
+            about_en='Hair and nails', address_en='Rainbow Street',
+        )
+        self.clinic = make_company(
+            1, category, name_en='Smile Clinic', name_ar='عيادة الابتسامة',
+            about_en='Dental care next to the salon', address_en='Mecca Street',
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/companies/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_normalize_folds_arabic_variants(self):
+        self.assertEqual(search.normalize('الأَمِيرَةُ'), search.normalize('الاميره'))
+        self.assertEqual(search.normalize('إسلام'), 'اسلام')
+        self.assertEqual(search.normalize('مستشفى'), 'مستشفي')
+        self.assertEqual(search.normalize('SALON'), 'salon')
+
+    def test_arabic_search_ignores_hamza_and_taa_marbuta(self):
+        self.assertEqual(self.search('الاميره'), [self.salon.id])
+
+    def test_prefix_search_covers_about_and_address_ranked_by_name(self):
+        self.assertEqual(self.search('salo'), [self.salon.id, self.clinic.id])
+        self.assertEqual(self.search('mecca'), [self.clinic.id])
+
+    def test_result_limit_applies_after_filters(self):
+        other = Category.objects.create(name='Clinics Service')
+        Company.objects.filter(pk=self.clinic.pk).update(category=other)
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            # The salon ranks first for 'salo' but is in another category.
+            response = self.client.get('/api/companies/', {'search': 'salo', 'category': other.id})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.clinic.id])
+        self.assertEqual(search.ranked_ids('salo', Company.objects.filter(category=other), limit=1), [self.clinic.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.clinic.name_en = 'Bright Smile'
+        self.clinic.save()
+        self.assertEqual(self.search('bright'), [self.clinic.id])
+        self.clinic.delete()
+        self.assertEqual(self.search('bright'), [])
+
+    def test_query_without_words_matches_nothing(self):
+        self.assertEqual(self.search('"*'), [])
+
+
+class PerClientFavoriteTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.companies = [make_company(index, category) for index in range(3)]
+        self.alice = make_client(0)
+        self.bob = make_client(1)
+        self.api = APIClient()
+        authenticate(self.api, self.alice.user)
+
+    def test_favorite_is_only_visible_to_that_client(self):
+        response = self.api.post(f'/api/favorite/{self.companies[1].id}')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['is_favorite'])
+
+        favorites = {item['id']: item['is_favorite'] for item in self.api.get('/api/companies/').data['results']}
+        self.assertEqual(favorites, {self.companies[0].id: False, self.companies[1].id: True, self.companies[2].id: False})
+
+        other = APIClient()
+        authenticate(other, self.bob.user)
+        response = other.get(f'/api/companies/{self.companies[1].id}/')
+        self.assertFalse(response.data['is_favorite'])
+
+    def test_unfavorite(self):
+        Favorite.objects.create(client=self.alice, company=self.companies[0])
+        response = self.api.delete(f'/api/favorite/{self.companies[0].id}')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(self.api.get(f'/api/companies/{self.companies[0].id}/').data['is_favorite'])
+
+    def test_favorite_list_has_no_per_row_queries(self):
+        for company in self.companies:
+            Favorite.objects.create(client=self.alice, company=company)
+            CompanyPhoto.objects.create(company=company, image='company_photos/a.png')
+        response = self.api.get('/api/favorite_list/')
+        # page, photos, favorite ids; the token and the client come from
+        # the caches warmed by the first call.
+        with self.assertNumQueries(3):
+            response = self.api.get('/api/favorite_list/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertTrue(all(item['is_favorite'] for item in response.data['results']))
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.company = make_company(0, category, slot_minutes=30, slot_capacity=2)
+        self.date = datetime.date.today() + datetime.timedelta(days=7)
+        WorkingHours.objects.create(
+            company=self.company, weekday=self.date.weekday(),
+            opens_at=datetime.time(9), closes_at=datetime.time(10, 30),
+        )
+        self.alice = make_client(0)
+        self.bob = make_client(1)
+        self.carol = make_client(2)
+
+    def book(self, client, time):
+        api = APIClient()
+        authenticate(api, client.user)
+        return api.post(f'/api/book_appointment/{self.company.id}', {'date': self.date.isoformat(), 'time': time})
+
+    def test_slots_report_remaining_capacity(self):
+        self.book(self.alice, '09:30')
+        with self.assertNumQueries(3):
+            response = APIClient().get(f'/api/companies/{self.company.id}/slots/', {'date': self.date.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        available = {item['time']: item['available'] for item in response.json()['slots']}
+        self.assertEqual(available, {'09:00:00': 2, '09:30:00': 1, '10:00:00': 2})
+
+    def test_slot_cannot_be_overbooked(self):
+        self.assertEqual(self.book(self.alice, '09:00').status_code, 201)
+        self.assertEqual(self.book(self.bob, '09:00').status_code, 201)
+        self.assertEqual(self.book(self.carol, '09:00').status_code, 409)
+        seats = Appointment.objects.filter(company=self.company).values_list('seat', flat=True)
+        self.assertEqual(sorted(seats), [0, 1])
+
+    def test_canceled_appointment_frees_its_seat(self):
+        self.book(self.alice, '09:00')
+        self.book(self.bob, '09:00')
+        Appointment.objects.filter(client=self.alice).update(status='canceled')
+        self.assertEqual(self.book(self.carol, '09:00').status_code, 201)
+
+        appointment = Appointment.objects.get(client=self.alice)
+        with self.assertRaises(availability.SlotUnavailable):
+            availability.change_status(appointment, 'pending')
+
+    def test_times_outside_working_hours_are_rejected(self):
+        self.assertEqual(self.book(self.alice, '10:30').status_code, 400)
+        self.assertEqual(self.book(self.alice, '09:15').status_code, 400)
+
+    def test_unique_constraint_rejects_duplicate_seat(self):
+        Appointment.objects.create(client=self.alice, company=self.company, date=self.date, time=datetime.time(9))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Appointment.objects.create(client=self.bob, company=self.company, date=self.date, time=datetime.time(9))
+
+    def test_slot_settings_must_be_positive(self):
+        api = APIClient()
+        authenticate(api, self.company.user)
+        for data in ({'slot_minutes': 0}, {'slot_minutes': 24 * 60 + 1}, {'slot_capacity': 0}):
+            response = api.put('/api/update_company/', data, format='multipart')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(next(iter(data)), response.json())
+        self.company.refresh_from_db()
+        self.assertEqual((self.company.slot_minutes, self.company.slot_capacity), (30, 2))
+
+    def test_zero_length_slots_are_empty(self):
+        Company.objects.filter(pk=self.company.pk).update(slot_minutes=0)
+        self.company.refresh_from_db()
+        self.assertEqual(availability.slot_times(self.company, self.date), [])
+
+
+class BulkAppointmentTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.company = make_company(0, category, slot_minutes=30, slot_capacity=1)
+        self.date = datetime.date.today() + datetime.timedelta(days=7)
+        WorkingHours.objects.create(
+            company=self.company, weekday=self.date.weekday(),
+            opens_at=datetime.time(9), closes_at=datetime.time(11),
+        )
+        self.client_profile = make_client(0)
+        self.api = APIClient()
+
+    def book(self, *times):
+        authenticate(self.api, self.client_profile.user)
+        slots = [{'date': self.date.isoformat(), 'time': time} for time in times]
+        return self.api.post(f'/api/book_appointments/{self.company.id}', {'slots': slots}, format='json')
+
+    def change(self, changes):
+        authenticate(self.api, self.company.user)
+        return self.api.post('/api/status_appointments/', {'changes': changes}, format='json')
+
+    def test_bulk_booking(self):
+        response = self.book('09:00', '09:30', '10:00')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['result'] for item in response.data['results']], ['booked'] * 3)
+        self.assertEqual(Appointment.objects.filter(client=self.client_profile).count(), 3)
+
+    def test_bulk_booking_is_all_or_nothing(self):
+        self.assertEqual(self.book('09:00', '09:00').status_code, 409)
+        response = self.book('09:30', '09:45')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['result'] for item in response.data['results']], ['booked', 'invalid'])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_status_changes_use_one_update_per_status(self):
+        ids = [item['id'] for item in self.book('09:00', '09:30', '10:00', '10:30').data['results']]
+        changes = [{'id': ids[0], 'status': 'confirmed'}, {'id': ids[1], 'status': 'confirmed'},
+                   {'id': ids[2], 'status': 'canceled'}, {'id': ids[3], 'status': 'pending'}]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.change(changes)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['result'] for item in response.data['results']], ['updated'] * 3 + ['unchanged'])
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        statuses = dict(Appointment.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[pk] for pk in ids], ['confirmed', 'confirmed', 'canceled', 'pending'])
+
+    def test_other_companies_appointments_reject_the_batch(self):
+        own = self.book('09:00').data['results'][0]['id']
+        other_company = make_company(1, self.company.category)
+        other = Appointment.objects.create(
+            client=self.client_profile, company=other_company, date=self.date, time=datetime.time(9),
+        )
+        response = self.change([{'id': own, 'status': 'confirmed'}, {'id': other.id, 'status': 'confirmed'}])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['results'][1]['result'], 'not_found')
+        self.assertEqual(Appointment.objects.get(pk=own).status, 'pending')
+
+    def test_restoring_into_a_full_slot_conflicts(self):
+        first = self.book('09:00').data['results'][0]['id']
+        self.change([{'id': first, 'status': 'canceled'}])
+        self.client_profile = make_client(1)
+        second = self.book('09:00').data['results'][0]['id']
+        response = self.change([{'id': first, 'status': 'pending'}])
+        self.assertEqual(response.status_code, 409)
+        # Canceling the other booking in the same batch frees the seat.
+        response = self.change([{'id': second, 'status': 'canceled'}, {'id': first, 'status': 'confirmed'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Appointment.objects.get(pk=first).status, 'confirmed')
+
+
+class ListQueryPlanTests(TestCase):
+    """Every query behind the list endpoints is answered through an index."""
+
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.companies = [make_company(index, category) for index in range(3)]
+        make_company(3, None)
+        self.client_profile = make_client(0)
+        date = datetime.date.today() + datetime.timedelta(days=1)
+        for company in self.companies:
+            Favorite.objects.create(client=self.client_profile, company=company)
+            CompanyPhoto.objects.create(company=company, image='company_photos/a.png')
+            Appointment.objects.create(client=self.client_profile, company=company, date=date, time=datetime.time(9))
+
+    def assertIndexedQueries(self, api, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = api.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    # FTS5 reports a MATCH lookup as a virtual table scan with an M
+                    # in its plan, after '=' when the rowids are restricted too.
+                    indexed = 'USING' in detail or ('VIRTUAL TABLE' in detail and re.search(r':=?M', detail))
+                    if detail.startswith('SCAN') and not indexed:
+                        self.fail(f'{url} scans a table: {detail}\n{query["sql"]}')
+
+    def test_company_list_endpoints(self):
+        api = APIClient()
+        self.assertIndexedQueries(api, '/api/companies/')
+        self.assertIndexedQueries(api, api.get('/api/companies/', {'limit': 1}).data['next'])
+        self.assertIndexedQueries(api, '/api/companies/', {'category': self.companies[0].category_id})
+        self.assertIndexedQueries(api, '/api/companies/', {'search': 'company'})
+
+    def test_client_list_endpoints(self):
+        api = APIClient()
+        authenticate(api, self.client_profile.user)
+        self.assertIndexedQueries(api, '/api/client_appointments/')
+        self.assertIndexedQueries(api, '/api/client_appointments/', {'status': 'pending'})
+        self.assertIndexedQueries(api, '/api/favorite_list/')
+
+    def test_company_appointment_list_endpoints(self):
+        api = APIClient()
+        authenticate(api, self.companies[0].user)
+        self.assertIndexedQueries(api, '/api/company_appointments/')
+        self.assertIndexedQueries(api, '/api/company_appointments/', {'status': 'confirmed'})
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.company = make_company(0, category)
+        self.api = APIClient()
+        authenticate(self.api, self.company.user)
+
+    def test_company_is_resolved_once_across_requests(self):
+        self.api.get('/api/profile/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/profile/')
+        self.assertEqual(response.data['id'], self.company.id)
+        self.assertFalse(any('FROM "dawrni_app_company" ' in query['sql'] for query in queries.captured_queries))
+
+    def test_profile_changes_invalidate_the_cache(self):
+        self.api.get('/api/profile/')
+        self.company.name_en = 'Renamed'
+        self.company.save()
+        self.assertEqual(self.api.get('/api/profile/').data['name_en'], 'Renamed')
+
+    def test_get_user_does_not_refetch_by_email(self):
+        self.api.get('/api/user/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/user/')
+        self.assertEqual(response.data['user_type'], 'company')
+        self.assertFalse(any('"auth_user"."email" =' in query['sql'] for query in queries.captured_queries))
+
+    def test_verification_state_is_never_served_from_the_cache(self):
+        self.assertFalse(self.api.get('/api/user/').data['is_verified'])
+        # Verified through another worker, whose invalidation never got here.
+        custom_user.objects.filter(pk=self.company.user.pk).update(is_verified=True)
+        self.assertTrue(self.api.get('/api/user/').data['is_verified'])
+
+    def test_updates_do_not_save_a_stale_cached_company(self):
+        self.api.get('/api/profile/')
+        # Another worker's write, whose invalidation this process never saw.
+        Company.objects.filter(pk=self.company.pk).update(about_en='Changed elsewhere')
+        response = self.api.put('/api/update_company/', {'name_en': 'Renamed'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.company.refresh_from_db()
+        self.assertEqual((self.company.name_en, self.company.about_en), ('Renamed', 'Changed elsewhere'))
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client(0)
+        self.api = APIClient()
+        authenticate(self.api, self.client_profile.user)
+
+    def test_known_token_skips_the_token_query(self):
+        self.api.get('/api/user/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('knox_authtoken' in query['sql'] for query in queries.captured_queries))
+
+    def test_logout_evicts_the_token(self):
+        self.assertEqual(self.api.get('/api/user/').status_code, 200)
+        self.assertEqual(self.api.post('/api/logout/').status_code, 204)
+        self.assertEqual(self.api.get('/api/user/').status_code, 401)
+
+    def test_deleted_token_is_rejected(self):
+        self.api.get('/api/user/')
+        AuthToken.objects.filter(user=self.client_profile.user).delete()
+        self.assertEqual(self.api.get('/api/user/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.api.get('/api/user/')
+        user = self.client_profile.user
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.api.get('/api/user/').status_code, 401)
+
+    def test_token_deleted_by_another_worker_expires_within_timeout(self):
+        self.api.get('/api/user/')
+        # Another worker's logout, whose eviction this process never saw.
+        tokens = AuthToken.objects.filter(user=self.client_profile.user)
+        tokens._raw_delete(tokens.db)
+        self.assertEqual(self.api.get('/api/user/').status_code, 200)
+        later = time.monotonic() + authentication.token_cache_settings()['TIMEOUT'] + 1
+        with mock.patch('dawrni_app.authentication.time.monotonic', return_value=later):
+            self.assertEqual(self.api.get('/api/user/').status_code, 401)
+
+
+class OutboxTests(TestCase):
+    def test_register_queues_the_otp_instead_of_sending_it(self):
+        response = APIClient().post('/api/register/', {
+            'email': 'new@example.com', 'password': 'password123', 'user_type': 'user',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.get().recipient, 'new@example.com')
+
+        call_command('send_outbox', stdout=mock.Mock())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        self.assertEqual(OutboxEmail.objects.get().status, 'sent')
+
+    def test_batch_shares_one_connection(self):
+        for index in range(3):
+            outbox.enqueue('Subject', 'Body', f'user{index}@example.com')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(outbox.drain(), (3, 0))
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        message = outbox.enqueue('Subject', 'Body', 'user@example.com')
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=smtplib.SMTPException('down')), \
+                self.assertLogs('dawrni_app.outbox', 'WARNING'):
+            self.assertEqual(outbox.drain(), (0, 1))
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, 'down'))
+            self.assertGreater(message.next_attempt_at, timezone.now())
+            # Not due yet.
+            self.assertEqual(outbox.drain(), (0, 0))
+
+            for attempt in range(outbox.MAX_ATTEMPTS - 1):
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+                outbox.drain()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('failed', outbox.MAX_ATTEMPTS))
+
+    def test_expired_lease_is_reclaimed(self):
+        outbox.enqueue('Subject', 'Body', 'user@example.com')
+        self.assertEqual(len(outbox.claim(10)), 1)
+        self.assertEqual(outbox.claim(10), [])
+        OutboxEmail.objects.update(next_attempt_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(outbox.drain(), (1, 0))
+
+
+class OneTimePasswordTests(TestCase):
+    def setUp(self):
+        # Profiles are cached by user id, which rolled back tests reuse.
+        cache.clear()
+        self.user = make_client(0).user
+        self.code = otp.issue(self.user)
+        self.api = APIClient()
+
+    def verify(self, code):
+        return self.api.post('/api/verify/', {'email': self.user.email, 'code_name': code})
+
+    def test_code_is_stored_hashed_not_in_first_name(self):
+        pending = OneTimePassword.objects.get(pk=self.user.pk)
+        self.assertNotIn(self.code, pending.code_hash)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, '')
+
+    def test_verification_is_one_lookup_and_two_updates(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.verify(self.code)
+        self.assertEqual(response.status_code, 200)
+        statements = [
+            query['sql'].split()[0] for query in queries.captured_queries if not is_throttle_query(query['sql'])
+        ]
+        self.assertEqual(statements.count('SELECT'), 1)
+        # The attempt claim and is_verified.
+        self.assertEqual(statements.count('UPDATE'), 2)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_verified)
+
+    def test_wrong_codes_count_attempts_until_locked(self):
+        wrong = '0000'
+        for attempt in range(otp.MAX_ATTEMPTS):
+            self.assertEqual(self.verify(wrong).status_code, 400)
+        self.assertEqual(self.verify(self.code).status_code, 429)
+
+    def test_attempts_are_claimed_before_the_code_is_compared(self):
+        # Another request used the last attempt after this one read the row.
+        stale = OneTimePassword.objects.get(pk=self.user.pk)
+        OneTimePassword.objects.update(attempts=otp.MAX_ATTEMPTS)
+        with mock.patch('django.db.models.query.QuerySet.first', return_value=stale):
+            with self.assertRaises(otp.TooManyAttempts):
+                otp.verify(self.user.email, self.code)
+        self.assertEqual(OneTimePassword.objects.get(pk=self.user.pk).attempts, otp.MAX_ATTEMPTS)
+
+    def test_expired_code_is_rejected(self):
+        OneTimePassword.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.verify(self.code).status_code, 400)
+
+    def test_resend_is_rate_limited(self):
+        response = self.api.post('/api/resend_otp/', {'email': self.user.email})
+        self.assertEqual(response.status_code, 429)
+        OneTimePassword.objects.update(sent_at=timezone.now() - otp.RESEND_INTERVAL)
+        response = self.api.post('/api/resend_otp/', {'email': self.user.email})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OutboxEmail.objects.get().recipient, self.user.email)
+
+
+def make_image(size=(2400, 1200), name='photo.jpg'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(IMAGE_PROCESSING_SYNC=True)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.company = make_company(0, Category.objects.create(name='Salons Service'))
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = CompanyPhoto.objects.create(company=self.company, image=make_image(**kwargs))
+        photo.refresh_from_db()
+        return photo
+
+    def test_variants_are_generated_after_commit(self):
+        photo = self.upload()
+        self.assertEqual(photo.variants['source'], photo.image.name)
+        for variant, edge in images.VARIANTS.items():
+            with default_storage.open(photo.variants[variant]) as stored, Image.open(stored) as image:
+                self.assertEqual(max(image.size), edge)
+
+    def test_deleting_a_photo_removes_its_variants(self):
+        photo = self.upload()
+        names = [photo.variants[variant] for variant in images.VARIANTS]
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_listing_exposes_variant_urls(self):
+        self.upload()
+        response = APIClient().get('/api/companies/')
+        variants = response.data['results'][0]['photos'][0]['variants']
+        self.assertEqual(set(variants), set(images.VARIANTS))
+        self.assertTrue(all(url.endswith('.' + images.output_format()[1]) for url in variants.values()))
+
+    def test_oversized_dimensions_are_rejected_before_decoding(self):
+        with mock.patch.object(images, 'MAX_EDGE', 1000):
+            with self.assertRaises(ValidationError):
+                images.validate_upload(make_image())
+
+
+@override_settings(IMAGE_PROCESSING_SYNC=True)
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.company = make_company(0, Category.objects.create(name='Salons Service'))
+        self.content = make_image(size=(20, 20)).read()
+
+    def upload(self, name='Screenshot_43.png'):
+        upload = SimpleUploadedFile(name, self.content, content_type='image/jpeg')
+        return CompanyPhoto.objects.create(company=self.company, image=upload)
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self.upload(), self.upload('Screenshot_43_copy.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).references, 2)
+
+    def test_blob_is_removed_with_its_last_reference(self):
+        first, second = self.upload(), self.upload()
+        name = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_failed_saves_release_their_reference(self):
+        with mock.patch.object(CompanyPhoto, '_do_insert', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.upload()
+        self.assertFalse(MediaBlob.objects.exists())
+        name = self.upload().image.name
+        self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+
+    def test_upload_racing_the_last_release_keeps_the_file(self):
+        first = self.upload()
+        name = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+            # Uploaded again before the release committed and removed it.
+            second = self.upload()
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+
+    def test_deleting_the_company_image_keeps_shared_blob(self):
+        photo = self.upload()
+        self.company.image = SimpleUploadedFile('logo.png', self.content)
+        self.company.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.image.delete()
+        self.assertTrue(default_storage.exists(photo.image.name))
+        self.assertEqual(MediaBlob.objects.get(name=photo.image.name).references, 1)
+
+    def test_replacing_an_upload_releases_the_old_blob(self):
+        photo = self.upload()
+        old = photo.image.name
+        photo.image = make_image(size=(30, 30))
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.save()
+        self.assertNotEqual(photo.image.name, old)
+        self.assertFalse(default_storage.exists(old))
+
+    def test_blobs_are_served_as_immutable(self):
+        photo = self.upload()
+        response = self.client.get(settings.MEDIA_URL + photo.image.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    def test_dedupe_media_refreshes_company_cards(self):
+        os.makedirs(os.path.join(self.media_root, 'company_photos'))
+        with open(os.path.join(self.media_root, 'company_photos', 'legacy.png'), 'wb') as handle:
+            handle.write(self.content)
+        photo = CompanyPhoto.objects.create(company=self.company, image='company_photos/legacy.png')
+        self.assertEqual(CompanyCard.objects.get(pk=self.company.pk).thumbnail, 'company_photos/legacy.png')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_media', stdout=io.StringIO())
+        photo.refresh_from_db()
+        self.assertTrue(is_blob(photo.image.name))
+        card = CompanyCard.objects.get(pk=self.company.pk)
+        self.assertEqual(card.thumbnail, photo.variants.get('thumb', photo.image.name))
+        self.assertTrue(is_blob(card.thumbnail))
+        self.assertIn(photo.image.name, card.json_en)
+        self.assertNotIn('legacy.png', card.json_en)
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        with open(f'{self.media_root}/photo.png', 'wb') as handle:
+            handle.write(bytes(range(256)) * 4)
+
+    def test_revalidation_with_etag_returns_not_modified(self):
+        response = self.client.get('/media/photo.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response = self.client.get('/media/photo.png', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get('/media/photo.png', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        response = self.client.get('/media/photo.png', HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(252, 256)))
+        response = self.client.get('/media/photo.png', HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.client.get('/media/photo.png', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_accel_redirect_handoff(self):
+        with override_settings(DAWRNI_MEDIA={'HANDOFF': 'x-accel-redirect'}):
+            response = self.client.get('/media/photo.png')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photo.png')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+    def test_paths_outside_media_root_are_not_served(self):
+        self.assertEqual(self.client.get('/media/../photo.png').status_code, 404)
+        self.assertEqual(self.client.get('/media/missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/dawrni/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/../dawrni/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/manage.py').status_code, 404)
+
+    def test_refuses_to_serve_without_media_root(self):
+        with override_settings(MEDIA_ROOT=''):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get('/media/photo.png')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Salons Service')
+        self.companies = [make_company(index, self.category) for index in range(7)]
+        self.api = APIClient()
+
+    def walk(self, url, params):
+        ids, pages = [], 0
+        response = self.api.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.data['results']]
+            pages += 1
+            if response.data['next'] is None:
+                return ids, pages
+            response = self.api.get(response.data['next'])
+
+    def test_pages_cover_every_company_once(self):
+        ids, pages = self.walk('/api/companies/', {'limit': 3})
+        self.assertEqual(ids, [company.id for company in self.companies])
+        self.assertEqual(pages, 3)
+
+    def test_search_results_page_in_rank_order(self):
+        ids, pages = self.walk('/api/companies/', {'limit': 2, 'search': 'company'})
+        self.assertEqual(sorted(ids), [company.id for company in self.companies])
+        self.assertEqual(pages, 4)
+
+    def test_later_pages_cost_the_same_queries(self):
+        first = self.api.get('/api/companies/', {'limit': 2})
+        with self.assertNumQueries(1):
+            self.api.get(first.data['next'])
+
+    def test_count_is_optional(self):
+        self.assertNotIn('count', self.api.get('/api/companies/').data)
+        self.assertEqual(self.api.get('/api/companies/', {'count': 'true'}).data['count'], 7)
+
+    def test_offset_requests_keep_the_old_format(self):
+        response = self.api.get('/api/companies/', {'limit': 3, 'offset': 3})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual([item['id'] for item in response.data['results']], [company.id for company in self.companies[3:6]])
+        self.assertIn('offset=6', response.data['next'])
+        self.assertNotIn('offset', response.data['previous'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.api.get('/api/companies/', {'cursor': 'bogus'}).status_code, 404)
+
+    def test_appointments_page_by_date_time_and_id(self):
+        client = make_client(0)
+        authenticate(self.api, client.user)
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        slots = [
+            (tomorrow + datetime.timedelta(days=1), datetime.time(9)),
+            (tomorrow, datetime.time(11)),
+            (tomorrow, datetime.time(9)),
+            (tomorrow, datetime.time(9)),
+        ]
+        appointments = [
+            Appointment.objects.create(client=client, company=company, date=date, time=time)
+            for company, (date, time) in zip(self.companies, slots)
+        ]
+        ids, pages = self.walk('/api/client_appointments/', {'limit': 1})
+        expected = sorted(appointments, key=lambda appointment: (appointment.date, appointment.time, appointment.id))
+        self.assertEqual(ids, [appointment.id for appointment in expected])
+
+
+class CompanyResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.category = Category.objects.create(name='Salons Service')
+        self.companies = [make_company(index, self.category) for index in range(3)]
+        self.api = APIClient()
+
+    def test_repeated_requests_are_served_from_the_cache(self):
+        first = self.api.get('/api/companies/')
+        with self.assertNumQueries(0):
+            second = self.api.get('/api/companies/')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_if_none_match_gets_not_modified(self):
+        etag = self.api.get(f'/api/companies/{self.companies[0].id}/')['ETag']
+        response = self.api.get(f'/api/companies/{self.companies[0].id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_saving_a_company_invalidates(self):
+        etag = self.api.get('/api/companies/')['ETag']
+        self.companies[0].name_en = 'Renamed'
+        self.companies[0].save()
+        response = self.api.get('/api/companies/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+
+    def test_renaming_the_owner_invalidates(self):
+        url = f'/api/companies/{self.companies[0].id}/'
+        self.api.get(url)
+        owner = self.companies[0].user
+        owner.username = 'renamed'
+        owner.save()
+        self.assertEqual(self.api.get(url).data['user'], 'renamed')
+
+    def test_language_and_params_are_part_of_the_key(self):
+        self.api.get('/api/companies/')
+        arabic = self.api.get('/api/companies/', HTTP_ACCEPT_LANGUAGE='ar')
+        self.assertEqual(arabic.data['results'][0]['name'], 'شركة 0')
+        compact = self.api.get('/api/companies/', {'fields': 'compact'})
+        self.assertNotIn('about', compact.data['results'][0])
+
+    def test_favorites_are_applied_per_client(self):
+        anonymous = self.api.get('/api/companies/')
+        client = make_client(0)
+        Favorite.objects.create(client=client, company=self.companies[1])
+        authenticate(self.api, client.user)
+        response = self.api.get('/api/companies/')
+        favorites = {item['id']: item['is_favorite'] for item in response.data['results']}
+        self.assertEqual(favorites, {company.id: company == self.companies[1] for company in self.companies})
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+
+
+class CompanyCardTests(TestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.category = Category.objects.create(name='Salons Service')
+        self.company = make_company(0, self.category, lat=31.95, lng=35.91)
+        CompanyPhoto.objects.create(company=self.company, image='company_photos/a.png')
+        self.api = APIClient()
+
+    def test_cards_render_like_the_serializer(self):
+        client = make_client(0)
+        Favorite.objects.create(client=client, company=self.company)
+        authenticate(self.api, client.user)
+        for language in ('en', 'ar'):
+            listed = self.api.get('/api/companies/', HTTP_ACCEPT_LANGUAGE=language).data['results'][0]
+            detail = self.api.get(f'/api/companies/{self.company.id}/', HTTP_ACCEPT_LANGUAGE=language).data
+            self.assertEqual(listed, detail)
+
+    def test_cards_follow_company_and_photo_changes(self):
+        incomplete = make_company(1, self.category, about_en='')
+        self.assertFalse(CompanyCard.objects.get(pk=incomplete.pk).is_listable)
+        incomplete.about_en = 'About 1'
+        incomplete.save()
+        self.assertTrue(CompanyCard.objects.get(pk=incomplete.pk).is_listable)
+
+        self.company.photos.get().delete()
+        self.assertEqual(self.api.get('/api/companies/').data['results'][0]['photos'], [])
+        self.company.delete()
+        self.assertFalse(CompanyCard.objects.filter(pk=self.company.pk).exists())
+
+    def test_migrate_renders_missing_cards(self):
+        CompanyCard.objects.all().delete()
+        emit_post_migrate_signal(0, False, 'default')
+        card = CompanyCard.objects.get(pk=self.company.pk)
+        self.assertTrue(card.is_listable)
+        self.assertEqual(card.thumbnail, 'company_photos/a.png')
+
+    def test_compact_cards_use_the_first_photo_as_thumbnail(self):
+        item = self.api.get('/api/companies/', {'fields': 'compact'}).data['results'][0]
+        self.assertEqual(item['thumbnail'], 'http://testserver/media/company_photos/a.png')
+
+    def test_rebuild(self):
+        CompanyCard.objects.all().delete()
+        self.assertEqual(cards.rebuild(), 1)
+        self.assertEqual(CompanyCard.objects.get().json_en, cards.render(self.company, 'en'))
+
+
+class AppointmentEventTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.company = make_company(0, category)
+        self.client_profile = make_client(0)
+        self.date = datetime.date.today() + datetime.timedelta(days=7)
+        self.broker = events.InProcessBroker()
+        patcher = mock.patch.object(events, 'broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def history(self, channel):
+        return [(event['id'], event['type']) for event in self.broker.history.get(channel, ())]
+
+    def test_events_are_published_on_commit_to_both_parties(self):
+        api = APIClient()
+        authenticate(api, self.client_profile.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = api.post(f'/api/book_appointment/{self.company.id}', {
+                'date': self.date.isoformat(), 'time': '10:00',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(self.history(events.company_channel(self.company.id)), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.history(events.client_channel(self.client_profile.id)), [(1, 'appointment.created')])
+        self.assertEqual(self.history(events.company_channel(self.company.id)), [(2, 'appointment.created')])
+
+    def test_reconnecting_replays_missed_events(self):
+        appointment = Appointment.objects.create(
+            client=self.client_profile, company=self.company, date=self.date, time=datetime.time(10),
+        )
+        channel = events.company_channel(self.company.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            events.publish_appointments('created', [events.appointment_row(appointment)])
+            events.publish_appointments('status', [events.appointment_row(appointment)])
+
+        async def replay():
+            body = events.stream(channel, last_event_id=1)
+            chunks = [await body.__anext__(), await body.__anext__()]
+            await body.aclose()
+            return chunks, self.broker.subscribers
+
+        chunks, subscribers = async_to_sync(replay)()
+        self.assertEqual(chunks[0], 'retry: 3000\n\n')
+        self.assertTrue(chunks[1].startswith('id: 2\nevent: appointment.created\ndata: '))
+        self.assertIn(f'"date":"{self.date.isoformat()}"', chunks[1])
+        self.assertEqual(subscribers, {})
+
+    async def test_stream_requires_a_token(self):
+        response = await AsyncClient().get('/api/events/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_stream_is_refused_under_wsgi(self):
+        instance, token = AuthToken.objects.create(self.company.user)
+        response = self.client.get('/api/events/', HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(response.status_code, 501)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+
+    async def test_stream_delivers_live_events(self):
+        instance, token = await sync_to_async(AuthToken.objects.create)(self.company.user)
+        response = await AsyncClient().get('/api/events/', headers={'Authorization': f'Token {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = aiter(response.streaming_content)
+        self.assertEqual(await anext(body), b'retry: 3000\n\n')
+        event = {'type': 'appointment.status', 'appointment': {'id': 1}}
+        self.broker.publish(events.company_channel(self.company.id), event)
+        self.assertEqual(await asyncio.wait_for(anext(body), 1), events.format_event({'id': 1, **event}).encode())
+        await body.aclose()
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        # Unread counts are cached by user id, which rolled back tests reuse.
+        cache.clear()
+        category = Category.objects.create(name='Salons Service')
+        self.company = make_company(0, category, slot_minutes=30, slot_capacity=1)
+        self.date = datetime.date.today() + datetime.timedelta(days=7)
+        WorkingHours.objects.create(
+            company=self.company, weekday=self.date.weekday(),
+            opens_at=datetime.time(9), closes_at=datetime.time(11),
+        )
+        self.client_profile = make_client(0)
+        self.api = APIClient()
+
+    def test_bulk_booking_writes_one_batch(self):
+        authenticate(self.api, self.client_profile.user)
+        slots = [{'date': self.date.isoformat(), 'time': time} for time in ('09:00', '09:30', '10:00')]
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.api.post(f'/api/book_appointments/{self.company.id}', {'slots': slots}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Notification.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        inserts = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Notification.objects.filter(user_id=self.company.user_id).count(), 3)
+
+    def test_status_changes_and_favorites_notify_the_other_party(self):
+        appointment = Appointment.objects.create(
+            client=self.client_profile, company=self.company, date=self.date, time=datetime.time(9),
+        )
+        authenticate(self.api, self.company.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api.post(f'/api/status_appointment/{appointment.id}', {'status': 'confirmed'}, format='json')
+        self.assertEqual(
+            list(Notification.objects.filter(user_id=self.client_profile.user_id).values_list('title', flat=True)),
+            ['Appointment confirmed'],
+        )
+        authenticate(self.api, self.client_profile.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api.post(f'/api/favorite/{self.company.id}')
+            self.api.post(f'/api/favorite/{self.company.id}')
+        self.assertEqual(Notification.objects.filter(user_id=self.company.user_id, title='New favorite').count(), 1)
+
+    def test_messages_render_in_the_readers_language(self):
+        appointment = Appointment.objects.create(
+            client=self.client_profile, company=self.company, date=self.date, time=datetime.time(9),
+        )
+        authenticate(self.api, self.company.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api.post(
+                f'/api/status_appointment/{appointment.id}', {'status': 'confirmed'}, format='json',
+                HTTP_ACCEPT_LANGUAGE='ar',
+            )
+        stored = Notification.objects.get(user_id=self.client_profile.user_id)
+        self.assertEqual((stored.message, stored.params['status']), ('appointment.status', 'confirmed'))
+
+        def tagged(message):
+            return f'{translation.get_language()}:{message}'
+
+        authenticate(self.api, self.client_profile.user)
+        with mock.patch('dawrni_app.notifications.gettext', side_effect=tagged):
+            item = self.api.get('/api/notifications/', HTTP_ACCEPT_LANGUAGE='ar').data['results'][0]
+        self.assertEqual(item['title'], 'ar:Appointment ar:confirmed')
+
+    def test_inbox_pages_newest_first(self):
+        Notification.objects.bulk_create(
+            Notification(user_id=self.client_profile.user_id, title=f'Title {index}', body='') for index in range(5)
+        )
+        Notification.objects.create(user_id=self.company.user_id, title='Other', body='')
+        authenticate(self.api, self.client_profile.user)
+        response = self.api.get('/api/notifications/?limit=3')
+        self.assertEqual([item['title'] for item in response.data['results']], ['Title 4', 'Title 3', 'Title 2'])
+        response = self.api.get(response.data['next'])
+        self.assertEqual([item['title'] for item in response.data['results']], ['Title 1', 'Title 0'])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.api.get(f'/api/notifications/{Notification.objects.get(title="Other").id}/').status_code, 404)
+
+    def test_unread_count_is_cached_until_it_changes(self):
+        user_id = self.client_profile.user_id
+        notifications.write([Notification(user_id=user_id, title='Hello', body='') for index in range(2)])
+        authenticate(self.api, self.client_profile.user)
+        self.assertEqual(self.api.get('/api/notifications/unread/').data, {'unread': 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(notifications.unread_count(user_id), 2)
+
+        first = Notification.objects.filter(user_id=user_id).order_by('id').first()
+        response = self.api.post('/api/notifications/read/', {'ids': [first.id]}, format='json')
+        self.assertEqual(response.data, {'updated': 1, 'unread': 1})
+        notifications.write([Notification(user_id=user_id, title='Again', body='')])
+        self.assertEqual(notifications.unread_count(user_id), 2)
+        self.assertEqual(self.api.post('/api/notifications/read/').data, {'updated': 2, 'unread': 0})
+
+    def test_inbox_requires_authentication(self):
+        self.assertEqual(self.api.get('/api/notifications/').status_code, 401)
+
+
+class RowSerializerTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Salons Service')
+        self.client_profile = make_client(0)
+        Client.objects.filter(pk=self.client_profile.pk).update(
+            name_ar='عميل', photo='clients/0.png', photo_variants={'thumb': 'clients/0_thumb.webp'},
+        )
+        date = datetime.date.today() + datetime.timedelta(days=7)
+        for index in range(3):
+            company = make_company(index, category)
+            if index:
+                Company.objects.filter(pk=company.pk).update(
+                    image=f'companies/{index}.png', image_variants={'medium': f'companies/{index}_medium.webp'},
+                )
+                CompanyPhoto.objects.create(company=company, image=f'photos/{index}.png', variants={'thumb': 't.webp'})
+                CompanyPhoto.objects.create(company=company, image=f'photos/{index}b.png')
+            Appointment.objects.create(client=self.client_profile, company=company, date=date, time=datetime.time(9 + index))
+            if index != 1:
+                Favorite.objects.create(client=self.client_profile, company=company)
+
+    def request(self, language):
+        request = APIRequestFactory().get('/api/', HTTP_ACCEPT_LANGUAGE=language)
+        request.user = self.client_profile.user
+        return request
+
+    def assertSameJSON(self, shape, serializer_class, queryset):
+        for language in ('en', 'ar'):
+            request = self.request(language)
+            expected = serializer_class(queryset, many=True, context={'request': request}).data
+            self.assertEqual(
+                JSONRenderer().render(rows.serialize(shape, queryset, request)), JSONRenderer().render(expected),
+            )
+
+    def test_appointments_render_byte_for_byte(self):
+        self.assertSameJSON(rows.APPOINTMENT, AppointmentSerializer, Appointment.objects.order_by('id'))
+
+    def test_favorites_render_byte_for_byte(self):
+        self.assertSameJSON(rows.FAVORITE, FavoriteSerializer, Favorite.objects.order_by('id'))
+
+    def test_appointment_list_queries(self):
+        api = APIClient()
+        authenticate(api, self.client_profile.user)
+        api.get('/api/client_appointments/')
+        # The appointments with their client and company, the photos of the
+        # page and the client's favorites.
+        with CaptureQueriesContext(connection) as queries:
+            response = api.get('/api/client_appointments/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(len(queries), 3)
+
+
+class FastJSONRendererTests(TestCase):
+    data = {
+        'name': 'شركة الصالون',
+        'about': 'line\u2028separator',
+        'date': datetime.date(2024, 3, 1),
+        'time': datetime.time(9, 30),
+        'created_at': datetime.datetime(2024, 3, 1, 9, 30, 5, 120000, tzinfo=datetime.timezone.utc),
+        'naive': datetime.datetime(2024, 3, 1, 9, 30),
+        'price': decimal.Decimal('10.50'),
+        'duration': datetime.timedelta(minutes=30),
+        'uuid': uuid.UUID(int=1),
+        'lazy': gettext_lazy('Invalid cursor'),
+        'variants': {'thumb': None},
+        'ids': (1, 2),
+        'counts': {1: 2},
+    }
+
+    def test_output_matches_json_renderer(self):
+        self.assertTrue(renderers.orjson)
+        self.assertEqual(renderers.FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_indent_and_missing_orjson_fall_back(self):
+        renderer = renderers.FastJSONRenderer()
+        indented = renderer.render(self.data, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render(self.data, 'application/json; indent=2'))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderer.render(self.data), JSONRenderer().render(self.data))
+
+    def test_unsupported_values_fail_like_json_renderer(self):
+        self.assertEqual(renderers.FastJSONRenderer().render({'big': 2 ** 70}), b'{"big":1180591620717411303424}')
+        with self.assertRaises(TypeError):
+            renderers.FastJSONRenderer().render({'value': object()})
+
+
+@override_settings(DAWRNI_PASSWORDS={'SCRYPT_WORK_FACTOR': 2 ** 4, 'QUEUE_TIMEOUT': 0})
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = custom_user.objects.create(
+            username='client0@example.com', email='client0@example.com', user_type='user',
+        )
+
+    def login(self, password='correct horse'):
+        return APIClient().post('/api/login/', {'email': 'client0@example.com', 'password': password}, format='json')
+
+    def test_login_upgrades_outdated_hashes(self):
+        self.user.password = make_password('correct horse', hasher='pbkdf2_sha256')
+        self.user.save()
+        self.assertEqual(self.login('wrong horse').status_code, 400)
+        self.assertTrue(custom_user.objects.get(pk=self.user.pk).password.startswith('pbkdf2_sha256$'))
+
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['email'], 'client0@example.com')
+        self.assertIn('login;dur=', response['Server-Timing'])
+        encoded = custom_user.objects.get(pk=self.user.pk).password
+        self.assertTrue(encoded.startswith('scrypt$'))
+
+        # A new cost is picked up the same way.
+        with override_settings(DAWRNI_PASSWORDS={'SCRYPT_WORK_FACTOR': 2 ** 5, 'QUEUE_TIMEOUT': 0}):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertNotEqual(custom_user.objects.get(pk=self.user.pk).password, encoded)
+
+    def test_login_looks_the_user_up_once(self):
+        self.user.password = make_password('correct horse')
+        self.user.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.login().status_code, 200)
+        lookups = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'knox_authtoken' not in query['sql']
+            and not is_throttle_query(query['sql'])
+        ]
+        self.assertEqual(len(lookups), 1)
+
+    def test_unknown_email_is_rejected(self):
+        response = APIClient().post('/api/login/', {'email': 'nobody@example.com', 'password': 'x' * 8})
+        self.assertEqual(response.status_code, 400)
+
+    def test_busy_workers_answer_503(self):
+        self.user.password = make_password('correct horse')
+        self.user.save()
+        executor, slots, workers = passwords.get_pool()
+        with mock.patch.object(passwords, 'pool', (executor, threading.BoundedSemaphore(1), 1)):
+            passwords.pool[1].acquire()
+            response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertGreaterEqual(metrics.snapshot()['counters']['passwords.rejected'], 1)
+
+    def test_register_hashes_with_the_preferred_hasher(self):
+        response = APIClient().post('/api/register/', {
+            'email': 'new@example.com', 'password': 'long enough', 'user_type': 'user',
+        })
+        self.assertEqual(response.status_code, 200)
+        user = custom_user.objects.get(email='new@example.com')
+        self.assertTrue(user.password.startswith('scrypt$'))
+        self.assertTrue(user.check_password('long enough'))
+
+
+@override_settings(DAWRNI_THROTTLE={
+    'RATES': {'login.ip': '5/min', 'login.email': '2/hour', 'verify.ip': '100/min', 'verify.email': '100/hour'},
+    'VERIFY_FAILURES': 3,
+})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.api = APIClient()
+
+    def login(self, email):
+        return self.api.post('/api/login/', {'email': email, 'password': 'wrong password'})
+
+    def test_login_buckets_per_email_and_ip(self):
+        self.assertEqual(self.login('a@example.com').status_code, 400)
+        self.assertEqual(self.login('A@example.com ').status_code, 400)
+        # The bucket is checked before the user is looked up.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login('a@example.com')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(all(is_throttle_query(query['sql']) for query in queries.captured_queries))
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        self.assertEqual(self.login('b@example.com').status_code, 400)
+        self.assertEqual(self.login('c@example.com').status_code, 400)
+        # Five requests have emptied the IP bucket.
+        self.assertEqual(self.login('d@example.com').status_code, 429)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['throttle.login.email.rejected'], 1)
+        self.assertEqual(counters['throttle.login.ip.rejected'], 1)
+
+    def test_forwarded_for_header_does_not_reset_the_ip_bucket(self):
+        for index in range(5):
+            response = self.api.post('/api/login/', {
+                'email': f'{index}@example.com', 'password': 'wrong password',
+            }, HTTP_X_FORWARDED_FOR=f'10.0.0.{index}')
+            self.assertEqual(response.status_code, 400)
+        response = self.api.post('/api/login/', {
+            'email': 'last@example.com', 'password': 'wrong password',
+        }, HTTP_X_FORWARDED_FOR='10.0.0.99')
+        self.assertEqual(response.status_code, 429)
+
+    def test_buckets_are_shared_between_processes(self):
+        self.assertEqual(throttling.take('login.email', 'a@example.com'), 0)
+        self.assertEqual(throttling.take('login.email', 'a@example.com'), 0)
+        # Nothing of the bucket lives in this process's memory.
+        cache.clear()
+        self.assertGreater(throttling.take('login.email', 'a@example.com'), 0)
+        self.assertEqual(ThrottleBucket.objects.count(), 1)
+
+    def test_idle_buckets_are_deleted(self):
+        with mock.patch('dawrni_app.throttling.time.time', return_value=1000.0):
+            throttling.take('login.email', 'a@example.com')
+        with mock.patch('dawrni_app.throttling.time.time', return_value=1000.0 + throttling.IDLE_BUCKET_SECONDS + 1):
+            throttling.take('login.email', 'b@example.com')
+        self.assertEqual(ThrottleBucket.objects.count(), 1)
+
+    def test_buckets_refill(self):
+        with mock.patch('dawrni_app.throttling.time.time', return_value=1000.0):
+            self.assertEqual(throttling.take('login.email', 'a@example.com'), 0)
+            self.assertEqual(throttling.take('login.email', 'a@example.com'), 0)
+            self.assertAlmostEqual(throttling.take('login.email', 'a@example.com'), 1800)
+        with mock.patch('dawrni_app.throttling.time.time', return_value=2800.0):
+            self.assertEqual(throttling.take('login.email', 'a@example.com'), 0)
+
+    def test_failed_verifications_lock_the_email(self):
+        user = make_client(0).user
+        code = otp.issue(user)
+
+        def verify(code):
+            return self.api.post('/api/verify/', {'email': user.email, 'code_name': code})
+
+        for attempt in range(3):
+            self.assertEqual(verify('0000').status_code, 400)
+        response = verify(code)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(metrics.snapshot()['counters']['throttle.verify.lockouts'], 1)
+
+        throttling.get_cache().delete(throttling.lockout_key(user.email))
+        self.assertEqual(verify(code).status_code, 200)
+        self.assertIsNone(throttling.get_cache().get(throttling.failures_key(user.email)))
+
+    def test_failures_slide_out_of_the_window(self):
+        # The database cache expires entries by the real clock, so the mocked
+        # clock needs a cache that uses time.time() too.
+        locmem = override_settings(DAWRNI_THROTTLE={'CACHE': 'default', 'VERIFY_FAILURES': 3})
+        locmem.enable()
+        self.addCleanup(locmem.disable)
+        window = throttling.DEFAULTS['VERIFY_WINDOW']
+        with mock.patch('dawrni_app.throttling.time.time', return_value=window * 10 + window * 0.9):
+            throttling.record_failure('a@example.com')
+            throttling.record_failure('a@example.com')
+        # Most of the previous window has slid past: 2 * 0.2 + 2 < 3.
+        with mock.patch('dawrni_app.throttling.time.time', return_value=window * 11 + window * 0.8):
+            throttling.record_failure('a@example.com')
+            throttling.record_failure('a@example.com')
+            self.assertEqual(throttling.locked_for('a@example.com'), 0)
+            throttling.record_failure('a@example.com')
+            self.assertGreater(throttling.locked_for('a@example.com'), 0)
+
+    def test_metrics_are_exposed_to_staff(self):
+        self.login('a@example.com')
+        staff = custom_user.objects.create(username='staff@example.com', email='staff@example.com', is_staff=True)
+        self.assertEqual(self.api.get('/api/metrics/').status_code, 401)
+        authenticate(self.api, staff)
+        response = self.api.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['observations']['passwords.hash']['count'], 1)
+
+
+class TokenPruningTests(TestCase):
+    def setUp(self):
+        self.user = make_client(0).user
+
+    @override_settings(DAWRNI_TOKENS={'MAX_PER_USER': 2})
+    def test_new_tokens_evict_the_oldest(self):
+        api = APIClient()
+        first = tokens.create(self.user)[1]
+        api.credentials(HTTP_AUTHORIZATION=f'Token {first}')
+        self.assertEqual(api.get('/api/user/').status_code, 200)
+        AuthToken.objects.filter(digest=hash_token(first)).update(
+            created=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        second = tokens.create(self.user)[1]
+        third = tokens.create(self.user)[1]
+        self.assertEqual(
+            set(AuthToken.objects.filter(user=self.user).values_list('digest', flat=True)),
+            {hash_token(second), hash_token(third)},
+        )
+        # The evicted token is dropped from the token cache too.
+        self.assertEqual(api.get('/api/user/').status_code, 401)
+
+    def test_expired_tokens_are_deleted_in_batches(self):
+        for index in range(5):
+            tokens.create(self.user)
+        AuthToken.objects.filter(
+            digest__in=AuthToken.objects.values_list('digest', flat=True)[:3],
+        ).update(expiry=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(tokens.prune_expired(2), 2)
+        self.assertEqual(tokens.prune_expired(2), 1)
+        self.assertEqual(tokens.prune_expired(2), 0)
+        self.assertEqual(AuthToken.objects.count(), 2)
+
+    def test_batch_size_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            tokens.prune_expired(0)
+        with self.assertRaises(CommandError):
+            call_command('prune_tokens', '--batch-size', '0', stdout=io.StringIO())
+
+    def test_command_reports_deletions_and_table_size(self):
+        tokens.create(self.user)
+        AuthToken.objects.update(expiry=timezone.now() - datetime.timedelta(seconds=1))
+        out = io.StringIO()
+        call_command('prune_tokens', stdout=out)
+        self.assertIn('Deleted 1 expired token(s)', out.getvalue())
+        self.assertIn('Token table: 1 -> 0 rows', out.getvalue())
+        self.assertEqual(tokens.table_size()[0], 0)
@@ -0,0 +1,203 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Least
+from django.db.models.lookups import GreaterThanOrEqual
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+from .models import ThrottleBucket
+
+
+DEFAULTS = {
+    # CACHES alias holding the verify failures and lockouts. It has to be
+    # shared between workers, or each one counts failures on its own.
+    'CACHE': 'shared',
+    # Bucket size and refill per scope: '10/min' allows bursts of 10 and
+    # gives a request back every 6 seconds.
+    'RATES': {
+        'login.ip': '30/min',
+        'login.email': '10/hour',
+        'verify.ip': '30/min',
+        'verify.email': '10/hour',
+    },
+    # Failed verifications of an email within WINDOW seconds (a sliding
+    # window) before verify is locked for LOCKOUT seconds.
+    'VERIFY_FAILURES': 5,
+    'VERIFY_WINDOW': 15 * 60,
+    'VERIFY_LOCKOUT': 15 * 60,
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+# Buckets untouched for this long are full whatever their rate, so they
+# are deleted as new ones are created.
+IDLE_BUCKET_SECONDS = PERIODS['d']
+BUCKET_ATTEMPTS = 3
+
+
+def throttle_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_THROTTLE', {})}
+
+
+def get_cache():
+    return caches[throttle_settings()['CACHE']]
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 10 / 60): the bucket size and tokens per second."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+def digest(value):
+    # Emails are user input; keep them out of cache keys and bucket rows.
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def take(scope, ident):
+    """Take a token from the bucket of ident in scope.
+
+    Returns the seconds to wait for the next token, or 0 when the request
+    may go ahead. A bucket is one ThrottleBucket row of (tokens, updated)
+    refilled on read. The refill and the take are one conditional UPDATE,
+    so concurrent requests of every worker never spend the same token.
+    """
+    capacity, refill = parse_rate(throttle_settings()['RATES'][scope])
+    key = f'{scope}:{digest(ident)}'
+    for attempt in range(BUCKET_ATTEMPTS):
+        now = time.time()
+        available = Least(
+            Value(float(capacity)),
+            F('tokens') + (Value(now) - F('updated')) * Value(refill),
+            output_field=FloatField(),
+        )
+        taken = ThrottleBucket.objects.filter(GreaterThanOrEqual(available, 1), key=key).update(
+            tokens=available - 1, updated=now,
+        )
+        if taken:
+            return 0
+        bucket = ThrottleBucket.objects.filter(key=key).values_list('tokens', 'updated').first()
+        if bucket is None:
+            try:
+                with transaction.atomic():
+                    ThrottleBucket.objects.create(key=key, tokens=capacity - 1, updated=now)
+            except IntegrityError:
+                # Created by a concurrent request; take from that one.
+                continue
+            ThrottleBucket.objects.filter(updated__lt=now - IDLE_BUCKET_SECONDS).delete()
+            return 0
+        tokens, updated = bucket
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        if tokens < 1:
+            return (1 - tokens) / refill
+        # Refilled between the UPDATE and the read; try again.
+    return 1 / refill
+
+
+def lockout_key(email):
+    return f'dawrni:lockout:{digest(email)}'
+
+
+def failures_key(email):
+    return f'dawrni:failures:{digest(email)}'
+
+
+def request_email(request):
+    """The email of a login or verify request body, normalized, or None."""
+    data = request.data
+    email = data.get('email') if hasattr(data, 'get') else None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def locked_for(email):
+    """Seconds left of the email's verify lockout, 0 when not locked."""
+    until = get_cache().get(lockout_key(email))
+    return max(0, until - time.time()) if until else 0
+
+
+def record_failure(email):
+    """Count a failed verification of email and lock it once the failures
+    of the last VERIFY_WINDOW seconds reach VERIFY_FAILURES.
+
+    The window slides by weighting the count of the previous fixed window
+    by how much of it still overlaps, which keeps it to one cache entry.
+    The entry is read and written back, so failures racing each other may
+    be counted once; the per-email verify bucket bounds how many can race.
+    """
+    options = throttle_settings()
+    window = options['VERIFY_WINDOW']
+    cache = get_cache()
+    now = time.time()
+    current_window = int(now // window)
+    index, current, previous = cache.get(failures_key(email), (current_window, 0, 0))
+    if index != current_window:
+        previous = current if index == current_window - 1 else 0
+        current = 0
+    current += 1
+    cache.set(failures_key(email), (current_window, current, previous), window * 2)
+    if previous * (1 - now % window / window) + current >= options['VERIFY_FAILURES']:
+        cache.set(lockout_key(email), now + options['VERIFY_LOCKOUT'], options['VERIFY_LOCKOUT'])
+        metrics.increment('throttle.verify.lockouts')
+
+
+def clear_failures(email):
+    get_cache().delete_many([failures_key(email), lockout_key(email)])
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token bucket per get_ident() of the request in scope."""
+
+    scope = None
+
+    def allow_request(self, request, view):
+        ident = self.get_ident(request)
+        self.wait_seconds = take(self.scope, ident) if ident else 0
+        if self.wait_seconds:
+            metrics.increment(f'throttle.{self.scope}.rejected')
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class EmailThrottle(TokenBucketThrottle):
+    """Token bucket per email in the request body."""
+
+    def get_ident(self, request):
+        return request_email(request)
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    scope = 'login.ip'
+
+
+class LoginEmailThrottle(EmailThrottle):
+    scope = 'login.email'
+
+
+class VerifyIPThrottle(TokenBucketThrottle):
+    scope = 'verify.ip'
+
+
+class VerifyEmailThrottle(EmailThrottle):
+    scope = 'verify.email'
+
+
+class VerifyLockoutThrottle(BaseThrottle):
+    """Rejects verify for emails locked by record_failure()."""
+
+    def allow_request(self, request, view):
+        email = request_email(request)
+        self.wait_seconds = locked_for(email) if email else 0
+        if self.wait_seconds:
+            metrics.increment('throttle.verify.locked')
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
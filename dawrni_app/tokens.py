@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from knox.models import AuthToken
+
+
+DEFAULTS = {
+    # Tokens kept per user; logging in again evicts the oldest ones. None
+    # keeps every token until it expires.
+    'MAX_PER_USER': 10,
+    # Expired tokens deleted per statement by prune_expired().
+    'BATCH_SIZE': 1000,
+}
+
+
+def token_settings():
+    return {**DEFAULTS, **getattr(settings, 'DAWRNI_TOKENS', {})}
+
+
+def create(user):
+    """AuthToken.objects.create(user), then drop the user's oldest tokens
+    beyond MAX_PER_USER. Returns (instance, token) like knox."""
+    limit = token_settings()['MAX_PER_USER']
+    with transaction.atomic():
+        instance, token = AuthToken.objects.create(user)
+        if limit is not None:
+            stale = list(
+                AuthToken.objects.filter(user=user).order_by('-created', 'pk').values_list('pk', flat=True)[limit:]
+            )
+            if stale:
+                # Through the ORM, so post_delete evicts them from the
+                # token cache.
+                AuthToken.objects.filter(pk__in=stale).delete()
+    return instance, token
+
+
+def prune_expired(batch_size=None):
+    """Delete one batch of expired tokens; returns how many were deleted.
+
+    The batch is picked through the expiry index, so each call costs the
+    same however large the table is.
+    """
+    if batch_size is None:
+        batch_size = token_settings()['BATCH_SIZE']
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    digests = list(
+        AuthToken.objects.filter(expiry__lt=timezone.now()).order_by('expiry').values_list('pk', flat=True)[:batch_size]
+    )
+    if digests:
+        AuthToken.objects.filter(pk__in=digests).delete()
+    return len(digests)
+
+
+def table_size():
+    """(rows, bytes) of the token table; bytes is None where unknown."""
+    rows = AuthToken.objects.count()
+    table = AuthToken._meta.db_table
+    size = None
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+            size = cursor.fetchone()[0]
+        elif connection.vendor == 'sqlite':
+            try:
+                # The table and its indexes; needs SQLite built with dbstat.
+                cursor.execute(
+                    'SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR name IN '
+                    '(SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s)',
+                    [table, 'index', table],
+                )
+                size = cursor.fetchone()[0]
+            except DatabaseError:
+                size = None
+    return rows, size
+
+
+def compact():
+    """Return the space of deleted rows to the database, where supported.
+
+    On SQLite this rebuilds the whole database file.
+    """
+    table = connection.ops.quote_name(AuthToken._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'VACUUM ANALYZE {table}')
+        elif connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+        else:
+            return False
+    return True
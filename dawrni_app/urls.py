@@ -2,7 +2,7 @@ from django.urls import path, include
 from knox import views as knox_views
 from . import views
 from rest_framework.routers import DefaultRouter
-from .views import CompanyViewSet , ClientViewSet, FavoriteViewSet, AppointmentViewSet, AppointmentCompanyViewSet
+from .views import CompanyViewSet , ClientViewSet, FavoriteViewSet, AppointmentViewSet, AppointmentCompanyViewSet, NotificationViewSet
 
 
 router = DefaultRouter()
@@ -11,6 +11,7 @@ router.register(r'clients', ClientViewSet, basename='client')
 router.register(r'favorite_list', FavoriteViewSet, basename='favorite_list')
 router.register(r'client_appointments', AppointmentViewSet, basename='clien_app')
 router.register(r'company_appointments', AppointmentCompanyViewSet, basename='company_app')
+router.register(r'notifications', NotificationViewSet, basename='notification')
 
 
 urlpatterns = [
@@ -18,6 +19,7 @@ urlpatterns = [
     path('login/', views.login),
     path('register/', views.register),
     path('verify/', views.verify),
+    path('resend_otp/', views.resend_otp),
     path('logout/', knox_views.LogoutView.as_view(), name='knox_logout'),
     path('profile/', views.profile),
 
@@ -33,6 +35,11 @@ urlpatterns = [
     path('book_appointment/<int:company_id>', views.book_an_appointment),
     path('delete_appointment/<int:appointment_id>', views.book_an_appointment),
     path('status_appointment/<int:appointment_id>', views.change_appointment_status),
+    path('book_appointments/<int:company_id>', views.book_appointments),
+    path('status_appointments/', views.change_appointment_statuses),
+    path('working_hours/', views.working_hours),
+    path('events/', views.appointment_events),
+    path('metrics/', views.process_metrics),
     
     path('privacy_policy/', views.privacy_policy, name='privacy_policy'),
 
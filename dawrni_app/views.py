@@ -1,24 +1,34 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, action, permission_classes, throttle_classes
 from rest_framework import viewsets, filters
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from knox.auth import AuthToken, TokenAuthentication
 from .serializers import *
 from .email import *
-from .models import Company, custom_user, Category
+from .models import Company, custom_user, Category, Notification, WorkingHours
 from rest_framework import status
 from django.utils.translation import gettext as _
 from rest_framework import exceptions
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q
+from django.db import transaction
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.decorators import parser_classes
 from wsgiref.simple_server import demo_app
 from django.shortcuts import render, redirect
+from rest_framework.utils.urls import replace_query_param
+from . import accounts, availability, cards, events, geo, metrics, notifications, otp, passwords, response_cache, rows, search, throttling, tokens
+from .authentication import CachedTokenAuthentication
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from .pagination import KeysetPagination
+import base64
+import time
 
 
 class AuthTokenSerializer(serializers.Serializer):
@@ -63,13 +73,13 @@ def profile(request):
     user = request.user
     if user.is_authenticated:
         try:
-            company = Company.objects.get(user=user)
+            company = accounts.get_company(request)
             serializer = CompanyProfileSerializer(company, context={'request': request})
             return Response(serializer.data)
         except Company.DoesNotExist:
             pass
         try:
-            client = Client.objects.get(user=user)
+            client = accounts.get_client(request)
             serializer = ClientProfileSerializer(client, context={'request': request})
             return Response(serializer.data)
         except Client.DoesNotExist:
@@ -84,7 +94,7 @@ def Companyphotos(request, photo_id=None):
     user = request.user
     if user.is_authenticated:
         try:
-            company = Company.objects.get(user=user)
+            company = accounts.get_company(request)
         except Company.DoesNotExist:
             return Response({"error": "User is not associated with any company"}, status=400)
 
@@ -114,35 +124,47 @@ def Companyphotos(request, photo_id=None):
     return Response({"error": "Invalid HTTP method"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+def appointments_changed(kind, rows):
+    """Stream and notify created, status-changed or deleted appointments."""
+    rows = list(rows)
+    events.publish_appointments(kind, rows)
+    notifications.notify_appointments(kind, rows)
+
+
 class AppointmentViewSet(viewsets.ModelViewSet):
     serializer_class = AppointmentSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
+    keyset_ordering = ('date', 'time', 'id')
 
     def get_queryset(self):
-        user = self.request.user
-        client = Client.objects.get(user=user)
-        return Appointment.objects.filter(client=client)
+        client = accounts.get_client(self.request)
+        return Appointment.objects.filter(client=client).select_related('client', 'company').prefetch_related('company__photos')
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ["status", ]
 
+    def list(self, request, *args, **kwargs):
+        return rows.list_response(self, rows.APPOINTMENT, self.get_queryset())
+
 
 class AppointmentCompanyViewSet(viewsets.ModelViewSet):
     serializer_class = AppointmentSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
+    keyset_ordering = ('date', 'time', 'id')
 
     def get_queryset(self):
-        user = self.request.user
-        company = Company.objects.get(user=user)
-        return Appointment.objects.filter(company=company)
+        company = accounts.get_company(self.request)
+        return Appointment.objects.filter(company=company).select_related('client', 'company').prefetch_related('company__photos')
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ["status", ]
 
+    def list(self, request, *args, **kwargs):
+        return rows.list_response(self, rows.APPOINTMENT, self.get_queryset())
+
 
 @api_view(['POST'])
 def change_appointment_status(request, appointment_id=None):
     try:
-        user = request.user
-        company = Company.objects.get(user=user)    
+        company = accounts.get_company(request)    
         if request.method == 'POST':
             try:
                 appointment = Appointment.objects.get(id=appointment_id, company=company)
@@ -151,8 +173,11 @@ def change_appointment_status(request, appointment_id=None):
 
             new_status = request.data.get('status')
             if new_status in ['pending', 'confirmed', 'canceled']:
-                appointment.status = new_status
-                appointment.save()
+                try:
+                    availability.change_status(appointment, new_status)
+                except availability.SlotUnavailable as e:
+                    return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+                appointments_changed('status', [events.appointment_row(appointment)])
                 serializer = AppointmentSerializer(appointment, context={'request': request})
                 return Response(serializer.data, status=status.HTTP_200_OK)
             else:
@@ -162,31 +187,82 @@ def change_appointment_status(request, appointment_id=None):
         return Response({'error': 'Client not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+@api_view(['POST'])
+def change_appointment_statuses(request):
+    try:
+        company = accounts.get_company(request)
+    except Company.DoesNotExist:
+        return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = BulkStatusSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    changes = [(change['id'], change['status']) for change in serializer.validated_data['changes']]
+    try:
+        results = availability.change_statuses(company, changes)
+    except availability.BatchRejected as e:
+        code = status.HTTP_409_CONFLICT if e.conflict else status.HTTP_404_NOT_FOUND
+        return Response({'error': 'No appointment was changed', 'results': e.results}, status=code)
+    except availability.SlotUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    updated = [result['id'] for result in results if result['result'] == 'updated']
+    if updated:
+        appointments_changed('status', Appointment.objects.filter(pk__in=updated).values(
+            'id', 'client_id', 'company_id', 'date', 'time', 'status',
+        ))
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'PUT'])
+def working_hours(request):
+    try:
+        company = accounts.get_company(request)
+    except Company.DoesNotExist:
+        return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'PUT':
+        serializer = WorkingHoursSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            company.working_hours.all().delete()
+            WorkingHours.objects.bulk_create(
+                WorkingHours(company=company, **hours) for hours in serializer.validated_data
+            )
+
+    serializer = WorkingHoursSerializer(company.working_hours.order_by('weekday', 'opens_at'), many=True)
+    return Response(serializer.data)
+
+
 @api_view(['POST', 'DELETE'])
 def book_an_appointment(request, company_id=None, appointment_id=None):
     try:
-        user = request.user
-        client = Client.objects.get(user=user)    
+        client = accounts.get_client(request)    
 
         if request.method == 'POST':
             try:
                 company = Company.objects.get(pk=company_id)
             except Company.DoesNotExist:
                 return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
-            appointment_data = {
-                'client': client,
-                'company': company,
-                'date': request.data.get('date'), 
-                'time': request.data.get('time'),  
-            }
-            appointment = Appointment.objects.create(**appointment_data)
+            booking = BookingSerializer(data=request.data)
+            if not booking.is_valid():
+                return Response(booking.errors, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                appointment = availability.book(client, company, **booking.validated_data)
+            except availability.InvalidSlot as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except availability.SlotUnavailable as e:
+                return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+            appointments_changed('created', [events.appointment_row(appointment)])
             serializer = AppointmentSerializer(appointment, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         elif request.method == 'DELETE':
             try:
                 appointment = Appointment.objects.get(id=appointment_id, client=client)
+                row = events.appointment_row(appointment)
                 appointment.delete()
+                appointments_changed('deleted', [row])
                 return Response({'message': 'Appointment deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
             except Appointment.DoesNotExist:
                 return Response({'error': 'Appointment not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -195,34 +271,89 @@ def book_an_appointment(request, company_id=None, appointment_id=None):
         return Response({'error': 'Client not found'}, status=status.HTTP_404_NOT_FOUND)
     
 
+@api_view(['POST'])
+def book_appointments(request, company_id=None):
+    try:
+        client = accounts.get_client(request)
+    except Client.DoesNotExist:
+        return Response({'error': 'Client not found'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        company = Company.objects.get(pk=company_id)
+    except Company.DoesNotExist:
+        return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = BulkBookingSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    slots = [(slot['date'], slot['time']) for slot in serializer.validated_data['slots']]
+    try:
+        results = availability.book_many(client, company, slots)
+    except availability.BatchRejected as e:
+        code = status.HTTP_409_CONFLICT if e.conflict else status.HTTP_400_BAD_REQUEST
+        return Response({'error': 'No appointment was booked', 'results': e.results}, status=code)
+    except availability.SlotUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    appointments_changed('created', [
+        {'id': result['id'], 'client_id': client.pk, 'company_id': company.pk, 'date': result['date'],
+         'time': result['time'], 'status': 'pending'}
+        for result in results
+    ])
+    return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+
 class ClientViewSet(viewsets.ModelViewSet):
     serializer_class = ClientSerializer
     queryset = Client.objects.all() 
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     search_fields = ["name_ar", "name_en"]
 
 
 class FavoriteViewSet(viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        user = self.request.user
-        client = Client.objects.get(user=user)
-        return Favorite.objects.filter(client=client)
+        client = accounts.get_client(self.request)
+        return Favorite.objects.filter(client=client).select_related('company').prefetch_related('company__photos')
+
+    def list(self, request, *args, **kwargs):
+        return rows.list_response(self, rows.FAVORITE, self.get_queryset())
+
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-id',)
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['is_read']
+
+    def get_queryset(self):
+        return Notification.objects.filter(user_id=self.request.user.pk)
+
+    @action(detail=False)
+    def unread(self, request):
+        return Response({'unread': notifications.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'])
+    def read(self, request):
+        """Mark the notifications in ids, or all of them, as read."""
+        ids = request.data.get('ids')
+        if ids is not None and (not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids)):
+            return Response({'error': 'ids must be a list of notification ids'}, status=status.HTTP_400_BAD_REQUEST)
+        updated = notifications.mark_read(request.user.pk, ids)
+        return Response({'updated': updated, 'unread': notifications.unread_count(request.user.pk)})
 
 
 @api_view(['GET', 'POST', 'DELETE'])
 def favorite_company(request, company_id=None):
     try:
-        user = request.user
-        client = Client.objects.get(user=user) 
+        client = accounts.get_client(request) 
         if request.method == 'GET':
             try:
-                favorites = Favorite.objects.filter(client=client)
-                serializer = FavoriteSerializer(favorites,  context={'request': request}, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                favorites = Favorite.objects.filter(client=client).order_by('id')
+                return Response(rows.serialize(rows.FAVORITE, favorites, request), status=status.HTTP_200_OK)
             except Client.DoesNotExist:
                 return Response({'error': 'Client not found'}, status=status.HTTP_404_NOT_FOUND)
    
@@ -232,9 +363,7 @@ def favorite_company(request, company_id=None):
             except Company.DoesNotExist:
                 return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
             Favorite.objects.filter(client=client, company=company).delete()
-            company.is_favorite = False
-            company.save()
-            
+
             return Response({'message': 'Company removed from favorites'}, status=status.HTTP_204_NO_CONTENT)
         
         elif request.method == 'POST':
@@ -243,11 +372,8 @@ def favorite_company(request, company_id=None):
             except Company.DoesNotExist:
                 return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
             favorite, created = Favorite.objects.get_or_create(client=client, company=company)
-            
-            # Set is_favorite to True when adding to favorites
             if created:
-                company.is_favorite = True
-                company.save()
+                notifications.notify_favorite(client, company)
 
             serializer = FavoriteSerializer(favorite, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
@@ -264,7 +390,7 @@ def add_client_image(request):
     try:
         user = request.user
         if user.is_authenticated:
-            client = Client.objects.get(user=user)
+            client = accounts.get_client_for_update(request)
         else:
             return Response({'message':_("this client doesn't exiest")}, status=401)    
     except Client.DoesNotExist:
@@ -283,14 +409,15 @@ def Companyprofile(request):
     try:
         user = request.user
         if user.is_authenticated:
-            company = Company.objects.get(user=user)
+            company = accounts.get_company_for_update(request)
         else:
             return Response({'message':_("this company doesn't exiest")}, status=401)    
     except Company.DoesNotExist:
         return Response({'error': 'Company not found'}, status=status.HTTP_404_NOT_FOUND)
    
     # Delete the main image
-    company.image.delete()
+    company.image.delete(save=False)
+    company.save(update_fields=['image'])
 
     # Optionally, update the company serializer to exclude the deleted main image from the response
     serializer = CompanySerializer(company, context={'request': request})
@@ -303,7 +430,7 @@ def update_company(request):
     try:
         user = request.user
         if user.is_authenticated:
-            company = Company.objects.get(user=user)
+            company = accounts.get_company_for_update(request)
         else:
             return Response({'message':_("this company doesn't exiest")}, status=401)    
     except Company.DoesNotExist:
@@ -316,41 +443,146 @@ def update_company(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
  
+NEARBY_DEFAULT_RADIUS_KM = 10
+NEARBY_MAX_RADIUS_KM = 500
+NEARBY_DEFAULT_LIMIT = 10
+NEARBY_MAX_LIMIT = 50
+
+
 class CompanyViewSet(viewsets.ModelViewSet):
     serializer_class = CompanySerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Company.objects.filter(
-            name_en__isnull=False,
-            category__isnull=False,
-            address_en__gt='',
-            about_en__gt='',
-        )
+        queryset = Company.objects.listable().order_by('id')
+        if self.action in ('list', 'retrieve'):
+            language = self.request.META.get('HTTP_ACCEPT_LANGUAGE', 'en')
+            queryset = queryset.for_listing(language, requested_company_fields(self.request))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['company_fields'] = requested_company_fields(self.request)
+        return context
 
     def list(self, request, *args, **kwargs):
+        return response_cache.cached_response(request, 'list', lambda: self.render_list(request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return response_cache.cached_response(
+            request, 'detail', lambda: super(CompanyViewSet, self).retrieve(request, *args, **kwargs),
+        )
+
+    def render_list(self, request):
+        fields = requested_company_fields(request)
+        if not request.query_params.get('search') and fields in (COMPANY_DEFAULT_FIELDS, COMPANY_COMPACT_FIELDS):
+            response = self.render_cards(request, fields)
+            if response is not None:
+                return response
+
         queryset = self.get_queryset()
         queryset = self.filter_queryset(queryset)
 
         search_query = self.request.query_params.get('search', None)
         if search_query:
-            queryset = queryset.filter(
-                Q(name_ar__icontains=search_query) |
-                Q(name_en__icontains=search_query)
-            )
+            queryset = search.search_companies(queryset, search_query)
+            if 'search_rank' in queryset.query.annotations:
+                # Page through matches in rank order.
+                self.keyset_ordering = ('search_rank', 'id')
 
         # Apply pagination
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.serializer_class(page, many=True, context={'request': request})
+            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.serializer_class(queryset, many=True, context={'request': request})
+        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    def render_cards(self, request, fields):
+        """The listing served from the precomputed company cards."""
+        category = request.query_params.get('category')
+        if category:
+            # Leave invalid categories to the filter backend and its 400.
+            if not category.isdigit() or not Category.objects.filter(pk=category).exists():
+                return None
+            category = int(category)
+        language = 'ar' if request.META.get('HTTP_ACCEPT_LANGUAGE', 'en') == 'ar' else 'en'
+        self.keyset_ordering = ('company_id',)
+        page = self.paginate_queryset(cards.listing(language, category or None))
+        results = cards.render_page(request, page, language, compact=fields == COMPANY_COMPACT_FIELDS)
+        return self.get_paginated_response(results)
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        try:
+            lat = float(request.query_params['lat'])
+            lng = float(request.query_params['lng'])
+            radius_km = float(request.query_params.get('radius_km', NEARBY_DEFAULT_RADIUS_KM))
+            limit = int(request.query_params.get('limit', NEARBY_DEFAULT_LIMIT))
+        except (KeyError, ValueError):
+            return Response({'error': 'lat and lng are required numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return Response({'error': 'lat or lng out of range'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+            return Response({'error': f'radius_km must be between 0 and {NEARBY_MAX_RADIUS_KM}'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, NEARBY_MAX_LIMIT))
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                after_distance, after_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+                after = (float(after_distance), int(after_id))
+            except (ValueError, UnicodeDecodeError):
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            after = None
+
+        # The geohash ranges and the lat/lng box narrow the table down through
+        # the index; exact distances are only computed for those candidates.
+        candidates = self.filter_queryset(self.get_queryset()).filter(geo.nearby_filter(lat, lng, radius_km))
+        search_query = request.query_params.get('search')
+        if search_query:
+            candidates = search.search_companies(candidates, search_query)
+        ranked = []
+        for company_id, company_lat, company_lng in candidates.values_list('id', 'lat', 'lng'):
+            distance = geo.haversine(lat, lng, company_lat, company_lng)
+            if distance <= radius_km and (after is None or (distance, company_id) > after):
+                ranked.append((distance, company_id))
+        ranked.sort()
+        page = ranked[:limit]
+
+        language = request.META.get('HTTP_ACCEPT_LANGUAGE', 'en')
+        fields = requested_company_fields(request)
+        companies = Company.objects.for_listing(language, fields).in_bulk([company_id for distance, company_id in page])
+        results = []
+        for distance, company_id in page:
+            data = self.get_serializer(companies[company_id]).data
+            data['distance_km'] = round(distance, 3)
+            results.append(data)
+
+        next_url = None
+        if len(ranked) > limit:
+            last_distance, last_id = page[-1]
+            next_cursor = base64.urlsafe_b64encode(f'{last_distance!r}:{last_id}'.encode()).decode()
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        return Response({'next': next_url, 'results': results})
+
+    @action(detail=True, methods=['get'])
+    def slots(self, request, pk=None):
+        company = self.get_object()
+        try:
+            date = serializers.DateField().to_internal_value(request.query_params.get('date'))
+        except serializers.ValidationError:
+            return Response({'error': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'date': date,
+            'slot_minutes': company.slot_minutes,
+            'slots': availability.slots(company, date),
+        })
+
+    filter_backends = [DjangoFilterBackend]
     filterset_fields = ["category", ]
-    search_fields = ["name_ar", "name_en",]
 
 
 def serialize_user(user):
@@ -361,23 +593,37 @@ def serialize_user(user):
 
 
 @api_view(['POST'])
+@throttle_classes([throttling.LoginIPThrottle, throttling.LoginEmailThrottle])
 def login(request):
     email = request.data.get('email')
     password = request.data.get('password')
 
     if not email or not password: 
         return Response({'message': _('Please provide both email and password.')})
-    serializer = AuthTokenSerializer(data=request.data)
-    serializer.is_valid(raise_exception=True)
+    started = time.perf_counter()
+    serializer = AuthTokenSerializer(data=request.data, context={'request': request})
+    try:
+        serializer.is_valid(raise_exception=True)
+    except passwords.Busy:
+        metrics.increment('login.busy')
+        return Response(
+            {'error': _('Too many sign-ins at once, please try again.')},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'},
+        )
     user = serializer.validated_data['user']
-    s, token = AuthToken.objects.create(user)
-    c_user = custom_user.objects.get(email=user.email)
+    s, token = tokens.create(user)
+    # PooledModelBackend already returns the custom_user.
+    c_user = user if isinstance(user, custom_user) else custom_user.objects.get(pk=user.pk)
     user_serializer = CustomUserSerializer(c_user)
 
-    return Response({
+    elapsed = time.perf_counter() - started
+    metrics.observe('login', elapsed)
+    response = Response({
         "user": user_serializer.data,
         'token': token
     })
+    response['Server-Timing'] = f'login;dur={elapsed * 1000:.1f}'
+    return response
         
 
 @api_view(['POST'])
@@ -392,9 +638,16 @@ def register(request):
     serializer = RegisterSerializer(data=request.data)
 
     if serializer.is_valid(raise_exception=True):
-        user = serializer.save()
-        send_otp(serializer.data['email'])
-        s, token = AuthToken.objects.create(user)
+        try:
+            user = serializer.save()
+        except passwords.Busy:
+            metrics.increment('register.busy')
+            return Response(
+                {'error': _('Too many sign-ups at once, please try again.')},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'},
+            )
+        send_otp(user)
+        s, token = tokens.create(user)
 
         return Response({   
             "user_info": serialize_user(user),
@@ -407,16 +660,14 @@ def get_user(request):
     try:
         user = request.user
         if user.is_authenticated:
-            c_user = custom_user.objects.get(email=user.email)
-            company = Company.objects.filter(user=user).first()
-            client = Client.objects.filter(user=user).first()
-
-            if company:
-                image_url = str(company.image)
-            elif client:
-                image_url = str(client.photo)
-            else:
-                image_url = None
+            c_user = accounts.get_custom_user(request)
+            try:
+                image_url = str(accounts.get_company(request).image)
+            except Company.DoesNotExist:
+                try:
+                    image_url = str(accounts.get_client(request).photo)
+                except Client.DoesNotExist:
+                    image_url = None
 
             return Response({
                 "id": c_user.id,
@@ -435,6 +686,7 @@ def get_user(request):
 
 
 @api_view(['POST'])
+@throttle_classes([throttling.VerifyLockoutThrottle, throttling.VerifyIPThrottle, throttling.VerifyEmailThrottle])
 def verify(request):
     email = request.data.get('email')
     code_name = request.data.get('code_name')
@@ -444,37 +696,94 @@ def verify(request):
     try:
         data = request.data
         serializer = VerifyAccountSerializer(data = data)
-        if serializer.is_valid():
-            email = serializer.data['email']
-            code_name = serializer.data['code_name']
-
-            user = User.objects.filter(email=email)
-            if not user.exists():
-                return Response({
-                    'message': _('User with this email does not exist.'),
-                },status=404)
-            
-            if user[0].first_name != code_name:
-                return Response({
-                    'message': _('Invalid verification code.'),
-                },status=400)
-            user = user.first() 
-            user.save()
-            user_obj = custom_user.objects.get(email=email)
-            user_obj.is_verified = True
-            user_obj.save()
-            return Response({
-                'message': _('Verification successful.'),
-                'is_verified' : True,
-                'status': 200,
-            })
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            otp.verify(serializer.validated_data['email'], serializer.validated_data['code_name'])
+        except otp.OTPError as e:
+            throttling.record_failure(throttling.request_email(request))
+            if isinstance(e, otp.NoPendingCode):
+                return Response({'message': str(e)}, status=404)
+            if isinstance(e, otp.TooManyAttempts):
+                return Response({'message': str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            return Response({'message': str(e)}, status=400)
+        throttling.clear_failures(throttling.request_email(request))
+        return Response({
+            'message': _('Verification successful.'),
+            'is_verified' : True,
+            'status': 200,
+        })
 
     except:
         return Response({
             'message': _('An error occurred.'),
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)   
+
+
+@api_view(['POST'])
+def resend_otp(request):
+    email = request.data.get('email')
+    if not email:
+        return Response({'message': _('Please provide your email.')}, status=400)
+    user = custom_user.objects.filter(email=email).exclude(is_verified=True).first()
+    if user is None:
+        return Response({'message': _('There is no pending verification for this email.')}, status=404)
+    try:
+        send_otp(user)
+    except otp.ResendTooSoon as e:
+        return Response({'message': str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    return Response({'message': _('A new verification code has been sent.')})
     
 
+def event_channel(request):
+    """Channel of the authenticated user's company or client, or None."""
+    authenticated = CachedTokenAuthentication().authenticate(request)
+    if authenticated is None:
+        return None
+    request.user = authenticated[0]
+    try:
+        return events.company_channel(accounts.get_company(request).pk)
+    except Company.DoesNotExist:
+        pass
+    try:
+        return events.client_channel(accounts.get_client(request).pk)
+    except Client.DoesNotExist:
+        return None
+
+
+async def appointment_events(request):
+    """Server-sent events of the user's appointments: created, status and
+    deleted. Streams stay open, so this view needs an ASGI server."""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid HTTP method'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        # A WSGI server reads the whole stream before sending any of it.
+        return JsonResponse({'error': 'Event streams need the ASGI server (dawrni.asgi)'}, status=501)
+    try:
+        channel = await sync_to_async(event_channel)(request)
+    except exceptions.AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=401)
+    if channel is None:
+        return JsonResponse({'error': 'No client or company profile for these credentials'}, status=401)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+
+    response = StreamingHttpResponse(events.stream(channel, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def process_metrics(request):
+    """Counters and timings of the process serving the request."""
+    return Response(metrics.snapshot())
+
+
 def privacy_policy(request):
     return render(request, 'dawrni_app/privacy_policy.html')
 
@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration for dawrni, read by ``gunicorn`` from this directory.
+
+The app is served through ASGI on uvicorn workers so the appointment event
+streams (api/events/) stay open without holding a worker each; the view
+answers 501 under a plain WSGI worker.
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = 'dawrni.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Streams still open on reload are cut after this; their clients reconnect
+# with Last-Event-ID.
+graceful_timeout = 30